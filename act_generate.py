@@ -1,13 +1,17 @@
-from dataclasses import dataclass, asdict
+from dataclasses import asdict, dataclass
+import io
 import json
 import os
-import subprocess # для запуска внешних процессов
-from typing import Sequence
+from typing import Any, AsyncIterator, Iterator, Literal, Sequence
 import uuid # для генерации уникальных идентификаторов
 
 from dotenv import find_dotenv, load_dotenv
+from gigachat.exceptions import ResponseError
+from langchain_core.callbacks import BaseCallbackHandler
 # интерфейс для языковых моделей
 from langchain_core.language_models import LanguageModelLike
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, RemoveMessage, ToolMessage
+from langchain_core.outputs import LLMResult
 # конфигурация для запускаемых объектов
 from langchain_core.runnables import RunnableConfig
 # базовый класс и декоратор для инструментов
@@ -15,49 +19,27 @@ from langchain_core.tools import BaseTool, tool
 from langchain_gigachat.chat_models import GigaChat
 # создание агента
 from langgraph.prebuilt import create_react_agent
-# сохранение состояния в памяти
-from langgraph.checkpoint.memory import InMemorySaver
-from mail import fetch_recent_emails
+# сохранение истории диалогов (SQLite или память, с ограничением размера)
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from attachment_text import read_attachment_text
+from checkpoints import default_checkpointer
+from context import ContextManager, ContextState
+from mail import download_email_attachment, fetch_email_headers
+from mail_ranking import describe_candidates, select_candidates
+from models import Customer, Job
+from render import render_document
+from requisites import extract_customer
+from telemetry import Span, annotate, count, start_span, traced
+from upload_cache import UploadCache, model_account, upload_cache, upload_key
+from watcher import Job as PreparedJob, latest_prepared
 
 
 load_dotenv(find_dotenv())
 # PATH_FILE = "ООО_реквизиты_Маркетсистемс.docx"
 
 
-@dataclass
-class Bank:
-    """Банковские реквизиты заказчика"""
-    name: str  # наименование банка
-    current_account: str  # расчётный счёт
-    corporate_account: str  # корреспондентский счёт
-    BIC: str  # БИК банка
-
-
-@dataclass
-class Customer:
-    """Заказчик"""
-    name: str  # полное название юридического лица, наприемер, ООО «Рога и копыта»
-    INN: str  # ИНН
-    KPP: str  # ОГРН или ОГРНИП
-    address: str  # юридический адрес
-    signatory: str  # подписант
-    bank: Bank  # банковские реквизиты заказчика
-
-
-@dataclass
-class Job:
-    task: str  # выполненная задача
-    count: int  # количество
-    unit: str  # единица измерения
-    price: int  # цена за задачу
-    price_total: int  # общая стоимость
-    price_nds: int  # стоимость с НДС
-    price_nds_18: int  # стоимость с НДС 18%
-    price_nds_10: int  # стоимость с НДС 10%
-
-
 @tool
-def generate_pdf_act(customer: Customer, jobs: list[Job]) -> None:
+def generate_pdf_act(customer: Customer, jobs: list[Job]) -> str:
     """
     Генерирует PDF-акт, в котором заполнены данные
     клиента, его банковские реквизиты, а также выполненные задачи
@@ -67,32 +49,17 @@ def generate_pdf_act(customer: Customer, jobs: list[Job]) -> None:
         jobs (list[Job]): список выполненных задач для внесения в акт
 
     Returns:
-        None
+        str: путь к сгенерированному PDF или текст ошибки
     """
-    # Преобразуем объекты в словари
-    act_json = {
-        "customer": asdict(customer),
-        "jobs": list(map(
-            lambda j: asdict(j), jobs
-        ))
-    }
-    # Сохраняем данные в JSON файл
-    with open(os.path.join("C:/Users/smoly/SBER_GIGA/LangChain-and-GigaChat/typst", "act.json"), "w", encoding="utf-8") as f:
-        json.dump(act_json, f, ensure_ascii=False)
-    command = ["typst", "compile", "--root", "./typst", "typst/act.typ"]
-    try:
-        subprocess.run(command,
-                       check=True,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE,
-                       text=True,
-                       encoding="utf-8")
-    except subprocess.CalledProcessError as e:
-        print(e.stderr)
+    result = render_document("act", customer, jobs)
+    if result.error:
+        print(result.error)
+        return f"Не удалось сгенерировать акт: {result.error}"
+    return str(result.pdf_path)
 
 
 @tool
-def generate_pdf_invoice(customer: Customer, jobs: list[Job]) -> None:
+def generate_pdf_invoice(customer: Customer, jobs: list[Job]) -> str:
     """
     Генерирует PDF-счёт, в котором заполнены данные
     клиента, а также выполненные задачи
@@ -102,77 +69,472 @@ def generate_pdf_invoice(customer: Customer, jobs: list[Job]) -> None:
         jobs (list[Job]): список выполненных задач для внесения в акт
 
     Returns:
-        None
+        str: путь к сгенерированному PDF или текст ошибки
     """
-    invoice_json = {
-        "customer": asdict(customer),
-        "jobs": list(map(
-            lambda j: asdict(j), jobs
-        ))
-    }
-    with open(os.path.join("C:/Users/smoly/SBER_GIGA/LangChain-and-GigaChat/typst", "invoice.json"), "w", encoding="utf-8") as f:
-        json.dump(invoice_json, f, ensure_ascii=False)
-    command = ["typst", "compile", "--root", "./typst", "typst/invoice.typ"]
-    try:
-        subprocess.run(command,
-                       check=True,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE, text=True)
-    except subprocess.CalledProcessError as e:
-        print(e.stderr)
+    result = render_document("invoice", customer, jobs)
+    if result.error:
+        print(result.error)
+        return f"Не удалось сгенерировать счёт: {result.error}"
+    return str(result.pdf_path)
+
+
+# Коды ответа GigaChat, с которыми он отвергает несуществующий id файла
+REJECTED_FILE_STATUSES = (400, 404)
+
+
+@dataclass
+class AgentEvent:
+    """Событие потокового ответа агента"""
+    kind: Literal["token", "tool_call", "tool_result"]
+    text: str  # кусок ответа модели или результат инструмента
+    tool: str = ""  # имя инструмента для tool_call и tool_result
+
+
+def _agent_events(item: tuple) -> Iterator[AgentEvent]:
+    """Переводит элемент stream_mode="messages" в события для интерфейса"""
+    message, _ = item
+    if isinstance(message, ToolMessage):
+        yield AgentEvent("tool_result", str(message.content), message.name or "")
+    elif isinstance(message, AIMessage):
+        # у потоковой модели имя инструмента приходит в первом куске вызова,
+        # у непотоковой всё сообщение приходит целиком
+        calls = message.tool_call_chunks if isinstance(message, AIMessageChunk) \
+            else message.tool_calls
+        for call in calls:
+            if call.get("name"):
+                yield AgentEvent("tool_call", "", call["name"])
+        if isinstance(message.content, str) and message.content:
+            yield AgentEvent("token", message.content)
+
+
+def _token_usage(response: LLMResult) -> tuple[int, int]:
+    """Токены запроса и ответа из usage_metadata сообщений модели"""
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            input_tokens += usage.get("input_tokens", 0)
+            output_tokens += usage.get("output_tokens", 0)
+    return input_tokens, output_tokens
+
+
+class AgentTelemetry(BaseCallbackHandler):
+    """
+    Спаны на каждый шаг ReAct-цикла: обращение к модели (с числом токенов)
+    и вызов инструмента. Родитель — спан хода агента (agent.turn)
+    """
+    run_inline = True  # в том же потоке и контексте, что и шаг графа
+
+    def __init__(self):
+        self._spans: dict[Any, Span] = {}  # run_id LangChain → открытый спан
+
+    def _start(self, name: str, run_id: Any, parent_run_id: Any, **attributes: Any) -> None:
+        self._spans[run_id] = start_span(name, parent=self._spans.get(parent_run_id), **attributes)
+
+    def _end(self, run_id: Any, error: BaseException | None = None, **attributes: Any) -> None:
+        if (span := self._spans.pop(run_id, None)) is not None:
+            span.set(**attributes)
+            span.end(error)
+
+    def on_chat_model_start(self, serialized: dict, messages: list[list[BaseMessage]], *,
+                            run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        self._start("agent.model", run_id, parent_run_id,
+                    messages=len(messages[0]) if messages else 0)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: Any, **kwargs: Any) -> None:
+        input_tokens, output_tokens = _token_usage(response)
+        count("llm_tokens", input_tokens, kind="input")
+        count("llm_tokens", output_tokens, kind="output")
+        self._end(run_id, input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized: dict, input_str: str, *,
+                      run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        self._start("agent.tool", run_id, parent_run_id,
+                    tool=(serialized or {}).get("name") or kwargs.get("name", ""))
+
+    def on_tool_end(self, output: Any, *, run_id: Any, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._end(run_id, error)
 
 
 # Класс LLM-агента
 class LLMAgent:
-    def __init__(self, model: LanguageModelLike, tools: Sequence[BaseTool]):
+    """
+    ReAct-агент поверх GigaChat. Без thread_id сообщения идут в сессию
+    по умолчанию; с thread_id (см. new_thread) один агент ведёт много
+    независимых диалогов, а асинхронные методы (ainvoke, astream,
+    aupload_file) позволяют вести их одновременно в одном цикле событий.
+    """
+
+    def __init__(self, model: LanguageModelLike, tools: Sequence[BaseTool],
+                 uploads: UploadCache = upload_cache,
+                 checkpointer: BaseCheckpointSaver | None = None,
+                 thread_id: str | None = None,
+                 context: ContextManager | None = None):
         self._model = model
+        # обрезает и сворачивает историю перед каждым обращением к модели
+        self.context = context or ContextManager(model)
         self._agent = create_react_agent(
             model,
             tools=tools,
-            checkpointer=InMemorySaver())
-        self._config: RunnableConfig = {
-                "configurable": {"thread_id": uuid.uuid4().hex}} # уникальный ID сессии
-
+            checkpointer=checkpointer or default_checkpointer(),
+            state_schema=ContextState,
+            pre_model_hook=self.context)
+        # спаны шагов модели и инструментов (telemetry.py)
+        self._telemetry = AgentTelemetry()
+        # уникальный ID сессии; с тем же thread_id диалог продолжится и после перезапуска
+        self.thread_id = thread_id or self.new_thread()
+        self._config: RunnableConfig = {"configurable": {"thread_id": self.thread_id},
+                                        "callbacks": [self._telemetry]}
+        self._uploads = uploads
+        # id файла → (имя, содержимое), чтобы перезагрузить отвергнутый файл
+        self._uploaded: dict[str, tuple[str, bytes]] = {}
+
+    @staticmethod
+    def new_thread() -> str:
+        """ID для нового независимого диалога с тем же агентом"""
+        return uuid.uuid4().hex
+
+    def _config_for(self, thread_id: str | None) -> RunnableConfig:
+        config = self._config if thread_id is None else \
+            {"configurable": {"thread_id": thread_id}, "callbacks": [self._telemetry]}
+        annotate(thread_id=config["configurable"]["thread_id"])
+        return config
+
+    def _account(self) -> str:
+        return model_account(self._model)
+
+    def _read_file(self, file) -> tuple[str, bytes, str]:
+        """Имя, содержимое и ключ кэша загрузок для файла"""
+        filename = os.path.basename(getattr(file, "name", None) or "file")
+        if file.seekable():  # Streamlit отдаёт тот же объект при каждом перезапуске
+            file.seek(0)
+        data = file.read()
+        return filename, data, upload_key(data, self._account())
+
+    @traced("agent.upload")
     def upload_file(self, file):
-        """Загрузка файла в GigaChat"""
-        file_uploaded_id = self._model.upload_file(file).id_  # type: ignore
+        """Загрузка файла в GigaChat; то же содержимое повторно не загружается"""
+        filename, data, key = self._read_file(file)
+        file_uploaded_id = self._uploads.get(key)
+        annotate(bytes=len(data), cached=file_uploaded_id is not None)
+        if file_uploaded_id is None:
+            file_uploaded_id = self._model.upload_file((filename, data)).id_  # type: ignore
+            self._uploads.put(key, file_uploaded_id)
+        self._uploaded[file_uploaded_id] = (filename, data)
+        return file_uploaded_id
+
+    @traced("agent.upload")
+    async def aupload_file(self, file):
+        """Асинхронная загрузка файла в GigaChat, с тем же кэшем, что и upload_file"""
+        filename, data, key = self._read_file(file)
+        file_uploaded_id = self._uploads.get(key)
+        annotate(bytes=len(data), cached=file_uploaded_id is not None)
+        if file_uploaded_id is None:
+            uploaded = await self._model.aupload_file((filename, data))  # type: ignore
+            file_uploaded_id = uploaded.id_
+            self._uploads.put(key, file_uploaded_id)
+        self._uploaded[file_uploaded_id] = (filename, data)
         return file_uploaded_id
 
+    def _rejected(self, error: ResponseError, attachments: list[str] | None) -> list[str]:
+        """
+        id из кэша, которые мог отвергнуть GigaChat (файл удалён на его стороне);
+        пустой список — ошибка не про вложения, повторять запрос бесполезно
+        """
+        status = error.args[1] if len(error.args) > 1 else None
+        if status not in REJECTED_FILE_STATUSES:
+            return []
+        return [file_id for file_id in attachments or [] if file_id in self._uploaded]
+
+    def _forget_upload(self, file_id: str):
+        """Сбрасывает отвергнутый id и возвращает файл для повторной загрузки"""
+        self._uploads.invalidate(file_id)
+        filename, data = self._uploaded.pop(file_id)
+        file = io.BytesIO(data)
+        file.name = filename
+        return file
+
+    def _reupload(self, attachments: list[str], rejected: list[str]) -> list[str]:
+        return [self.upload_file(self._forget_upload(file_id)) if file_id in rejected
+                else file_id for file_id in attachments]
+
+    async def _areupload(self, attachments: list[str], rejected: list[str]) -> list[str]:
+        return [await self.aupload_file(self._forget_upload(file_id)) if file_id in rejected
+                else file_id for file_id in attachments]
+
+    @staticmethod
+    def _input(content: str, attachments: list[str] | None, temperature: float) -> dict:
+        message: dict = {
+            "role": "user",
+            "content": content,
+            **({"attachments": attachments} if attachments else {}) 
+        }
+        return {
+            "messages": [message],
+            "temperature": temperature
+        }
+
+    @traced("agent.turn")
     def invoke(
         self,
         content: str,
         attachments: list[str] | None = None,
-        temperature: float = 0.1
+        temperature: float = 0.1,
+        thread_id: str | None = None,
     ) -> str:
         """Отправка сообщения агенту"""
-        message: dict = {
-            "role": "user",
-            "content": content,
-            **({"attachments": attachments} if attachments else {}) 
-        }
+        config = self._config_for(thread_id)
+        try:
+            return self._agent.invoke(
+                self._input(content, attachments, temperature),
+                config=config)["messages"][-1].content
+        except ResponseError as error:
+            rejected = self._rejected(error, attachments)
+            if not rejected:
+                raise
+        # id из кэша мог протухнуть на стороне GigaChat: убираем неудачное
+        # сообщение из истории и повторяем его с заново загруженными файлами
+        self._drop_last_turn(config, attachments or [])
+        attachments = self._reupload(attachments or [], rejected)
         return self._agent.invoke(
-            {
-                "messages": [message],
-                "temperature": temperature
-            },
-            config=self._config)["messages"][-1].content
+            self._input(content, attachments, temperature),
+            config=config)["messages"][-1].content
+
+    @traced("agent.turn")
+    async def ainvoke(
+        self,
+        content: str,
+        attachments: list[str] | None = None,
+        temperature: float = 0.1,
+        thread_id: str | None = None,
+    ) -> str:
+        """Асинхронная отправка сообщения агенту в диалог thread_id"""
+        config = self._config_for(thread_id)
+        try:
+            return (await self._agent.ainvoke(
+                self._input(content, attachments, temperature),
+                config=config))["messages"][-1].content
+        except ResponseError as error:
+            rejected = self._rejected(error, attachments)
+            if not rejected:
+                raise
+        await self._adrop_last_turn(config, attachments or [])
+        attachments = await self._areupload(attachments or [], rejected)
+        return (await self._agent.ainvoke(
+            self._input(content, attachments, temperature),
+            config=config))["messages"][-1].content
+
+    @traced("agent.turn")
+    async def astream(
+        self,
+        content: str,
+        attachments: list[str] | None = None,
+        temperature: float = 0.1,
+        thread_id: str | None = None,
+    ) -> AsyncIterator[BaseMessage]:
+        """
+        Отправляет сообщение и отдаёт новые сообщения агента (ответы модели,
+        вызовы инструментов и их результаты) по мере выполнения шагов графа
+        """
+        config = self._config_for(thread_id)
+        yielded = False
+        try:
+            async for message in self._astream_updates(content, attachments, temperature, config):
+                yielded = True
+                yield message
+            return
+        except ResponseError as error:
+            # повторять можно, только если GigaChat отказал на первом же шаге:
+            # иначе вызывающий получит уже отданные сообщения второй раз
+            rejected = [] if yielded else self._rejected(error, attachments)
+            if not rejected:
+                raise
+        await self._adrop_last_turn(config, attachments or [])
+        attachments = await self._areupload(attachments or [], rejected)
+        async for message in self._astream_updates(content, attachments, temperature, config):
+            yield message
+
+    async def _astream_updates(self, content: str, attachments: list[str] | None,
+                               temperature: float, config: RunnableConfig
+                               ) -> AsyncIterator[BaseMessage]:
+        async for update in self._agent.astream(
+                self._input(content, attachments, temperature),
+                config=config, stream_mode="updates"):
+            for node_update in update.values():
+                for message in (node_update or {}).get("messages", []):
+                    yield message
+
+    @traced("agent.turn")
+    def stream(
+        self,
+        content: str,
+        attachments: list[str] | None = None,
+        temperature: float = 0.1,
+        thread_id: str | None = None,
+    ) -> Iterator[AgentEvent]:
+        """
+        Отправляет сообщение и отдаёт ответ по токенам, а между ними —
+        вызовы инструментов и их результаты, как только они случаются
+        """
+        config = self._config_for(thread_id)
+        yielded = False
+        try:
+            for item in self._agent.stream(
+                    self._input(content, attachments, temperature),
+                    config=config, stream_mode="messages"):
+                for event in _agent_events(item):
+                    yielded = True
+                    yield event
+            return
+        except ResponseError as error:
+            # после первого отданного токена повтор задвоил бы вывод
+            rejected = [] if yielded else self._rejected(error, attachments)
+            if not rejected:
+                raise
+        self._drop_last_turn(config, attachments or [])
+        attachments = self._reupload(attachments or [], rejected)
+        for item in self._agent.stream(
+                self._input(content, attachments, temperature),
+                config=config, stream_mode="messages"):
+            yield from _agent_events(item)
+
+    @traced("agent.turn")
+    async def astream_tokens(
+        self,
+        content: str,
+        attachments: list[str] | None = None,
+        temperature: float = 0.1,
+        thread_id: str | None = None,
+    ) -> AsyncIterator[AgentEvent]:
+        """Асинхронный вариант stream для диалога thread_id"""
+        config = self._config_for(thread_id)
+        yielded = False
+        try:
+            async for item in self._agent.astream(
+                    self._input(content, attachments, temperature),
+                    config=config, stream_mode="messages"):
+                for event in _agent_events(item):
+                    yielded = True
+                    yield event
+            return
+        except ResponseError as error:
+            # после первого отданного токена повтор задвоил бы вывод
+            rejected = [] if yielded else self._rejected(error, attachments)
+            if not rejected:
+                raise
+        await self._adrop_last_turn(config, attachments or [])
+        attachments = await self._areupload(attachments or [], rejected)
+        async for item in self._agent.astream(
+                self._input(content, attachments, temperature),
+                config=config, stream_mode="messages"):
+            for event in _agent_events(item):
+                yield event
+
+    @staticmethod
+    def _last_turn(messages: list[BaseMessage], attachments: list[str]) -> list[RemoveMessage]:
+        """Сообщение со старыми вложениями и всё, что после него, — на удаление"""
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].additional_kwargs.get("attachments") == attachments:
+                return [RemoveMessage(id=m.id) for m in messages[index:]]  # type: ignore
+        return []
+
+    def _drop_last_turn(self, config: RunnableConfig, attachments: list[str]) -> None:
+        messages = self._agent.get_state(config).values.get("messages", [])
+        if removed := self._last_turn(messages, attachments):
+            self._agent.update_state(config, {"messages": removed})
+
+    async def _adrop_last_turn(self, config: RunnableConfig, attachments: list[str]) -> None:
+        messages = (await self._agent.aget_state(config)).values.get("messages", [])
+        if removed := self._last_turn(messages, attachments):
+            await self._agent.aupdate_state(config, {"messages": removed})
+
+
+def requisites_source(customer: Customer | None) -> str:
+    """
+    Откуда агенту брать реквизиты контрагента: из уже разобранных
+    локально данных или, если разобрать не удалось, из приложенного файла
+    """
+    if customer is None:
+        return "из приложенного файла"
+    return ("из этих данных, они уже проверены, используй их как есть: "
+            + json.dumps(asdict(customer), ensure_ascii=False))
 
 
 def print_agent_response(llm_response: str) -> None:
     print(f"\033[35m{llm_response}\033[0m")
 
 
+def print_agent_stream(events: Iterator[AgentEvent]) -> None:
+    """Печатает ответ агента по мере генерации, вызовы инструментов — серым"""
+    for event in events:
+        if event.kind == "token":
+            print(f"\033[35m{event.text}\033[0m", end="", flush=True)
+        elif event.kind == "tool_call":
+            print(f"\n\033[90m→ {event.tool}\033[0m", flush=True)
+    print()
+
+
 def get_user_prompt() -> str:
     return input("\nТы: ")
 
 
-def main():
+def confirm_prepared(prepared: PreparedJob) -> bool:
+    """Спрашивает пользователя, та ли это карточка: демон не знает, для кого акт"""
+    print(f"Демон подготовил «{prepared.filename}» из письма «{prepared.subject}» от {prepared.date}")
+    if prepared.customer:
+        print(f"  {prepared.customer['name']}, ИНН {prepared.customer['INN']}")
+    else:
+        print("  реквизиты разберёт агент по файлу")
+    answer = input("Взять реквизиты отсюда? [Д/н]: ").strip().lower()
+    return answer in ("", "д", "да", "y", "yes")
+
+
+def find_customer_file(model: LanguageModelLike) -> tuple[str, Customer | None]:
+    """
+    Файл с реквизитами контрагента и сами реквизиты, если их разобрали
+    правила. Сначала — то, что заранее подготовил демон watcher.py (если
+    пользователь подтвердит), затем вложения-кандидаты из почты и только
+    потом агент.
+    """
+    prepared = latest_prepared()
+    if (prepared is not None and prepared.path and os.path.exists(prepared.path)
+            and confirm_prepared(prepared)):
+        return prepared.path, Customer.from_dict(prepared.customer) if prepared.customer else None
+
+    # вложения отбираются локально: скачиваются и разбираются правилами
+    # только лучшие кандидаты, агент видит их, а не весь ящик
+    candidates = select_candidates(fetch_email_headers())
+    if not candidates:
+        exit("ничего не получилось")
+    for candidate in candidates:
+        if candidate.path and (customer := extract_customer(candidate.path)):
+            return candidate.path, customer
+
     system_prompt = (
-        "Твоя задача найти файл,  содержащий реквизиты компании в одном из"
-        "писем на почте. Найди имя этого файла и выведи его ответом. В ответе"
-        "только имя файла или слово нет, если не нашёл"
+        "Твоя задача найти файл, содержащий реквизиты компании, среди вложений писем "
+        "на почте. Вот вложения, отобранные по темам писем, именам и содержимому файлов, "
+        "самые вероятные первыми:\n"
+        f"{describe_candidates(candidates)}\n"
+        "Выбери подходящее вложение, если оно ещё не скачано — скачай его; если по описанию "
+        "не ясно, прочитай текст скачанного вложения инструментом read_attachment_text. Выведи "
+        "ответом путь к файлу. В ответе только путь к файлу или слово нет, если не нашёл"
     )
+    agent = LLMAgent(model, tools=[download_email_attachment, read_attachment_text])
+    filename = agent.invoke(content=system_prompt)
+    if filename == "нет":
+        exit("ничего не получилось")
+    if not os.path.exists(filename):
+        filename = os.path.join("attachments", filename)
+    return filename, extract_customer(filename)
 
+
+def main():
     model = GigaChat(
         model="GigaChat-2-Max",
         verify_ssl_certs=False,
@@ -184,20 +546,19 @@ def main():
         print(f"upload {filename} to LLM")
         agent.upload_file(open(filename, "rb"))
 
-    agent = LLMAgent(model, tools=[fetch_recent_emails])
-    filename = agent.invoke(content=system_prompt)
-    if filename == "нет":
-        exit("ничего не получилось")
-
+    filename, customer = find_customer_file(model)
 
     agent = LLMAgent(model, tools=[generate_pdf_act,
-                                   generate_pdf_invoice])
-    file_uploaded_id = agent.upload_file(open(f"attachments/{filename}", "rb"))
+                                   generate_pdf_invoice,
+                                   read_attachment_text])
+    # реквизиты сначала разбираются локально, файл в GigaChat загружается,
+    # только если правила не справились (если его уже загрузил watcher.py — id из кэша)
+    attachments = [] if customer else [agent.upload_file(open(filename, "rb"))]
 
     system_prompt = (
         "Твоя задача спросить у пользователя, что он хочет сгенерировать — акт или счёт или оба документа. "
         "Затем нужно сгенерировать акт или счёт, для этого тебе надо взять реквизиты "
-        "контрагента из приложенного файла, а также запроси работы для включения в "
+        f"контрагента {requisites_source(customer)}, а также запроси работы для включения в "
         "акт (наименования задач и их стоимость), работ может быть несколько. "
         "Если пользователь указывает в качестве работы аренда жилья, то для документов берём одну работу, в точности такую "
         "Аренда жилого помещения «Гостевой дом Kalina», стоимостью 5 тыс руб. за сутки и спроси на сколько суток снимают если не указали"
@@ -210,12 +571,11 @@ def main():
         "ставим »."
     )
 
-    agent_response = agent.invoke(content=system_prompt, attachments=[file_uploaded_id])
+    print_agent_stream(agent.stream(content=system_prompt, attachments=attachments))
 
     while (True):
-        # ... передача сообщения агенту ...
-        agent_response = agent.invoke(get_user_prompt())
-        print_agent_response(agent_response)
+        # ... передача сообщения агенту, ответ печатается по мере генерации ...
+        print_agent_stream(agent.stream(get_user_prompt()))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
+from typing import Iterator
+
 import streamlit as st
-from langgraph.checkpoint.memory import InMemorySaver
 from langchain_gigachat.chat_models import GigaChat
-from act_generate import LLMAgent, generate_pdf_act  # <-- импортируй свой класс
+from act_generate import AgentEvent, LLMAgent, generate_pdf_act, requisites_source  # <-- импортируй свой класс
+from requisites import extract_customer
 
 st.set_page_config(page_title="Генератор Акта", layout="wide")
 
@@ -12,15 +14,31 @@ if "agent" not in st.session_state:
         model="GigaChat-2-Max",
         verify_ssl_certs=False
     )
-    st.session_state.agent = LLMAgent(model, tools=[generate_pdf_act])
+    # ID диалога живёт в адресе страницы: после перезапуска сервера
+    # или обновления вкладки история подхватывается из хранилища
+    st.session_state.agent = LLMAgent(model, tools=[generate_pdf_act],
+                                      thread_id=st.query_params.get("thread"))
+    st.query_params["thread"] = st.session_state.agent.thread_id
 
 agent: LLMAgent = st.session_state.agent
 
+
+def stream_markdown(events: Iterator[AgentEvent]) -> Iterator[str]:
+    """Ответ агента кусками для st.write_stream; вызовы инструментов — курсивом"""
+    for event in events:
+        if event.kind == "token":
+            yield event.text
+        elif event.kind == "tool_call":
+            yield f"\n\n_⚙️ {event.tool}…_\n\n"
+
+
 # Загрузка файла
 uploaded_file = st.file_uploader("📄 Загрузите документ с реквизитами (docx)", type=["docx"])
 if uploaded_file:
-    file_id = agent.upload_file(uploaded_file)
-    st.success("Файл загружен!")
+    # реквизиты разбираются локально; в GigaChat файл уходит, только если не получилось
+    customer = extract_customer(uploaded_file)
+    attachments = [] if customer else [agent.upload_file(uploaded_file)]
+    st.success("Реквизиты распознаны!" if customer else "Файл загружен!")
 
 # Ввод пользовательского сообщения
 user_input = st.text_area("✍️ Напишите запрос (например: Сформируй акт)", height=150)
@@ -32,8 +50,8 @@ if st.button("📨 Отправить"):
     elif not user_input.strip():
         st.warning("Введите сообщение.")
     else:
-        with st.spinner("Генерация ответа..."):
-            response = agent.invoke(content=user_input, attachments=[file_id])
-            st.success("Ответ получен!")
-            st.markdown("**Ответ:**")
-            st.write(response)
+        st.markdown("**Ответ:**")
+        # ответ появляется по мере генерации, а не после всего цикла агента
+        content = f"{user_input}\n\nРеквизиты контрагента возьми {requisites_source(customer)}"
+        st.write_stream(stream_markdown(agent.stream(content=content, attachments=attachments)))
+        st.success("Ответ получен!")
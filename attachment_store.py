@@ -0,0 +1,213 @@
+"""
+Хранилище вложений с адресацией по содержимому.
+
+Содержимое каждого вложения лежит один раз в <каталог вложений>/.store/
+под своим sha256, только для чтения. Файлы с человеческими именами в
+каталоге вложений — жёсткие ссылки на эти блобы (или копии, если ФС не
+умеет ссылки). Индекс .store/index.sqlite помнит для каждого хэша размер,
+имена файлов и UID писем, в которых он встречался.
+
+В индекс пишут сразу несколько процессов (act_generate.py, app.py и
+демон watcher.py), поэтому он в SQLite: каждая запись — отдельная
+транзакция, чужие записи не затираются. Для каждого имени запомнены
+размер и время изменения файла: если файл с тех пор изменили или
+заменили, hash_of посчитает хэш заново, а новое вложение с тем же
+именем ляжет рядом, не затирая правки.
+
+Если одни и те же реквизиты присылают много раз, они записываются
+на диск один раз, а по хэшу (hash_of) дальше можно не загружать и
+не разбирать файл повторно.
+"""
+from contextlib import contextmanager
+from functools import lru_cache
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Iterator
+
+from cache import file_hash
+
+
+STORE_DIRECTORY_NAME = ".store"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS names_digest ON names (digest);
+CREATE TABLE IF NOT EXISTS uids (
+    digest TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    PRIMARY KEY (digest, uid)
+);
+"""
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+class _HashingWriter:
+    """Файл, который по ходу записи считает sha256 и размер"""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return self._f.write(data)
+
+
+class AttachmentStore:
+    """Блобы по sha256 плюс индекс имён файлов и писем"""
+
+    def __init__(self, attachments_directory: str | Path):
+        self.directory = Path(attachments_directory)
+        self.store_directory = self.directory / STORE_DIRECTORY_NAME
+        self.store_directory.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.store_directory / "index.sqlite", check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # потоки одного процесса делят соединение, процессы разводит SQLite
+        self._lock = threading.Lock()
+
+    def save(self, filename: str, uid: str, write: Callable[[BinaryIO], object]) -> Path:
+        """
+        Сохраняет вложение *filename* письма *uid*; *write* пишет содержимое
+        в переданный файл (можно кусками). Возвращает путь к файлу с именем.
+
+        Если такое же содержимое уже есть под этим именем, новый файл не
+        появляется; под другим именем — появляется ссылка на тот же блоб.
+        """
+        fd, tmp_name = tempfile.mkstemp(dir=self.store_directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = _HashingWriter(f)
+                write(writer)  # type: ignore[arg-type]
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        digest = writer.digest.hexdigest()
+        blob = self.store_directory / digest
+
+        with self._lock, self._transaction():
+            if self._intact(blob):
+                os.unlink(tmp_name)  # дубликат: содержимое уже есть
+            else:
+                # правка файла по ссылке не должна менять блоб; если блоб всё же
+                # изменили (например, от root), он заменяется свежей копией
+                os.chmod(tmp_name, READ_ONLY)
+                if blob.exists():
+                    os.chmod(blob, stat.S_IWRITE | READ_ONLY)  # Windows не заменяет файлы только для чтения
+                os.replace(tmp_name, blob)
+                info = os.stat(blob)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs (digest, size, mtime_ns) VALUES (?, ?, ?)",
+                    (digest, info.st_size, info.st_mtime_ns))
+            names = self._conn.execute("SELECT path FROM names WHERE digest = ?", (digest,))
+            path = next((Path(name) for (name,) in names.fetchall()
+                         if Path(name).name == filename and self._recorded(name) == digest), None)
+            if path is None:
+                path = self._free_path(filename, uid, digest)
+                self._link(blob, path)
+                self._remember(path, digest)
+            self._conn.execute("INSERT OR IGNORE INTO uids (digest, uid) VALUES (?, ?)", (digest, uid))
+        return path
+
+    def save_bytes(self, filename: str, uid: str, data: bytes) -> Path:
+        return self.save(filename, uid, lambda f: f.write(data))
+
+    def hash_of(self, path: str | Path) -> str:
+        """sha256 файла: из индекса, а для чужих или изменённых файлов — посчитанный заново"""
+        with self._lock:
+            digest = self._recorded(str(path))
+        return digest if digest is not None else file_hash(path)
+
+    def _recorded(self, path: str) -> str | None:
+        """Хэш из индекса, если файл *path* не меняли с тех пор, как его записали"""
+        row = self._conn.execute(
+            "SELECT digest, size, mtime_ns FROM names WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return row[0] if (info.st_size, info.st_mtime_ns) == (row[1], row[2]) else None
+
+    def _intact(self, blob: Path) -> bool:
+        """Блоб есть и не менялся с тех пор, как его записали"""
+        row = self._conn.execute(
+            "SELECT size, mtime_ns FROM blobs WHERE digest = ?", (blob.name,)).fetchone()
+        try:
+            info = os.stat(blob)
+        except FileNotFoundError:
+            return False
+        return row is not None and (info.st_size, info.st_mtime_ns) == tuple(row)
+
+    def _remember(self, path: Path, digest: str) -> None:
+        info = os.stat(path)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO names (path, digest, size, mtime_ns) VALUES (?, ?, ?, ?)",
+            (str(path), digest, info.st_size, info.st_mtime_ns))
+
+    def _free_path(self, filename: str, uid: str, digest: str) -> Path:
+        filepath = self.directory / filename
+        # предотвращаем перезапись файла с другим содержимым (или с правками пользователя)
+        if filepath.exists() and self._recorded(str(filepath)) != digest:
+            base, ext = os.path.splitext(filename)
+            filepath = self.directory / f"{base}_{uid}{ext}"
+        if filepath.exists():
+            self._unlink(filepath)
+        self._conn.execute("DELETE FROM names WHERE path = ?", (str(filepath),))
+        return filepath
+
+    def _unlink(self, path: Path) -> None:
+        try:
+            path.unlink()
+        except PermissionError:  # Windows не удаляет файлы только для чтения
+            row = self._conn.execute("SELECT digest FROM names WHERE path = ?", (str(path),)).fetchone()
+            os.chmod(path, stat.S_IWRITE)
+            path.unlink()
+            # атрибут общий у ссылки и блоба: возвращаем блобу «только чтение»
+            if row is not None and (blob := self.store_directory / row[0]).exists():
+                os.chmod(blob, READ_ONLY)
+
+    @staticmethod
+    def _link(blob: Path, path: Path) -> None:
+        try:
+            os.link(blob, path)
+        except OSError:  # ФС без жёстких ссылок
+            shutil.copyfile(blob, path)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """BEGIN IMMEDIATE … COMMIT: запись в индекс не пересекается с другими процессами"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+
+@lru_cache(maxsize=None)
+def attachment_store(attachments_directory: str) -> AttachmentStore:
+    """Одно хранилище на каталог вложений в пределах процесса"""
+    return AttachmentStore(attachments_directory)
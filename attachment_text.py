@@ -0,0 +1,203 @@
+"""
+Текст вложений (.docx, .pdf, .txt) для правил и для агента.
+
+Раньше каждый разбор реквизитов, ранжирование вложений (mail_ranking.py)
+и демон watcher.py заново распаковывали docx и разбирали PDF — одни и
+те же файлы из attachments/ при каждом запуске. Теперь текст
+извлекается один раз на содержимое файла:
+
+- ключ — sha256 содержимого (для файлов из attachments/ он уже есть в
+  индексе attachment_store.py), расширение и TEXT_FORMAT_VERSION;
+- значение — .txt в .cache/text (DiskCache из cache.py); размер папки
+  ограничен TEXT_CACHE_MAX_MB, вытесняются давно не читанные тексты;
+- неудачные разборы не кэшируются: например, PDF станет читаться,
+  когда поставят pypdf.
+
+Агенту текст доступен инструментом read_attachment_text — вместо
+загрузки файла в GigaChat, когда достаточно прочитать его.
+
+PDF читается, только если установлен пакет pypdf.
+"""
+import io
+import os
+from pathlib import Path
+from typing import BinaryIO
+from xml.etree import ElementTree
+import zipfile
+import zlib
+
+from dotenv import find_dotenv, load_dotenv
+from langchain_core.tools import tool
+
+from attachment_store import STORE_DIRECTORY_NAME, attachment_store
+from cache import DiskCache, content_hash, file_hash
+from telemetry import count
+
+
+load_dotenv(find_dotenv())
+# Кэш извлечённого текста и его предельный размер
+TEXT_CACHE_DIRECTORY = Path(__file__).resolve().parent / ".cache" / "text"
+TEXT_CACHE_MAX_MB = int(os.getenv("TEXT_CACHE_MAX_MB") or 50)
+# Меняется вместе с правилами извлечения текста, чтобы старый кэш не совпадал
+TEXT_FORMAT_VERSION = "1"
+# Расширения, из которых извлекается текст; пустое — файл без расширения
+TEXT_SUFFIXES = (".docx", ".pdf", ".txt", ".csv", "")
+# Папка вложений, из которой агенту можно читать файлы
+ATTACHMENTS_DIRECTORY = "attachments"
+# Сколько символов отдавать агенту за один вызов read_attachment_text
+TEXT_TOOL_MAX_CHARS = 20_000
+
+text_cache = DiskCache(TEXT_CACHE_DIRECTORY, TEXT_CACHE_MAX_MB * 2**20, suffix=".txt")
+
+
+class CantReadDocument(Exception):
+    """Документ не удалось прочитать как текст"""
+
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _docx_paragraph(paragraph: ElementTree.Element) -> str:
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == f"{W}t" and node.text:
+            parts.append(node.text)
+        elif node.tag == f"{W}tab":
+            parts.append("\t")
+        elif node.tag in (f"{W}br", f"{W}cr"):
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _docx_lines(element: ElementTree.Element) -> list[str]:
+    """Абзацы — отдельными строками, строка таблицы — ячейки через табуляцию"""
+    lines = []
+    for child in element:
+        if child.tag == f"{W}p":
+            lines.append(_docx_paragraph(child))
+        elif child.tag == f"{W}tbl":
+            for row in child.iter(f"{W}tr"):
+                cells = [" ".join(_docx_paragraph(p) for p in cell.iter(f"{W}p")).strip()
+                         for cell in row.iter(f"{W}tc")]
+                lines.append("\t".join(cells))
+        elif child.tag == f"{W}sdt":  # блоки «элементов управления содержимым»
+            for content in child.iter(f"{W}sdtContent"):
+                lines.extend(_docx_lines(content))
+    return lines
+
+
+def docx_text(file: str | Path | BinaryIO) -> str:
+    try:
+        with zipfile.ZipFile(file) as archive:
+            root = ElementTree.fromstring(archive.read("word/document.xml"))
+    except OSError as e:
+        raise CantReadDocument(f"не удалось открыть {file}: {e}") from e
+    # битый архив: zipfile бросает не только BadZipFile, но и ошибки распаковки,
+    # а на зашифрованных и экзотически сжатых архивах — RuntimeError и NotImplementedError
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError, zlib.error, EOFError,
+            RuntimeError, NotImplementedError) as e:
+        raise CantReadDocument(f"не docx: {e}") from e
+    body = root.find(f"{W}body")
+    return "\n".join(_docx_lines(body if body is not None else root))
+
+
+def pdf_text(file: str | Path | BinaryIO) -> str:
+    try:
+        from pypdf import PdfReader  # необязательная зависимость, нужна только для PDF
+    except ImportError as e:
+        raise CantReadDocument("для PDF нужен пакет pypdf") from e
+    try:
+        return "\n".join(page.extract_text() or "" for page in PdfReader(file).pages)
+    except Exception as e:  # pypdf бросает много разных исключений на битых файлах
+        raise CantReadDocument(f"не удалось прочитать PDF: {e}") from e
+
+
+def _suffix(file: str | Path | BinaryIO) -> str:
+    name = str(file if isinstance(file, (str, Path)) else getattr(file, "name", ""))
+    return Path(name).suffix.lower()
+
+
+def _parse(source: str | Path | BinaryIO, suffix: str) -> str:
+    if suffix == ".docx":
+        return docx_text(source)
+    if suffix == ".pdf":
+        return pdf_text(source)
+    if suffix in TEXT_SUFFIXES:
+        try:
+            data = Path(source).read_bytes() if isinstance(source, (str, Path)) else source.read()
+        except OSError as e:
+            raise CantReadDocument(f"не удалось прочитать {source}: {e}") from e
+        return data.decode("utf-8", errors="replace")
+    raise CantReadDocument(f"неподдерживаемый формат: {suffix}")
+
+
+def _read_all(file: BinaryIO) -> bytes:
+    if file.seekable():
+        file.seek(0)
+    return file.read()
+
+
+def parse_document(file: str | Path | BinaryIO) -> str:
+    """Текст документа по расширению имени, без кэша; *file* — путь или открытый файл с .name"""
+    suffix = _suffix(file)
+    if not isinstance(file, (str, Path)):
+        file = io.BytesIO(_read_all(file))
+    return _parse(file, suffix)
+
+
+def document_text(file: str | Path | BinaryIO, cache: DiskCache | None = text_cache) -> str:
+    """
+    Текст документа, как parse_document, но извлекается один раз на
+    содержимое: тот же файл под другим именем или из другого письма
+    читается из кэша.
+
+    Любая ошибка чтения (нет файла, нет прав, битый архив) — CantReadDocument,
+    чтобы вызывающий перешёл к агенту, а не упал.
+    """
+    suffix = _suffix(file)
+    if suffix not in TEXT_SUFFIXES:
+        raise CantReadDocument(f"неподдерживаемый формат: {suffix}")
+    if cache is None:
+        return parse_document(file)
+    if isinstance(file, (str, Path)):
+        directory = Path(file).parent
+        # хэш файла из каталога вложений уже есть в индексе хранилища
+        try:
+            digest = (attachment_store(str(directory)).hash_of(file)
+                      if (directory / STORE_DIRECTORY_NAME).is_dir() else file_hash(file))
+        except OSError as e:
+            raise CantReadDocument(f"не удалось прочитать {file}: {e}") from e
+        source: str | Path | BinaryIO = file
+    else:
+        data = _read_all(file)
+        digest, source = content_hash(data), io.BytesIO(data)
+    key = content_hash(TEXT_FORMAT_VERSION, suffix, digest)
+    cached = cache.get(key)
+    count("text_cache_lookups", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached.decode("utf-8")
+    text = _parse(source, suffix)
+    cache.put(key, text.encode("utf-8"))
+    return text
+
+
+@tool
+def read_attachment_text(filename: str, offset: int = 0) -> str:
+    """
+    Возвращает текст скачанного вложения (docx, pdf, txt) из папки вложений,
+    не больше 20000 символов начиная с символа *offset*. Если текст длиннее,
+    в конце ответа указано, с какого *offset* читать дальше.
+    """
+    path = Path(filename)
+    if not path.exists():
+        path = Path(ATTACHMENTS_DIRECTORY) / filename
+    if not path.resolve().is_relative_to(Path(ATTACHMENTS_DIRECTORY).resolve()):
+        return f"Файл {filename} не из папки вложений"
+    try:
+        text = document_text(path)
+    except (CantReadDocument, OSError) as e:
+        return f"Не удалось прочитать {filename}: {e}"
+    end = offset + TEXT_TOOL_MAX_CHARS
+    if end < len(text):
+        return f"{text[offset:end]}\n[продолжение: offset={end} из {len(text)}]"
+    return text[offset:]
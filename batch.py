@@ -0,0 +1,274 @@
+"""
+Пакетная генерация актов и счетов по манифесту — без LLM и без диалога.
+
+Манифест — CSV или JSONL (.json со списком документов тоже подойдёт):
+- JSONL: одна строка — один документ, в том же виде, что typst/act.json:
+  {"id": "kalina-2026-10", "customer": {...}, "jobs": [{...}, ...]}
+- CSV: одна строка — одна работа (task, count, unit, price). Строки с
+  одинаковым значением колонки document (а без неё — с одинаковым ИНН)
+  собираются в один документ. Реквизиты заказчика достаточно заполнить
+  в первой строке документа, колонки банка — с префиксом bank_
+  (bank_name, bank_current_account, bank_corporate_account, bank_BIC).
+  Разделитель (запятая, точка с запятой, табуляция) определяется сам,
+  файл из Excel с BOM тоже читается.
+
+Сначала весь манифест проверяется моделями (models.py): документы с
+ошибками не рендерятся и попадают в отчёт с номером строки. Остальные
+рендерятся параллельно через RenderScheduler; PDF складываются в
+--output как <id>_<вид>.pdf, туда же пишется отчёт report.json.
+
+Запуск из корня проекта:
+    python batch.py tenants.csv --kinds invoice --output documents/2026-10
+    python batch.py tenants.jsonl --check   # только проверить манифест
+"""
+import argparse
+from collections import defaultdict
+import csv
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+import json
+from pathlib import Path
+import re
+import sys
+import time
+from typing import get_args
+
+from models import Customer, InvalidDocumentData, Job
+from render import DocumentKind, RenderScheduler, make_backend
+from totals import VAT_RATES, compute_totals, format_money
+
+
+KINDS: tuple[DocumentKind, ...] = get_args(DocumentKind)
+JOB_COLUMNS = ("task", "count", "unit", "price")
+
+
+class InvalidManifest(Exception):
+    """Манифест не удалось прочитать"""
+
+
+@dataclass
+class ManifestDocument:
+    """Документ из манифеста"""
+    id: str
+    line: int  # строка манифеста, с которой начинается документ
+    customer: Customer | None
+    jobs: list[Job]
+    errors: list[str] = field(default_factory=list)  # пусто — документ можно рендерить
+
+
+@dataclass
+class BatchEntry:
+    """Строка отчёта: один документ одного вида"""
+    id: str
+    line: int
+    kind: DocumentKind | None  # None — документ не прошёл проверку
+    pdf_path: str | None
+    total: str | None  # всего к оплате
+    seconds: float
+    cached: bool
+    error: str | None
+
+
+def _document(document_id: str, line: int, customer: dict,
+              jobs: list[tuple[int, dict]]) -> ManifestDocument:
+    """Собирает документ из сырых данных; ошибки не бросаются, а копятся"""
+    document = ManifestDocument(document_id, line, None, [])
+    try:
+        document.customer = Customer.from_dict(customer)
+    except InvalidDocumentData as e:
+        document.errors.append(f"строка {line}: заказчик: {e}")
+    for job_line, job in jobs:
+        try:
+            document.jobs.append(Job.from_dict(job))
+        except InvalidDocumentData as e:
+            document.errors.append(f"строка {job_line}: работа: {e}")
+    if not jobs:
+        document.errors.append(f"строка {line}: нет работ")
+    return document
+
+
+def _read_jsonl(path: Path) -> list[ManifestDocument]:
+    with open(path, encoding="utf-8-sig") as f:
+        if path.suffix == ".json":
+            items = list(enumerate(json.load(f), start=1))
+        else:
+            items = []
+            for line, text in enumerate(f, start=1):
+                if text.strip():
+                    try:
+                        items.append((line, json.loads(text)))
+                    except json.JSONDecodeError as e:
+                        raise InvalidManifest(f"{path}, строка {line}: {e}") from e
+    documents = []
+    for line, item in items:
+        if not isinstance(item, dict):
+            raise InvalidManifest(f"{path}, строка {line}: ожидается объект документа")
+        jobs = item.get("jobs") or []
+        documents.append(_document(str(item.get("id") or f"{line:04d}"), line,
+                                   item.get("customer") or {},
+                                   [(line, job) for job in jobs]))
+    return documents
+
+
+def _read_csv(path: Path) -> list[ManifestDocument]:
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(8192)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error as e:
+            raise InvalidManifest(f"{path}: не удалось определить разделитель") from e
+        reader = csv.DictReader(f, dialect=dialect)
+        if not reader.fieldnames or not set(JOB_COLUMNS) <= {name.strip() for name in reader.fieldnames}:
+            raise InvalidManifest(f"{path}: нужны колонки {', '.join(JOB_COLUMNS)}")
+        # номер строки файла: заголовок — строка 1
+        rows = [(line, {key.strip(): (value or "").strip() for key, value in row.items() if key})
+                for line, row in enumerate(reader, start=2)]
+
+    groups: dict[str, list[tuple[int, dict]]] = defaultdict(list)
+    for line, row in rows:
+        groups[row.get("document") or row.get("INN") or f"{line:04d}"].append((line, row))
+    documents = []
+    for document_id, group in groups.items():
+        # у каждого поля заказчика берётся первое непустое значение в группе
+        customer: dict = {}
+        for _, row in group:
+            for key, value in row.items():
+                if key not in JOB_COLUMNS and value and key not in customer:
+                    customer[key] = value
+        jobs = [(line, {key: row.get(key) for key in JOB_COLUMNS}) for line, row in group]
+        documents.append(_document(document_id, group[0][0], customer, jobs))
+    return documents
+
+
+def read_manifest(path: str | Path) -> list[ManifestDocument]:
+    """Читает и проверяет манифест; формат — по расширению файла"""
+    path = Path(path)
+    if path.suffix in (".jsonl", ".json"):
+        documents = _read_jsonl(path)
+    elif path.suffix in (".csv", ".tsv", ".txt"):
+        documents = _read_csv(path)
+    else:
+        raise InvalidManifest(f"{path}: поддерживаются .csv и .jsonl")
+    seen: dict[str, int] = {}
+    # разные id могут дать одно имя PDF («a b» и «a_b»), а на Windows и macOS
+    # имена не различают регистр; такой документ затёр бы PDF предыдущего
+    files: dict[str, ManifestDocument] = {}
+    for document in documents:
+        stem = _file_stem(document.id).casefold()
+        if document.id in seen:
+            document.errors.append(
+                f"строка {document.line}: id «{document.id}» уже был в строке {seen[document.id]}")
+        elif stem in files:
+            other = files[stem]
+            document.errors.append(
+                f"строка {document.line}: id «{document.id}» даёт то же имя файла, что и "
+                f"«{other.id}» из строки {other.line}")
+        seen.setdefault(document.id, document.line)
+        files.setdefault(stem, document)
+    return documents
+
+
+def _file_stem(document_id: str) -> str:
+    """Имя PDF без вида документа: всё, кроме букв, цифр, точек и дефисов, — в «_»"""
+    return re.sub(r"[^\w.-]+", "_", document_id).strip("._") or "document"
+
+
+def _file_name(document_id: str, kind: DocumentKind) -> str:
+    return f"{_file_stem(document_id)}_{kind}.pdf"
+
+
+def render_manifest(
+    documents: list[ManifestDocument],
+    kinds: tuple[DocumentKind, ...],
+    output_directory: str | Path,
+    max_workers: int | None = None,
+    backend: str | None = None,
+) -> list[BatchEntry]:
+    """
+    Рендерит все проверенные документы каждого вида из *kinds*;
+    строки отчёта идут в порядке манифеста
+    """
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    entries: list[BatchEntry] = []
+    with RenderScheduler(max_workers, backend=make_backend(backend)) as scheduler:
+        pending = []
+        for document in documents:
+            if document.errors:
+                entries.append(BatchEntry(document.id, document.line, None, None, None,
+                                          0.0, False, "; ".join(document.errors)))
+                continue
+            for kind in kinds:
+                total = compute_totals(document.jobs, VAT_RATES[kind]).total
+                entry = BatchEntry(document.id, document.line, kind, None,
+                                   format_money(total), 0.0, False, None)
+                entries.append(entry)
+                pdf_path = output_directory / _file_name(document.id, kind)
+                pending.append((entry, scheduler.submit(
+                    kind, document.customer, document.jobs, pdf_path)))  # type: ignore[arg-type]
+        for entry, future in pending:
+            result = future.result()
+            entry.seconds = round(result.seconds, 3)
+            entry.cached = result.cached
+            entry.error = result.error
+            entry.pdf_path = str(result.pdf_path) if result.pdf_path else None
+    return entries
+
+
+def write_report(path: Path, manifest: Path, entries: list[BatchEntry], seconds: float) -> dict:
+    report = {
+        "manifest": str(manifest),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seconds": round(seconds, 3),
+        "rendered": sum(entry.kind is not None and entry.error is None for entry in entries),
+        "cached": sum(entry.cached for entry in entries),
+        "failed": sum(entry.kind is not None and entry.error is not None for entry in entries),
+        "invalid": sum(entry.kind is None for entry in entries),
+        "documents": [asdict(entry) for entry in entries],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("manifest", type=Path, help="CSV или JSONL с заказчиками и работами")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS),
+                        help="какие документы делать (по умолчанию акт и счёт)")
+    parser.add_argument("--output", type=Path, default=Path("documents") / "batch")
+    parser.add_argument("--report", type=Path, help="куда писать отчёт (по умолчанию <output>/report.json)")
+    parser.add_argument("--workers", type=int, help="сколько компиляций typst одновременно")
+    parser.add_argument("--backend", choices=("subprocess", "native"), help="как компилировать typst")
+    parser.add_argument("--check", action="store_true", help="только проверить манифест")
+    args = parser.parse_args()
+
+    try:
+        documents = read_manifest(args.manifest)
+    except (InvalidManifest, OSError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    invalid = [document for document in documents if document.errors]
+    for document in invalid:
+        for error in document.errors:
+            print(f"{document.id}: {error}", file=sys.stderr)
+    print(f"документов в манифесте: {len(documents)}, с ошибками: {len(invalid)}")
+    if args.check:
+        return 1 if invalid else 0
+
+    started = time.perf_counter()
+    entries = render_manifest(documents, tuple(args.kinds), args.output, args.workers, args.backend)
+    report_path = args.report or args.output / "report.json"
+    report = write_report(report_path, args.manifest, entries, time.perf_counter() - started)
+    for entry in entries:
+        if entry.kind is not None and entry.error:
+            print(f"{entry.id} ({entry.kind}): {entry.error}", file=sys.stderr)
+    print(f"готово за {report['seconds']} с: отрендерено {report['rendered']} "
+          f"(из кэша {report['cached']}), ошибок рендера {report['failed']}, "
+          f"не прошли проверку {report['invalid']}; отчёт — {report_path}")
+    return 1 if report["failed"] or report["invalid"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
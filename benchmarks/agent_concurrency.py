@@ -0,0 +1,120 @@
+"""
+Пропускная способность LLMAgent: N диалогов по очереди через invoke
+против N одновременных диалогов через ainvoke в одном цикле событий.
+
+Вместо GigaChat — локальная модель с задержкой ответа, имитирующей сеть:
+на каждое сообщение она сначала вызывает инструмент, потом отвечает
+текстом (два обращения к модели на диалог, как в реальном ReAct-цикле).
+
+Запуск из корня проекта:
+    python benchmarks/agent_concurrency.py --conversations 50 --latency 0.2
+"""
+import argparse
+import asyncio
+from pathlib import Path
+import statistics
+import sys
+import time
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun  # noqa: E402
+from langchain_core.language_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+from langchain_core.tools import tool  # noqa: E402
+
+from act_generate import LLMAgent  # noqa: E402
+
+
+@tool
+def lookup_customer(inn: str) -> str:
+    """Находит заказчика по ИНН"""
+    return f"ООО «Заказчик {inn}»"
+
+
+class FakeChatModel(BaseChatModel):
+    """Модель-заглушка: вызов инструмента, затем текстовый ответ"""
+
+    latency: float = 0.2
+    tool_name: str = "lookup_customer"
+    tool_args: dict = {"inn": "7700000000"}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gigachat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _reply(self, messages: list[BaseMessage]) -> ChatResult:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            message = AIMessage(content=f"Готово: {last.content}")
+        else:
+            message = AIMessage(content="", tool_calls=[{
+                "name": self.tool_name, "args": self.tool_args,
+                "id": f"call_{len(messages)}",
+            }])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                  run_manager: CallbackManagerForLLMRun | None = None,
+                  **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                         run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                         **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._reply(messages)
+
+
+def percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 \
+        else values[0]
+
+
+def report(mode: str, latencies: list[float], seconds: float) -> None:
+    print(f"{mode:<14}{len(latencies) / seconds:>12.1f}{percentile(latencies, 50):>9.2f}"
+          f"{percentile(latencies, 95):>9.2f}{seconds:>9.2f}")
+
+
+def run_sequential(agent: LLMAgent, conversations: int) -> None:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(conversations):
+        begin = time.perf_counter()
+        agent.invoke("Сформируй акт", thread_id=agent.new_thread())
+        latencies.append(time.perf_counter() - begin)
+    report("invoke", latencies, time.perf_counter() - started)
+
+
+async def run_concurrent(agent: LLMAgent, conversations: int) -> None:
+    async def conversation() -> float:
+        begin = time.perf_counter()
+        await agent.ainvoke("Сформируй акт", thread_id=agent.new_thread())
+        return time.perf_counter() - begin
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(conversation() for _ in range(conversations)))
+    report("ainvoke", list(latencies), time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа модели, с")
+    args = parser.parse_args()
+
+    agent = LLMAgent(FakeChatModel(latency=args.latency), tools=[lookup_customer])
+    print(f"диалогов: {args.conversations}, задержка модели {args.latency} с")
+    print(f"{'режим':<14}{'диалогов/с':>12}{'p50, с':>9}{'p95, с':>9}{'всего, с':>9}")
+    run_sequential(agent, args.conversations)
+    asyncio.run(run_concurrent(agent, args.conversations))
+
+
+if __name__ == "__main__":
+    main()
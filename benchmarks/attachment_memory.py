@@ -0,0 +1,88 @@
+"""
+Пиковая память при сохранении большого вложения: письмо целиком (RFC822)
+против потокового скачивания вложения по кускам.
+
+Запуск из корня проекта (поднимает локальный IMAP-сервер сам):
+    python benchmarks/attachment_memory.py --size-mb 50
+
+Каждый режим запускается в отдельном процессе, чтобы пиковый RSS
+одного не влиял на другой.
+"""
+import argparse
+from contextlib import redirect_stdout
+from email.message import EmailMessage
+import io
+import os
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imap_server import ImapServer, Mailbox  # noqa: E402
+
+
+def large_message(size_mb: int) -> bytes:
+    message = EmailMessage()
+    message["Subject"] = "Скан договора"
+    message["Date"] = "Mon, 1 Jan 2025 00:00:00 +0000"
+    message.set_content("Во вложении скан.")
+    message.add_attachment(os.urandom(size_mb * 2**20), maintype="application",
+                           subtype="pdf", filename="scan.pdf")
+    return bytes(message)
+
+
+def peak_rss_mb() -> float:
+    # VmHWM сбрасывается при exec, а ru_maxrss наследуется от родителя
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # в Linux — килобайты
+
+
+def child() -> None:
+    """Выполняется в дочернем процессе: скачивает почту и печатает пиковый RSS"""
+    from mail import fetch_emails
+
+    baseline = peak_rss_mb()
+    with tempfile.TemporaryDirectory() as attachments, redirect_stdout(io.StringIO()):
+        fetch_emails(2, attachments, connections=1, incremental=False)
+    print(f"{baseline:.1f} {peak_rss_mb():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    server = ImapServer(Mailbox([large_message(args.size_mb)])).start()
+    env = {
+        **os.environ,
+        "EMAIL_LOGIN": "bench", "EMAIL_PASSWORD": "bench",
+        "EMAIL_IMAP_HOST": "127.0.0.1", "EMAIL_IMAP_PORT": str(server.port),
+        "EMAIL_IMAP_SSL": "0",
+    }
+    print(f"вложение {args.size_mb} МБ")
+    print(f"{'режим':<12}{'RSS до, МБ':>12}{'пик RSS, МБ':>13}{'прирост, МБ':>13}")
+    for mode, threshold in (("RFC822", "100000"), ("потоковый", "0")):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child"],
+            env={**env, "EMAIL_STREAM_THRESHOLD_MB": threshold},
+            check=True, capture_output=True, text=True,
+        ).stdout.split()
+        baseline, peak = map(float, output[-2:])
+        print(f"{mode:<12}{baseline:>12.1f}{peak:>13.1f}{peak - baseline:>13.1f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
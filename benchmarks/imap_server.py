@@ -0,0 +1,325 @@
+"""
+Локальный IMAP-сервер для проверок и замеров mail.py без настоящей почты.
+
+Понимает ровно то подмножество IMAP4rev1, которым пользуется mail.py:
+LOGIN, SELECT, STATUS, UID SEARCH, UID FETCH (RFC822, RFC822.SIZE, ENVELOPE,
+BODYSTRUCTURE, BODY[часть] с диапазоном <начало.длина>), IDLE, NOOP, CLOSE,
+LOGOUT. Письма генерируются синтетически и живут в памяти; *latency*
+добавляет задержку на каждую команду, имитируя сетевой round trip.
+Письма можно добавлять на ходу (Mailbox.append) — клиенты в IDLE
+получат «* N EXISTS».
+
+Запуск отдельно:
+    python benchmarks/imap_server.py --messages 300 --port 1143
+и в .env: EMAIL_IMAP_HOST=127.0.0.1, EMAIL_IMAP_PORT=1143, EMAIL_IMAP_SSL=0
+"""
+import argparse
+import base64
+import email
+import email.policy
+from email.message import EmailMessage, Message
+from email.utils import format_datetime
+from datetime import datetime, timezone
+import re
+import select
+import socketserver
+import threading
+import time
+
+
+def make_message(index: int, attachment_size: int = 20_000) -> bytes:
+    """Письмо с текстом и вложением-реквизитами заданного размера"""
+    message = EmailMessage()
+    message["Subject"] = f"Реквизиты для договора №{index}"
+    message["From"] = f"client{index}@example.com"
+    message["To"] = "me@example.com"
+    message["Date"] = format_datetime(datetime.now(timezone.utc))
+    message.set_content(f"Добрый день! Во вложении реквизиты компании №{index}.")
+    if attachment_size:
+        payload = (f"ИНН 77{index:08d} КПП 7701{index:05d} ".encode() * attachment_size)
+        message.add_attachment(
+            payload[:attachment_size],
+            maintype="application",
+            subtype="vnd.openxmlformats-officedocument.wordprocessingml.document",
+            filename=f"реквизиты_{index}.docx",
+        )
+    return bytes(message)
+
+
+def _quote(value: str | bytes | None) -> bytes:
+    if value is None:
+        return b"NIL"
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return b'"' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+
+
+def _encoded(value: str) -> str:
+    """Не-ASCII строки отдаются в виде RFC 2047, как это делают настоящие серверы"""
+    if value.isascii():
+        return value
+    return f"=?utf-8?b?{base64.b64encode(value.encode()).decode()}?="
+
+
+def _envelope(message: Message) -> bytes:
+    def address(header: str) -> bytes:
+        value = message.get(header)
+        if not value:
+            return b"NIL"
+        mailbox, _, host = str(value).partition("@")
+        return b"((NIL NIL " + _quote(mailbox) + b" " + _quote(host) + b"))"
+
+    return b"(" + b" ".join([
+        _quote(message.get("Date")),
+        _quote(_encoded(str(message.get("Subject", "")))),
+        address("From"), address("From"), address("From"), address("To"),
+        b"NIL", b"NIL", b"NIL", _quote(message.get("Message-ID")),
+    ]) + b")"
+
+
+def _bodystructure(part: Message) -> bytes:
+    if part.is_multipart():
+        children = b"".join(_bodystructure(child) for child in part.get_payload())
+        return b"(" + children + b" " + _quote(part.get_content_subtype()) + b")"
+    params = [
+        item for key, value in part.get_params()[1:]
+        for item in (_quote(key), _quote(_encoded(str(value))))
+    ]
+    body = _part_body(part)
+    fields = [
+        _quote(part.get_content_maintype()), _quote(part.get_content_subtype()),
+        b"(" + b" ".join(params) + b")" if params else b"NIL",
+        b"NIL", b"NIL",
+        _quote(part.get("Content-Transfer-Encoding", "7bit")),
+        b"%d" % len(body),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(b"%d" % body.count(b"\n"))
+    fields.append(b"NIL")  # md5
+    filename = part.get_filename()
+    if filename:
+        fields.append(b"(" + _quote(part.get_content_disposition() or "attachment")
+                      + b" (" + _quote("filename") + b" " + _quote(_encoded(filename)) + b"))")
+    else:
+        fields.append(b"NIL")
+    return b"(" + b" ".join(fields) + b")"
+
+
+def _part_body(part: Message) -> bytes:
+    """Содержимое части в том виде, как оно лежит в письме (до декодирования)"""
+    payload = part.get_payload()
+    return payload.encode("utf-8") if isinstance(payload, str) else bytes(payload)
+
+
+def _find_part(message: Message, section: str) -> Message:
+    """Часть письма по номеру из BODY[...], например "2" или "1.2" """
+    part = message
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != "1":
+            raise KeyError(section)
+    return part
+
+
+_BODY_RE = re.compile(r"BODY(?:\.PEEK)?\[([\d.]+)\](?:<(\d+)\.(\d+)>)?")
+
+
+class Mailbox:
+    """INBOX в памяти: UID → письмо"""
+
+    def __init__(self, messages: list[bytes], uid_validity: int = 1):
+        self.uid_validity = uid_validity
+        self.messages: dict[int, bytes] = {}
+        self._parsed: dict[int, Message] = {}
+        self.lock = threading.Lock()
+        for raw in messages:
+            self.append(raw)
+
+    def append(self, raw: bytes) -> int:
+        with self.lock:
+            uid = max(self.messages, default=0) + 1
+            self.messages[uid] = raw
+            return uid
+
+    def parsed(self, uid: int) -> Message:
+        """Разобранное письмо; разбирается один раз, большие письма разбирать долго"""
+        with self.lock:
+            if uid not in self._parsed:
+                self._parsed[uid] = email.message_from_bytes(
+                    self.messages[uid], policy=email.policy.default)
+            return self._parsed[uid]
+
+    def uids(self) -> list[int]:
+        with self.lock:
+            return sorted(self.messages)
+
+
+def _parse_uid_set(uid_set: str, existing: list[int]) -> list[int]:
+    """'1,3:5,7:*' → список существующих UID"""
+    result = []
+    last = existing[-1] if existing else 0
+    for chunk in uid_set.split(","):
+        if ":" in chunk:
+            start, end = chunk.split(":")
+            low = int(start)
+            high = last if end == "*" else int(end)
+            low, high = min(low, high), max(low, high)
+            result.extend(uid for uid in existing if low <= uid <= high)
+        else:
+            uid = last if chunk == "*" else int(chunk)
+            if uid in existing:
+                result.append(uid)
+    return sorted(set(result))
+
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    server: "ImapServer"
+
+    def send(self, line: bytes) -> None:
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self) -> None:
+        self.send(b"* OK IMAP4rev1 stand-in ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            command, _, args = rest.partition(b" ")
+            handler = getattr(self, f"do_{command.decode().upper()}", None)
+            if handler is None:
+                self.send(tag + b" BAD unknown command")
+                continue
+            if handler(tag, args.decode()) is False:
+                return
+
+    def do_CAPABILITY(self, tag: bytes, args: str) -> None:
+        self.send(b"* CAPABILITY IMAP4rev1 IDLE")
+        self.send(tag + b" OK CAPABILITY completed")
+
+    def do_LOGIN(self, tag: bytes, args: str) -> None:
+        self.send(tag + b" OK LOGIN completed")
+
+    def do_NOOP(self, tag: bytes, args: str) -> None:
+        self.send(tag + b" OK NOOP completed")
+
+    def do_SELECT(self, tag: bytes, args: str) -> None:
+        mailbox = self.server.mailbox
+        uids = mailbox.uids()
+        self.send(f"* {len(uids)} EXISTS".encode())
+        self.send(f"* OK [UIDVALIDITY {mailbox.uid_validity}] UIDs valid".encode())
+        self.send(f"* OK [UIDNEXT {(uids[-1] if uids else 0) + 1}] next UID".encode())
+        self.send(tag + b" OK [READ-WRITE] SELECT completed")
+
+    def do_STATUS(self, tag: bytes, args: str) -> None:
+        mailbox = self.server.mailbox
+        uids = mailbox.uids()
+        self.send(f"* STATUS INBOX (MESSAGES {len(uids)} UIDVALIDITY {mailbox.uid_validity} "
+                  f"UIDNEXT {(uids[-1] if uids else 0) + 1})".encode())
+        self.send(tag + b" OK STATUS completed")
+
+    def do_IDLE(self, tag: bytes, args: str) -> None:
+        self.send(b"+ idling")
+        known = len(self.server.mailbox.uids())
+        while True:
+            exists = len(self.server.mailbox.uids())
+            if exists != known:
+                known = exists
+                self.send(b"* %d EXISTS" % exists)
+            if select.select([self.connection], [], [], 0.05)[0]:
+                line = self.rfile.readline()
+                if line.strip().upper() != b"DONE":
+                    self.send(tag + b" BAD expected DONE")
+                    return
+                self.send(tag + b" OK IDLE terminated")
+                return
+
+    def do_CLOSE(self, tag: bytes, args: str) -> None:
+        self.send(tag + b" OK CLOSE completed")
+
+    def do_LOGOUT(self, tag: bytes, args: str) -> bool:
+        self.send(b"* BYE logging out")
+        self.send(tag + b" OK LOGOUT completed")
+        return False
+
+    def do_UID(self, tag: bytes, args: str) -> None:
+        command, _, rest = args.partition(" ")
+        uids = self.server.mailbox.uids()
+        if command.upper() == "SEARCH":
+            match = re.search(r"UID (\S+)", rest, re.IGNORECASE)
+            found = _parse_uid_set(match.group(1), uids) if match else uids
+            self.send(b"* SEARCH" + b"".join(b" %d" % uid for uid in found))
+            self.send(tag + b" OK SEARCH completed")
+        elif command.upper() == "FETCH":
+            uid_set, _, items = rest.partition(" ")
+            for uid in _parse_uid_set(uid_set, uids):
+                self.send_fetch(uids.index(uid) + 1, uid, items.upper())
+            self.send(tag + b" OK FETCH completed")
+        else:
+            self.send(tag + b" BAD unsupported UID command")
+
+    def send_fetch(self, seq: int, uid: int, items: str) -> None:
+        raw = self.server.mailbox.messages[uid]
+        message = self.server.mailbox.parsed(uid)
+        head = b"* %d FETCH (UID %d" % (seq, uid)
+        literals: list[tuple[bytes, bytes]] = []  # (текст перед литералом, литерал)
+        if "RFC822.SIZE" in items:
+            head += b" RFC822.SIZE %d" % len(raw)
+        if "ENVELOPE" in items:
+            head += b" ENVELOPE " + _envelope(message)
+        if "BODYSTRUCTURE" in items:
+            head += b" BODYSTRUCTURE " + _bodystructure(message)
+        if re.search(r"RFC822(?![.\w])", items):
+            literals.append((b" RFC822", raw))
+        for section, start, length in _BODY_RE.findall(items):
+            body = _part_body(_find_part(message, section))
+            key = b" BODY[%s]" % section.encode()
+            if start:
+                body = body[int(start):int(start) + int(length)]
+                key += b"<%s>" % start.encode()
+            literals.append((key, body))
+        self.wfile.write(head)
+        for key, body in literals:
+            self.wfile.write(key + b" {%d}\r\n" % len(body))
+            self.wfile.write(body)
+        self.send(b")")
+
+
+class ImapServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox: Mailbox, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0):
+        super().__init__((host, port), ImapHandler)
+        self.mailbox = mailbox
+        self.latency = latency
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "ImapServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный IMAP-сервер с синтетическими письмами")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--attachment-size", type=int, default=20_000)
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка на команду, с")
+    args = parser.parse_args()
+
+    mailbox = Mailbox([make_message(i, args.attachment_size) for i in range(args.messages)])
+    server = ImapServer(mailbox, port=args.port, latency=args.latency)
+    print(f"IMAP на 127.0.0.1:{server.port}, писем: {args.messages}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
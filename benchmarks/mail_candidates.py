@@ -0,0 +1,210 @@
+"""
+Поиск карточки предприятия в ящике: все заголовки агенту против
+локального отбора кандидатов (mail_ranking.py), в зависимости от
+размера ящика.
+
+Ящик синтетический, на локальном IMAP-сервере (imap_server.py): счета
+в PDF, фотографии, архивы, договоры в .docx без реквизитов, скан
+«Реквизиты для оплаты.jpg» и одна настоящая карточка (.docx с верными
+реквизитами). В части ящиков у карточки нейтральное имя и тема письма,
+и узнать её можно только по тексту.
+
+- all_headers — как раньше: агент получает заголовки всех писем,
+  выбирает вложение, оно скачивается и разбирается правилами;
+- ranked — заголовки ранжируются локально, лучшие вложения скачиваются
+  и разбираются правилами; агент зовётся, только если правила не
+  справились, и видит только кандидатов.
+
+Модель не вызывается: её время оценивается как
+запросов × --llm-latency + токенов в запросах × --prefill / 1000,
+токены — как в context.py. Всё остальное (IMAP, ранжирование,
+скачивание, разбор) — настоящее.
+
+Запуск из корня проекта:
+    python benchmarks/mail_candidates.py --mailboxes 50 200 1000 --rounds 5
+"""
+import argparse
+from contextlib import redirect_stdout
+from email.message import EmailMessage
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import io
+import os
+from pathlib import Path
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from context import CHARS_PER_TOKEN  # noqa: E402
+from imap_server import ImapServer, Mailbox  # noqa: E402
+from mail import download_attachment, fetch_email_headers  # noqa: E402
+from mail_ranking import CANDIDATES_TOP_K, describe_candidates, select_candidates  # noqa: E402
+from requisites import extract_customer  # noqa: E402
+from requisites_extraction import COMPANIES, LAYOUTS, random_requisites, write_docx  # noqa: E402
+
+
+DOCX = ("application", "vnd.openxmlformats-officedocument.wordprocessingml.document")
+# системный запрос агента, который ищет файл, без списка писем или кандидатов
+SYSTEM_PROMPT_TOKENS = 80
+
+
+def _docx(blocks: list[str | list[str]]) -> bytes:
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "document.docx"
+        write_docx(path, blocks)
+        return path.read_bytes()
+
+
+def _message(subject: str, body: str, sent: datetime,
+             attachments: list[tuple[str, bytes, tuple[str, str]]]) -> bytes:
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = "client@example.com"
+    message["To"] = "me@example.com"
+    message["Date"] = format_datetime(sent)
+    message.set_content(body)
+    for filename, payload, (maintype, subtype) in attachments:
+        message.add_attachment(payload, maintype=maintype, subtype=subtype, filename=filename)
+    return bytes(message)
+
+
+def _noise(rng: random.Random, index: int, sent: datetime) -> bytes:
+    company = rng.choice(COMPANIES)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return _message(f"Счёт №{index} от {company}", "Счёт во вложении.", sent,
+                        [(f"Счёт_на_оплату_{index}.pdf", b"%PDF-1.4\n" + rng.randbytes(30_000),
+                          ("application", "pdf"))])
+    if kind == 1:
+        return _message("Фото с объекта", "Фотографии во вложении.", sent,
+                        [(f"IMG_{index:04d}.jpg", rng.randbytes(200_000), ("image", "jpeg"))])
+    if kind == 2:
+        return _message(f"Документы по проекту {company}", "Архив с документами.", sent,
+                        [("документы.zip", rng.randbytes(100_000), ("application", "zip"))])
+    if kind == 3:
+        return _message(f"Договор аренды №{index}", "Проект договора на согласование.", sent,
+                        [(f"Договор_{index}.docx", _docx([
+                            f"Договор аренды №{index}", "Арендодатель передаёт Арендатору помещение.",
+                            "Реквизиты сторон указаны в приложении 1."]), DOCX)])
+    if kind == 4:
+        return _message("Реквизиты для оплаты", "Скан реквизитов.", sent,
+                        [("Реквизиты для оплаты.jpg", rng.randbytes(150_000), ("image", "jpeg"))])
+    return _message(f"Встреча {index}", "Давайте созвонимся завтра в 11:00.", sent, [])
+
+
+def build_mailbox(size: int, rng: random.Random,
+                  neutral: bool) -> tuple[list[bytes], dict, str]:
+    """Ящик из *size* писем, реквизиты единственной настоящей карточки и имя её файла"""
+    now = datetime.now(timezone.utc)
+
+    def sent() -> datetime:
+        return now - timedelta(hours=rng.uniform(0, 40))
+
+    messages = [_noise(rng, index, sent()) for index in range(size - 1)]
+    requisites = random_requisites(rng)
+    card = _docx(rng.choice(LAYOUTS)(requisites))
+    if neutral:
+        filename, subject = f"{rng.choice(COMPANIES)}.docx", "Документы"
+    else:
+        filename, subject = "Карточка предприятия.docx", f"Реквизиты {requisites['name']}"
+    messages.insert(rng.randrange(size), _message(subject, "Добрый день!", sent(),
+                                                  [(filename, card, DOCX)]))
+    return messages, requisites, filename
+
+
+def model_seconds(requests: int, prompt_tokens: int, args: argparse.Namespace) -> float:
+    return requests * args.llm_latency + prompt_tokens * args.prefill / 1000
+
+
+def all_headers(directory: str, card: str, args: argparse.Namespace) -> dict:
+    """Агент видит все заголовки: запрос → список писем → скачать → ответ"""
+    started = time.perf_counter()
+    headers = fetch_email_headers(2, incremental=False)
+    listing = len(str(headers)) // CHARS_PER_TOKEN
+    # агент безошибочно выбирает карточку; время модели — только оценка
+    uid, part = next((header.uid, attachment.part) for header in headers
+                     for attachment in header.attachments
+                     if attachment.filename == card)
+    extract_customer(download_attachment(uid, part, directory))
+    local = time.perf_counter() - started
+    tokens = SYSTEM_PROMPT_TOKENS * 3 + listing * 2
+    return {"local": local, "model": model_seconds(3, tokens, args), "tokens": tokens,
+            "rules": 0.0, "top1": None, "topk": None}
+
+
+def ranked(directory: str, requisites: dict, args: argparse.Namespace) -> dict:
+    """Локальный отбор: агент нужен, только если правила не разобрали ни одного кандидата"""
+    started = time.perf_counter()
+    candidates = select_candidates(fetch_email_headers(2, incremental=False), directory, args.top_k)
+    customer = None
+    for candidate in candidates:
+        if candidate.path and (customer := extract_customer(candidate.path)):
+            break
+    local = time.perf_counter() - started
+
+    found = customer is not None and customer.INN == requisites["INN"]
+    hits = [candidate.path is not None and (c := extract_customer(candidate.path)) is not None
+            and c.INN == requisites["INN"] for candidate in candidates]
+    if found:
+        tokens, model = 0, 0.0
+    else:
+        # запрос с кандидатами → скачать → ответ
+        tokens = (SYSTEM_PROMPT_TOKENS + len(describe_candidates(candidates)) // CHARS_PER_TOKEN) * 2
+        model = model_seconds(2, tokens, args)
+    return {"local": local, "model": model, "tokens": tokens, "rules": float(found),
+            "top1": float(bool(hits) and hits[0]), "topk": float(any(hits))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mailboxes", type=int, nargs="+", default=[50, 200, 1000],
+                        help="размеры ящиков, писем")
+    parser.add_argument("--rounds", type=int, default=5, help="ящиков каждого размера")
+    parser.add_argument("--top-k", type=int, default=CANDIDATES_TOP_K)
+    parser.add_argument("--neutral", type=float, default=0.3,
+                        help="доля ящиков, где карточку видно только по тексту")
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="время ответа модели, с")
+    parser.add_argument("--prefill", type=float, default=0.1, help="секунд на 1000 токенов запроса")
+    parser.add_argument("--imap-latency", type=float, default=0.0, help="задержка на IMAP-команду, с")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'писем':>6} {'способ':<12}{'токенов':>9}{'локально, с':>13}{'модель, с':>11}"
+          f"{'всего, с':>10}{'без агента':>11}{'top-1':>7}{'top-k':>7}")
+    for size in args.mailboxes:
+        results: dict[str, list[dict]] = {"all_headers": [], "ranked": []}
+        for _ in range(args.rounds):
+            messages, requisites, card = build_mailbox(size, rng, rng.random() < args.neutral)
+            server = ImapServer(Mailbox(messages), latency=args.imap_latency).start()
+            os.environ.update({
+                "EMAIL_LOGIN": "bench", "EMAIL_PASSWORD": "bench",
+                "EMAIL_IMAP_HOST": "127.0.0.1", "EMAIL_IMAP_PORT": str(server.port),
+                "EMAIL_IMAP_SSL": "0",
+            })
+            with redirect_stdout(io.StringIO()):
+                # сервер разбирает письма один раз, прогреваем для обоих способов
+                fetch_email_headers(2, incremental=False)
+            with tempfile.TemporaryDirectory() as directory, redirect_stdout(io.StringIO()):
+                results["all_headers"].append(all_headers(directory, card, args))
+            with tempfile.TemporaryDirectory() as directory, redirect_stdout(io.StringIO()):
+                results["ranked"].append(ranked(directory, requisites, args))
+            server.shutdown()
+
+        for name, runs in results.items():
+            def mean(key: str) -> float:
+                return statistics.mean(run[key] for run in runs)
+
+            def share(key: str) -> str:
+                return "—" if runs[0][key] is None else f"{mean(key):.0%}"
+            print(f"{size:>6} {name:<12}{mean('tokens'):>9.0f}{mean('local'):>13.2f}"
+                  f"{mean('model'):>11.2f}{mean('local') + mean('model'):>10.2f}"
+                  f"{mean('rules'):>11.0%}{share('top1'):>7}{share('topk'):>7}")
+
+
+if __name__ == "__main__":
+    main()
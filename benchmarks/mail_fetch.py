@@ -0,0 +1,59 @@
+"""
+Скорость скачивания почты: по одному письму на запрос через одно
+соединение против пачек UID FETCH через пул соединений. Письма
+разбирают --parse-workers потоков параллельно со скачиванием; «первое
+письмо» — через сколько секунд iter_emails отдал первое письмо.
+
+Запуск из корня проекта (поднимает локальный IMAP-сервер сам):
+    python benchmarks/mail_fetch.py --messages 300 --latency 0.02
+"""
+import argparse
+from contextlib import redirect_stdout
+import io
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imap_server import ImapServer, Mailbox, make_message  # noqa: E402
+from mail import EMAIL_PARSE_WORKERS, iter_emails  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--attachment-size", type=int, default=20_000)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка на команду, с")
+    parser.add_argument("--parse-workers", type=int, default=EMAIL_PARSE_WORKERS,
+                        help="сколько потоков разбирают письма")
+    args = parser.parse_args()
+
+    mailbox = Mailbox([make_message(i, args.attachment_size) for i in range(args.messages)])
+    server = ImapServer(mailbox, latency=args.latency).start()
+    os.environ.update({
+        "EMAIL_LOGIN": "bench", "EMAIL_PASSWORD": "bench",
+        "EMAIL_IMAP_HOST": "127.0.0.1", "EMAIL_IMAP_PORT": str(server.port),
+        "EMAIL_IMAP_SSL": "0",
+    })
+
+    print(f"{'соединений':>10}{'пачка':>7}{'время, с':>10}{'писем/с':>9}{'первое письмо, с':>18}")
+    for connections, batch_size in ((1, 1), (1, 50), (4, 25), (8, 10)):
+        with tempfile.TemporaryDirectory() as attachments:
+            started = time.perf_counter()
+            first, emails = None, 0
+            with redirect_stdout(io.StringIO()):  # iter_emails печатает каждое вложение
+                for _ in iter_emails(2, attachments, connections, batch_size,
+                                     parse_workers=args.parse_workers):
+                    first = first or time.perf_counter() - started
+                    emails += 1
+            seconds = time.perf_counter() - started
+        print(f"{connections:>10}{batch_size:>7}{seconds:>10.2f}{emails / seconds:>9.1f}"
+              f"{first or 0:>18.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
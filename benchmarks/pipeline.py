@@ -0,0 +1,243 @@
+"""
+Замер всего конвейера по этапам: где уходит время от почты до PDF.
+
+Этапы и их заменители:
+- imap_fetch[N] — fetch_emails из mail.py против локального IMAP-сервера
+  (imap_server.py) с синтетическим ящиком на N писем;
+- requisites / requisites_cached — разбор карточки предприятия (.docx)
+  правилами requisites.py, новый файл и тот же файл ещё раз (текст из
+  кэша attachment_text.py);
+- upload / upload_cached — LLMAgent.upload_file в модель-заглушку с задержкой
+  загрузки, новый файл и файл из кэша id;
+- agent_turn — один ход ReAct (вызов инструмента и ответ) в LLMAgent
+  с моделью-заглушкой и историей в SQLite;
+- json_write — сборка данных документа и запись JSON для шаблона;
+- typst_compile — настоящая компиляция акта typst (без кэша PDF);
+- end_to_end — ход агента, в котором модель вызывает generate_pdf_act,
+  и акт рендерится через общий планировщик.
+
+Для каждого этапа печатаются p50/p95/p99 и пропускная способность.
+Результат можно сохранить (--save) и сравнить со старым (--baseline):
+если p50 какого-то этапа вырос больше чем на --tolerance, скрипт
+завершается с кодом 1.
+
+Запуск из корня проекта (нужен typst в PATH):
+    python benchmarks/pipeline.py --rounds 20 --save .cache/pipeline.json
+    python benchmarks/pipeline.py --rounds 20 --baseline .cache/pipeline.json
+"""
+import argparse
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass, field
+import io
+import json
+import os
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import BaseMessage  # noqa: E402
+from langchain_core.outputs import ChatResult  # noqa: E402
+
+from act_generate import LLMAgent, generate_pdf_act  # noqa: E402
+from agent_concurrency import FakeChatModel, lookup_customer, percentile  # noqa: E402
+from checkpoints import BoundedSqliteSaver  # noqa: E402
+from imap_server import ImapServer, Mailbox, make_message  # noqa: E402
+from mail import fetch_emails  # noqa: E402
+from models import Customer, Job  # noqa: E402
+from render import _write_payload, document_payload, make_backend, render_workspace  # noqa: E402
+from requisites import extract_customer  # noqa: E402
+from requisites_extraction import LAYOUTS, random_requisites, write_docx  # noqa: E402
+from upload_cache import UploadCache  # noqa: E402
+
+
+@dataclass
+class Stage:
+    """Замеры одного этапа"""
+    name: str
+    unit: str  # в чём считается пропускная способность
+    seconds: list[float] = field(default_factory=list)
+    units: int = 0
+
+    def run(self, function: Callable[[], Any], units: int = 1) -> Any:
+        started = time.perf_counter()
+        result = function()
+        self.seconds.append(time.perf_counter() - started)
+        self.units += units
+        return result
+
+    def summary(self) -> dict:
+        return {
+            "unit": self.unit,
+            "runs": len(self.seconds),
+            "p50_ms": percentile(self.seconds, 50) * 1000,
+            "p95_ms": percentile(self.seconds, 95) * 1000,
+            "p99_ms": percentile(self.seconds, 99) * 1000,
+            "throughput": self.units / sum(self.seconds),
+        }
+
+
+class PipelineChatModel(FakeChatModel):
+    """
+    Модель-заглушка по сценарию настоящего агента: вызывает generate_pdf_act
+    с реквизитами и работами, затем отвечает текстом. Цена меняется от
+    вызова к вызову, а в названии работы — метка запуска, чтобы акт не
+    брался из кэша PDF ни в этом запуске, ни после предыдущих.
+    """
+    tool_name: str = "generate_pdf_act"
+    upload_latency: float = 0.05
+    customer: dict = {}
+    calls: int = 0
+    run: str = ""
+
+    def _reply(self, messages: list[BaseMessage]) -> ChatResult:
+        self.calls += 1
+        self.tool_args = {"customer": self.customer, "jobs": [
+            {"task": f"Аренда жилого помещения {self.run}", "count": 2, "unit": "сутки",
+             "price": 5000 + self.calls},
+        ]}
+        return super()._reply(messages)
+
+    def upload_file(self, file: tuple[str, bytes]) -> SimpleNamespace:
+        time.sleep(self.upload_latency)
+        return SimpleNamespace(id_=f"file-{self.calls}-{len(file[1])}")
+
+
+def sample_customer(rng: random.Random) -> dict:
+    """Заказчик в том виде, в каком модель передаёт его в generate_pdf_act"""
+    return asdict(Customer.from_dict(random_requisites(rng)))
+
+
+def bench_imap(stages: dict[str, Stage], sizes: list[int], rounds: int, latency: float) -> None:
+    for size in sizes:
+        server = ImapServer(Mailbox([make_message(i) for i in range(size)]), latency=latency).start()
+        os.environ.update({
+            "EMAIL_LOGIN": "bench", "EMAIL_PASSWORD": "bench",
+            "EMAIL_IMAP_HOST": "127.0.0.1", "EMAIL_IMAP_PORT": str(server.port),
+            "EMAIL_IMAP_SSL": "0",
+        })
+        stage = stages.setdefault(f"imap_fetch[{size}]", Stage(f"imap_fetch[{size}]", "писем"))
+        for _ in range(rounds):
+            # каждый раз новая папка, иначе инкрементальный режим ничего не скачает
+            with tempfile.TemporaryDirectory() as attachments, redirect_stdout(io.StringIO()):
+                stage.run(lambda: fetch_emails(2, attachments), units=size)
+        server.shutdown()
+
+
+def bench_requisites(stages: dict[str, Stage], rng: random.Random, rounds: int,
+                     directory: Path) -> None:
+    stage, cached = Stage("requisites", "документов"), Stage("requisites_cached", "документов")
+    for index in range(rounds):
+        path = directory / f"card_{index}.docx"
+        write_docx(path, LAYOUTS[index % len(LAYOUTS)](random_requisites(rng)))
+        stage.run(lambda: extract_customer(path))
+        cached.run(lambda: extract_customer(path))
+    stages.update({"requisites": stage, "requisites_cached": cached})
+
+
+def bench_agent(stages: dict[str, Stage], customer: dict, rounds: int, llm_latency: float,
+                upload_latency: float, directory: Path) -> None:
+    model = PipelineChatModel(latency=llm_latency, upload_latency=upload_latency, customer=customer,
+                              run=uuid.uuid4().hex[:8])
+    checkpointer = BoundedSqliteSaver.from_path(directory / "checkpoints.sqlite")
+    uploads = UploadCache(directory / "uploads.sqlite")
+
+    agent = LLMAgent(model, tools=[generate_pdf_act], uploads=uploads, checkpointer=checkpointer)
+    upload, cached = Stage("upload", "файлов"), Stage("upload_cached", "файлов")
+    for index in range(rounds):
+        data = f"карточка предприятия №{index}".encode() * 1000
+        upload.run(lambda: agent.upload_file(io.BytesIO(data)))
+        cached.run(lambda: agent.upload_file(io.BytesIO(data)))
+    stages.update({"upload": upload, "upload_cached": cached})
+
+    turn = stages["agent_turn"] = Stage("agent_turn", "ходов")
+    simple = LLMAgent(FakeChatModel(latency=llm_latency), tools=[lookup_customer],
+                      uploads=uploads, checkpointer=checkpointer)
+    for _ in range(rounds):
+        turn.run(lambda: simple.invoke("Найди заказчика", thread_id=simple.new_thread()))
+
+    end_to_end = stages["end_to_end"] = Stage("end_to_end", "актов")
+    for _ in range(rounds):
+        with redirect_stdout(io.StringIO()):
+            answer = end_to_end.run(lambda: agent.invoke("Сформируй акт", thread_id=agent.new_thread()))
+        if not answer.endswith(".pdf"):
+            raise SystemExit(f"end_to_end: акт не сгенерирован: {answer}")
+        # акт лёг в documents/ рядом с настоящими, после замера он не нужен
+        Path(answer.removeprefix("Готово: ")).unlink(missing_ok=True)
+
+
+def bench_render(stages: dict[str, Stage], customer: dict, rounds: int, backend_name: str | None) -> None:
+    backend = make_backend(backend_name)
+    write, compile_ = Stage("json_write", "документов"), Stage("typst_compile", "документов")
+    with render_workspace() as workspace:
+        for index in range(rounds):
+            jobs = [Job("Аренда жилого помещения", 2, "сутки", 5000 + index)]
+            data_path, pdf_path = workspace / f"{index}.json", workspace / f"{index}.pdf"
+            write.run(lambda: _write_payload(
+                data_path, document_payload("act", Customer.from_dict(customer), jobs)))
+            compile_.run(lambda: backend.compile("act", data_path, pdf_path))
+    stages.update({"json_write": write, "typst_compile": compile_})
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Этапы, у которых p50 вырос больше чем на tolerance относительно baseline"""
+    regressions = []
+    for name, stage in results.items():
+        old = baseline.get(name)
+        if old and stage["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {old['p50_ms']:.1f} → {stage['p50_ms']:.1f} мс")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=20, help="сколько замеров на этап")
+    parser.add_argument("--mailboxes", type=int, nargs="+", default=[10, 100, 500],
+                        help="размеры синтетических ящиков, писем")
+    parser.add_argument("--imap-latency", type=float, default=0.0, help="задержка на IMAP-команду, с")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="задержка ответа модели, с")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="задержка загрузки файла, с")
+    parser.add_argument("--backend", choices=("subprocess", "native"), help="бэкенд typst")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=Path, help="сохранить результат в JSON")
+    parser.add_argument("--baseline", type=Path, help="сравнить с сохранённым результатом")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="допустимый рост p50 относительно --baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    customer = sample_customer(rng)
+    stages: dict[str, Stage] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        bench_imap(stages, args.mailboxes, args.rounds, args.imap_latency)
+        bench_requisites(stages, rng, args.rounds, Path(directory))
+        bench_render(stages, customer, args.rounds, args.backend)
+        bench_agent(stages, customer, args.rounds, args.llm_latency, args.upload_latency,
+                    Path(directory))
+
+    results = {name: stage.summary() for name, stage in stages.items()}
+    print(f"{'этап':<18}{'замеров':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}  пропускная способность")
+    for name, result in results.items():
+        print(f"{name:<18}{result['runs']:>8}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}  {result['throughput']:.1f} {result['unit']}/с")
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")),
+                              args.tolerance)
+        for regression in regressions:
+            print(f"замедление: {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Размер запроса к модели по ходам диалога: вся история против
+обрезки результатов инструментов и сворачивания старых ходов.
+
+На каждый ход модель-заглушка вызывает инструмент, который, как
+fetch_recent_email_headers, возвращает длинный список писем, и
+затем отвечает. Токены оцениваются так же, как в context.py.
+Первый ход, как в act_generate.main, — постановка задачи; скрипт
+проверяет, что она остаётся в каждом запросе и после сокращения
+истории, и завершается с кодом 1, если нет.
+
+Запуск из корня проекта:
+    python benchmarks/prompt_size.py --turns 30 --budget 4000
+"""
+import argparse
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import BaseMessage  # noqa: E402
+from langchain_core.outputs import ChatResult  # noqa: E402
+from langchain_core.tools import tool  # noqa: E402
+
+from act_generate import LLMAgent  # noqa: E402
+from agent_concurrency import FakeChatModel  # noqa: E402
+from checkpoints import BoundedMemorySaver  # noqa: E402
+from context import ContextManager  # noqa: E402
+
+
+INSTRUCTIONS = ("Твоя задача спросить у пользователя, что он хочет сгенерировать — акт или счёт. "
+                "Реквизиты контрагента возьми из приложенного файла.")
+
+
+class RecordingChatModel(FakeChatModel):
+    """Модель-заглушка, которая запоминает, есть ли в запросе постановка задачи"""
+    with_instructions: list[bool] = []
+
+    def _reply(self, messages: list[BaseMessage]) -> ChatResult:
+        self.with_instructions.append(any(m.content == INSTRUCTIONS for m in messages))
+        return super()._reply(messages)
+
+
+@tool
+def list_emails(days: int) -> str:
+    """Список писем за последние дни"""
+    return "\n".join(
+        f"UID {uid}: «Реквизиты для договора №{uid}», вложение реквизиты_{uid}.docx, 20 КБ"
+        for uid in range(60))
+
+
+def run(context: ContextManager, turns: int) -> tuple[list[int], list[bool]]:
+    """Размер запроса на каждый ход и, для каждого запроса, есть ли в нём постановка задачи"""
+    model = RecordingChatModel(latency=0, tool_name="list_emails", tool_args={"days": 2},
+                               with_instructions=[])
+    agent = LLMAgent(model, [list_emails], checkpointer=BoundedMemorySaver(max_messages=10_000),
+                     context=context)
+    thread_id = agent.new_thread()
+    agent.invoke(INSTRUCTIONS, thread_id=thread_id)
+    for turn in range(1, turns):
+        agent.invoke(f"Ход {turn}: найди письмо с реквизитами и добавь работу «Разработка» за 10 000 руб.",
+                     thread_id=thread_id)
+    # две записи на ход: до вызова инструмента и после; берём самую большую
+    stats = list(context.stats)
+    return ([max(stats[2 * turn].prompt_tokens, stats[2 * turn + 1].prompt_tokens)
+             for turn in range(turns)], model.with_instructions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--budget", type=int, default=4000, help="AGENT_CONTEXT_TOKENS")
+    parser.add_argument("--tool-result-chars", type=int, default=500)
+    args = parser.parse_args()
+
+    full, _ = run(ContextManager(max_tokens=0, tool_result_chars=0), args.turns)
+    context = ContextManager(FakeChatModel(latency=0), max_tokens=args.budget,
+                             tool_result_chars=args.tool_result_chars)
+    managed, with_instructions = run(context, args.turns)
+    print(f"{'ход':>4}{'вся история':>13}{'с обрезкой':>12}")
+    for turn, (before, after) in enumerate(zip(full, managed), start=1):
+        print(f"{turn:>4}{before:>13}{after:>12}")
+    print(f"{'всего':>4}{sum(full):>13}{sum(managed):>12}")
+
+    cut = sum(stats.summarized_messages for stats in context.stats)
+    print(f"свёрнуто сообщений: {cut}")
+    if not all(with_instructions):
+        raise SystemExit(f"постановка задачи пропала из {with_instructions.count(False)} "
+                         f"запросов из {len(with_instructions)}")
+
+
+if __name__ == "__main__":
+    main()
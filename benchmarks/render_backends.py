@@ -0,0 +1,61 @@
+"""
+Сравнение бэкендов компиляции: `typst compile` в отдельном процессе
+против компилятора внутри процесса (Python-биндинги typst).
+
+Запуск из корня проекта:
+    python benchmarks/render_backends.py --documents 50
+
+Кэш PDF отключён, чтобы мерить именно компиляцию.
+"""
+import argparse
+import json
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import Customer, Job  # noqa: E402
+from render import TYPST_DIRECTORY, RenderScheduler, make_backend  # noqa: E402
+
+
+def sample_document() -> tuple[Customer, list[Job]]:
+    """Документ из примера typst/act.json"""
+    with open(TYPST_DIRECTORY / "act.json", encoding="utf-8") as f:
+        data = json.load(f)
+    return Customer.from_dict(data["customer"]), [Job.from_dict(job) for job in data["jobs"]]
+
+
+def measure(backend_name: str, kind: str, documents: int) -> list[float]:
+    """Последовательно рендерит документы и возвращает время каждого"""
+    customer, jobs = sample_document()
+    scheduler = RenderScheduler(max_workers=1, cache=None, backend=make_backend(backend_name))
+    with scheduler, tempfile.TemporaryDirectory() as output:
+        seconds = []
+        for index in range(documents):
+            result = scheduler.submit(kind, customer, jobs, Path(output) / f"{index}.pdf").result()
+            if result.error:
+                raise SystemExit(f"{backend_name}: {result.error}")
+            seconds.append(result.seconds)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--kind", choices=("act", "invoice"), default="act")
+    parser.add_argument("--backends", nargs="+", default=["subprocess", "native"])
+    args = parser.parse_args()
+
+    print(f"{'бэкенд':<12}{'первый, мс':>12}{'p50, мс':>10}{'p95, мс':>10}{'док/с':>8}")
+    for name in args.backends:
+        seconds = measure(name, args.kind, args.documents)
+        warm = seconds[1:] or seconds
+        p95 = statistics.quantiles(warm, n=20)[-1] if len(warm) > 1 else warm[0]
+        print(f"{name:<12}{seconds[0] * 1000:>12.1f}{statistics.median(warm) * 1000:>10.1f}"
+              f"{p95 * 1000:>10.1f}{len(seconds) / sum(seconds):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
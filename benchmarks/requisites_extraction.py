@@ -0,0 +1,223 @@
+"""
+Скорость и точность извлечения реквизитов правилами (requisites.py)
+на корпусе карточек предприятий.
+
+По умолчанию корпус генерируется: .docx с разной вёрсткой (таблица
+«поле — значение», строки абзацами, всё в одну строку, ИП с ОГРНИП)
+и корректными контрольными суммами, ответы известны заранее.
+Можно указать папку с настоящими карточками — тогда печатается,
+какие поля нашлись в каждом файле.
+
+Запуск из корня проекта:
+    python benchmarks/requisites_extraction.py --documents 200
+    python benchmarks/requisites_extraction.py --corpus attachments/
+"""
+import argparse
+import random
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+import zipfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from attachment_text import parse_document  # noqa: E402
+from requisites import REQUIRED_FIELDS, find_requisites  # noqa: E402
+
+
+SURNAMES = ["Иванов", "Петрова", "Смирнов", "Кузнецова", "Соколов", "Римский-Корсаков"]
+NAMES = ["Андрей", "Мария", "Олег", "Елена", "Пётр", "Ирина"]
+PATRONYMICS = ["Евгеньевич", "Игоревна", "Сергеевич", "Павловна", "Олегович", "Андреевна"]
+COMPANIES = ["Ромашка", "Маркетсистемс", "Северный ветер", "Техностиль", "Альфа-Строй"]
+BANKS = ["ПАО Сбербанк", "АО «Альфа-Банк»", "Банк ВТБ (ПАО)", "АО «Тинькофф Банк»"]
+STREETS = ["ул. Гагарина, д. 142", "пр-т Мира, д. 5, оф. 12", "ул. Серова, 25"]
+
+
+def _check_digit(digits: str, weights: list[int]) -> str:
+    return str(sum(int(d) * w for d, w in zip(digits, weights)) % 11 % 10)
+
+
+def random_inn(rng: random.Random, individual: bool) -> str:
+    if individual:
+        inn = "".join(rng.choice("0123456789") for _ in range(10))
+        inn += _check_digit(inn, [7, 2, 4, 10, 3, 5, 9, 4, 6, 8])
+        return inn + _check_digit(inn, [3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8])
+    inn = "".join(rng.choice("0123456789") for _ in range(9))
+    return inn + _check_digit(inn, [2, 4, 10, 3, 5, 9, 4, 6, 8])
+
+
+def random_account(rng: random.Random, prefix: str, key_prefix: str) -> str:
+    """Счёт с правильным контрольным ключом (9-я цифра) относительно БИК"""
+    account = prefix + "".join(rng.choice("0123456789") for _ in range(20 - len(prefix)))
+    account = account[:8] + "0" + account[9:]
+    key = key_prefix + account
+    total = sum(int(d) * (7, 1, 3)[i % 3] for i, d in enumerate(key))
+    # у контрольной цифры вес 3, а 3 * 7 ≡ 1 (mod 10)
+    return account[:8] + str(-total * 7 % 10) + account[9:]
+
+
+def random_requisites(rng: random.Random) -> dict[str, str]:
+    individual = rng.random() < 0.2
+    surname, name, patronymic = rng.choice(SURNAMES), rng.choice(NAMES), rng.choice(PATRONYMICS)
+    bic = "04" + "".join(rng.choice("0123456789") for _ in range(7))
+    return {
+        "name": (f"ИП {surname} {name} {patronymic}" if individual
+                 else f"ООО «{rng.choice(COMPANIES)}»"),
+        "INN": random_inn(rng, individual),
+        "KPP": ("".join(rng.choice("0123456789") for _ in range(15)) if individual
+                else "77" + "".join(rng.choice("0123456789") for _ in range(7))),
+        "address": f"г. Москва, {rng.choice(STREETS)}",
+        "signatory": f"{surname} {name[0]}.{patronymic[0]}.",
+        "full_signatory": f"{surname} {name} {patronymic}",
+        "bank_name": rng.choice(BANKS),
+        "bank_BIC": bic,
+        "bank_current_account": random_account(rng, "40702810", bic[-3:]),
+        "bank_corporate_account": random_account(rng, "30101810", "0" + bic[4:6]),
+    }
+
+
+def layout_table(r: dict[str, str]) -> list[str | list[str]]:
+    long_name = r["name"].replace("ООО", "Общество с ограниченной ответственностью")
+    kpp_label = "ОГРНИП" if r["name"].startswith("ИП") else "КПП"
+    return [
+        "Карточка предприятия",
+        ["Полное наименование", long_name],
+        ["ИНН", r["INN"]], [kpp_label, r["KPP"]],
+        ["Юридический адрес", r["address"]],
+        ["Почтовый адрес", "а/я 15"],
+        ["Расчётный счёт", r["bank_current_account"]],
+        ["Банк", r["bank_name"]],
+        ["Корр. счёт", r["bank_corporate_account"]],
+        ["БИК", r["bank_BIC"]],
+        ["Генеральный директор", r["full_signatory"]],
+    ]
+
+
+def layout_lines(r: dict[str, str]) -> list[str | list[str]]:
+    kpp_label = "ОГРНИП" if r["name"].startswith("ИП") else "КПП"
+    account = " ".join(r["bank_current_account"][i:i + 4] for i in range(0, 20, 4))
+    surname, initials = r["signatory"].split(" ")
+    return [
+        f"Реквизиты {r['name']}",
+        f"ИНН: {r['INN']}  {kpp_label}: {r['KPP']}",
+        f"Адрес: {r['address']}",
+        f"Р/с № {account}",
+        f"Наименование банка: {r['bank_name']}",
+        f"К/с: {r['bank_corporate_account']}",
+        f"БИК: {r['bank_BIC']}",
+        f"Директор — {initials} {surname}",
+    ]
+
+
+def layout_inline(r: dict[str, str]) -> list[str | list[str]]:
+    kpp = f"ИНН/КПП {r['INN']}/{r['KPP']}" if not r["name"].startswith("ИП") \
+        else f"ИНН {r['INN']}, ОГРНИП {r['KPP']}"
+    return [
+        f"{r['name']}, {kpp}, юр. адрес: {r['address']}",
+        f"р/с {r['bank_current_account']} в {r['bank_name']}, к/с {r['bank_corporate_account']}, "
+        f"БИК {r['bank_BIC']}",
+        f"Руководитель: {r['full_signatory']}",
+    ]
+
+
+LAYOUTS = [layout_table, layout_lines, layout_inline]
+
+
+def write_docx(path: Path, blocks: list[str | list[str]]) -> None:
+    def paragraph(text: str) -> str:
+        return f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(text)}</w:t></w:r></w:p>"
+
+    body = []
+    rows = []
+    for block in blocks + [""]:
+        if isinstance(block, list):
+            rows.append("<w:tr>" + "".join(f"<w:tc>{paragraph(cell)}</w:tc>" for cell in block)
+                        + "</w:tr>")
+            continue
+        if rows:
+            body.append("<w:tbl>" + "".join(rows) + "</w:tbl>")
+            rows = []
+        body.append(paragraph(block))
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{''.join(body)}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'))
+        archive.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/></Relationships>'))
+        archive.writestr("word/document.xml", document)
+
+
+def percentile(values: list[float], q: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 \
+        else values[0]
+
+
+def run_generated(documents: int, seed: int) -> None:
+    rng = random.Random(seed)
+    seconds = []
+    correct = {field: 0 for field in REQUIRED_FIELDS}
+    complete = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(documents):
+            expected = random_requisites(rng)
+            path = Path(directory) / f"реквизиты_{index}.docx"
+            write_docx(path, LAYOUTS[index % len(LAYOUTS)](expected))
+            started = time.perf_counter()
+            found = find_requisites(parse_document(path))
+            seconds.append(time.perf_counter() - started)
+            matched = [field for field in REQUIRED_FIELDS if found.get(field) == expected[field]]
+            for field in matched:
+                correct[field] += 1
+            complete += len(matched) == len(REQUIRED_FIELDS)
+
+    print(f"документов: {documents}, разобрано полностью и верно: {complete} "
+          f"({complete / documents:.0%})")
+    print(f"время на документ: p50 {percentile(seconds, 50) * 1000:.2f} мс, "
+          f"p95 {percentile(seconds, 95) * 1000:.2f} мс")
+    for field in REQUIRED_FIELDS:
+        print(f"  {field:<24}{correct[field] / documents:>6.0%}")
+
+
+def run_corpus(directory: Path) -> None:
+    paths = sorted(p for p in directory.iterdir() if p.suffix.lower() in (".docx", ".pdf", ".txt"))
+    for path in paths:
+        started = time.perf_counter()
+        try:
+            found = find_requisites(parse_document(path))
+        except Exception as e:
+            print(f"{path.name}: {e}")
+            continue
+        missing = [field for field in REQUIRED_FIELDS if field not in found]
+        status = "все поля" if not missing else "нет: " + ", ".join(missing)
+        print(f"{path.name}: {(time.perf_counter() - started) * 1000:.1f} мс, {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--corpus", type=Path, help="папка с настоящими карточками предприятий")
+    args = parser.parse_args()
+    if args.corpus:
+        run_corpus(args.corpus)
+    else:
+        run_generated(args.documents, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Пропись сумм: Python (ru_numbers.py) против Typst (typst/ru-numbers.typ).
+
+1. Сверка: одни и те же числа прописываются обеими реализациями, Typst —
+   через `typst query`; все числа 0–99 999 плюс случайные меньше 10¹²,
+   то есть до сотен миллиардов (триллионов ru-numbers.typ не умеет).
+2. Скорость компиляции документа, в котором пропись считает шаблон,
+   и документа с готовыми строками.
+3. Стоимость прописи в Python без кэша и с ним.
+
+Запуск из корня проекта (нужен typst в PATH):
+    python benchmarks/ru_numbers.py --random 20000 --runs 20
+"""
+import argparse
+import json
+from pathlib import Path
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from render import TYPST_DIRECTORY, render_workspace  # noqa: E402
+from ru_numbers import rubles_in_words, ru_words  # noqa: E402
+
+
+# пропись считает шаблон, как было раньше
+TYPST_WORDS = """#import "/ru-numbers.typ": ru-words
+#let amounts = json("amounts.json")
+#for n in amounts [#ru-words(n) рублей 00 коп. #parbreak()]
+"""
+# шаблон печатает готовые строки
+PYTHON_WORDS = """#let amounts = json("words.json")
+#for words in amounts [#words 00 коп. #parbreak()]
+"""
+QUERY = """#import "/ru-numbers.typ": ru-words
+#metadata(json("numbers.json").map(ru-words)) <words>
+"""
+
+
+def typst(*args: str) -> str:
+    result = subprocess.run(["typst", *args], check=True, capture_output=True,
+                            text=True, encoding="utf-8")
+    return result.stdout
+
+
+def typst_words(workspace: Path, numbers: list[int]) -> list[str]:
+    (workspace / "numbers.json").write_text(json.dumps(numbers))
+    (workspace / "query.typ").write_text(QUERY, encoding="utf-8")
+    output = typst("query", "--root", str(TYPST_DIRECTORY), str(workspace / "query.typ"),
+                   "<words>", "--field", "value", "--one")
+    return json.loads(output)
+
+
+def check(workspace: Path, random_numbers: int) -> None:
+    numbers = list(range(100_000)) + [random.randrange(10 ** 12) for _ in range(random_numbers)]
+    started = time.perf_counter()
+    expected = typst_words(workspace, numbers)
+    mismatches = [(n, want, ru_words(n)) for n, want in zip(numbers, expected)
+                  if ru_words(n) != want]
+    print(f"сверка с ru-numbers.typ: {len(numbers)} чисел, расхождений {len(mismatches)} "
+          f"({time.perf_counter() - started:.1f} с)")
+    for n, want, got in mismatches[:10]:
+        print(f"  {n}: typst «{want}», python «{got}»")
+    if mismatches:
+        raise SystemExit(1)
+
+
+def compile_seconds(workspace: Path, source: str, runs: int) -> list[float]:
+    document = workspace / "document.typ"
+    document.write_text(source, encoding="utf-8")
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        typst("compile", "--root", str(TYPST_DIRECTORY), str(document), str(workspace / "document.pdf"))
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def compare_compile(workspace: Path, amounts: int, runs: int) -> None:
+    numbers = [random.randrange(10 ** 9) for _ in range(amounts)]
+    (workspace / "amounts.json").write_text(json.dumps(numbers))
+    (workspace / "words.json").write_text(
+        json.dumps([rubles_in_words(n) for n in numbers], ensure_ascii=False), encoding="utf-8")
+    print(f"\nкомпиляция, сумм в документе: {amounts}, запусков: {runs}")
+    print(f"{'пропись':<10}{'p50, мс':>10}{'мин, мс':>10}")
+    for name, source in (("typst", TYPST_WORDS), ("python", PYTHON_WORDS)):
+        seconds = compile_seconds(workspace, source, runs)
+        print(f"{name:<10}{statistics.median(seconds) * 1000:>10.1f}{min(seconds) * 1000:>10.1f}")
+
+
+def python_cost(amounts: int) -> None:
+    numbers = [random.randrange(10 ** 9) for _ in range(amounts)]
+    ru_words.cache_clear()
+    started = time.perf_counter()
+    for n in numbers:
+        rubles_in_words(n)
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    for n in numbers:
+        rubles_in_words(n)
+    warm = time.perf_counter() - started
+    print(f"\npython, {amounts} сумм: без кэша {cold / amounts * 1e6:.1f} мкс на сумму, "
+          f"из кэша {warm / amounts * 1e6:.2f} мкс; {ru_words.cache_info()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--random", type=int, default=20_000,
+                        help="сколько случайных чисел до 10^12 добавить к сверке")
+    parser.add_argument("--amounts", type=int, nargs="+", default=[2, 200],
+                        help="сколько сумм прописью в документе (в акте их две)")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with render_workspace() as workspace:
+        check(workspace, args.random)
+        for amounts in args.amounts:
+            compare_compile(workspace, amounts, args.runs)
+    python_cost(1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Дисковый кэш с адресацией по содержимому.
+
+Ключ — хэш входных данных, значение — файл в папке кэша.
+Суммарный размер папки ограничен: при переполнении удаляются файлы,
+к которым дольше всего не обращались (LRU по времени изменения файла).
+"""
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+
+def content_hash(*parts: bytes | str) -> str:
+    """sha256 от склеенных частей ключа"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8") if isinstance(part, str) else part)
+        digest.update(b"\0")  # разделитель, чтобы ("ab", "c") != ("a", "bc")
+    return digest.hexdigest()
+
+
+def file_hash(path: str | Path, chunk_size: int = 2**20) -> str:
+    """sha256 содержимого файла, читается кусками"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Кэш ключ → файл с ограничением суммарного размера"""
+
+    def __init__(self, directory: str | Path, max_bytes: int, suffix: str = ""):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._suffix = suffix
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}{self._suffix}"
+
+    def get_path(self, key: str) -> Path | None:
+        """Путь к закэшированному файлу (и отметка об использовании) или None"""
+        path = self.path(key)
+        try:
+            os.utime(path)  # для LRU: файл только что использовали
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key: str) -> bytes | None:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:  # успели вытеснить
+            return None
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Сохраняет значение; запись атомарная, читатели не увидят половину файла"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        path = self.path(key)
+        os.replace(tmp_name, path)
+        self._evict()
+        return path
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(self._suffix) \
+                        and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            # самые давно использованные — первыми
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,265 @@
+"""
+Хранилище истории диалогов агента (checkpointer для langgraph).
+
+По умолчанию история лежит в SQLite (.cache/checkpoints.sqlite) и
+переживает перезапуск; AGENT_CHECKPOINTER=memory держит её в памяти.
+В обоих вариантах хранилище ограничено:
+- от каждого диалога остаются только последние контрольные точки
+  (langgraph сохраняет точку на каждый шаг графа, старые не нужны);
+- в сохранённом состоянии не больше AGENT_MAX_MESSAGES сообщений,
+  старые реплики отбрасываются целыми ходами;
+- диалоги, в которых ничего не происходило AGENT_THREAD_IDLE_HOURS,
+  удаляются целиком.
+"""
+import asyncio
+from collections import defaultdict
+from functools import lru_cache
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Sequence
+
+from dotenv import find_dotenv, load_dotenv
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+load_dotenv(find_dotenv())
+
+CHECKPOINTER = os.getenv("AGENT_CHECKPOINTER") or "sqlite"
+CHECKPOINT_DB = Path(os.getenv("AGENT_CHECKPOINT_DB") or Path(".cache") / "checkpoints.sqlite")
+# сколько сообщений одного диалога хранить
+MAX_MESSAGES = int(os.getenv("AGENT_MAX_MESSAGES") or 200)
+# через сколько часов без активности диалог удаляется
+IDLE_HOURS = float(os.getenv("AGENT_THREAD_IDLE_HOURS") or 72)
+# сколько последних контрольных точек диалога хранить: текущая и её родитель
+KEEP_CHECKPOINTS = 2
+# как часто проверять, не пора ли удалить простаивающие диалоги, с
+EVICT_INTERVAL = 60.0
+
+
+def trim_messages(messages: list[BaseMessage], max_messages: int) -> list[BaseMessage]:
+    """
+    Последние *max_messages* сообщений. Обрезка идёт по началу хода
+    пользователя, чтобы в истории не осталось результата инструмента
+    без вызова, который его породил.
+    """
+    if len(messages) <= max_messages:
+        return messages
+    tail = messages[-max_messages:]
+    for index, message in enumerate(tail):
+        if isinstance(message, HumanMessage):
+            return tail[index:]
+    return tail[-1:]
+
+
+class _BoundedSaver(BaseCheckpointSaver):
+    """Общая часть ограниченных хранилищ: обрезка истории и простаивающие диалоги"""
+
+    def _init_bounds(self, max_messages: int, idle_hours: float) -> None:
+        self.max_messages = max_messages
+        self.idle_seconds = idle_hours * 3600
+        self._last_eviction = 0.0
+        self._eviction_lock = threading.Lock()
+
+    def _bounded(self, checkpoint: Checkpoint) -> Checkpoint:
+        """Копия точки с обрезанной историей; исходную точку граф ещё использует"""
+        messages = checkpoint["channel_values"].get("messages")
+        if not isinstance(messages, list) or len(messages) <= self.max_messages:
+            return checkpoint
+        return {
+            **checkpoint,
+            "channel_values": {
+                **checkpoint["channel_values"],
+                "messages": trim_messages(messages, self.max_messages),
+            },
+        }
+
+    def _touch(self, thread_id: str) -> None:
+        """Отмечает активность диалога и изредка удаляет простаивающие"""
+        now = time.time()
+        self._mark_active(thread_id, now)
+        with self._eviction_lock:
+            if now - self._last_eviction < EVICT_INTERVAL:
+                return
+            self._last_eviction = now
+        self.evict_idle()
+
+    def evict_idle(self) -> list[str]:
+        """Удаляет диалоги без активности дольше idle_seconds; возвращает их ID"""
+        threads = self._idle_threads(time.time() - self.idle_seconds)
+        for thread_id in threads:
+            self.delete_thread(thread_id)
+        return threads
+
+    def _mark_active(self, thread_id: str, now: float) -> None:
+        raise NotImplementedError
+
+    def _idle_threads(self, cutoff: float) -> list[str]:
+        raise NotImplementedError
+
+
+class BoundedMemorySaver(_BoundedSaver, InMemorySaver):
+    """InMemorySaver, который не растёт с каждым шагом и каждым диалогом"""
+
+    def __init__(self, max_messages: int = MAX_MESSAGES, idle_hours: float = IDLE_HOURS):
+        super().__init__()
+        self._init_bounds(max_messages, idle_hours)
+        self._activity: dict[str, float] = {}
+        # (thread_id, checkpoint_ns) → [(checkpoint_id, channel_versions), ...]
+        self._recent: dict[tuple[str, str], list[tuple[str, ChannelVersions]]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint,
+            metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        with self._lock:
+            saved = super().put(config, self._bounded(checkpoint), metadata, new_versions)
+            self._compact(config["configurable"]["thread_id"],
+                          config["configurable"]["checkpoint_ns"], checkpoint)
+        self._touch(config["configurable"]["thread_id"])
+        return saved
+
+    def _compact(self, thread_id: str, checkpoint_ns: str, checkpoint: Checkpoint) -> None:
+        """Удаляет старые точки диалога, их промежуточные записи и значения каналов"""
+        recent = self._recent[(thread_id, checkpoint_ns)]
+        recent.append((checkpoint["id"], dict(checkpoint["channel_versions"])))
+        del recent[:-KEEP_CHECKPOINTS]
+        kept_ids = {checkpoint_id for checkpoint_id, _ in recent}
+        kept_blobs = {(channel, version) for _, versions in recent
+                      for channel, version in versions.items()}
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [key for key in checkpoints if key not in kept_ids]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        for key in [key for key in self.blobs
+                    if key[:2] == (thread_id, checkpoint_ns) and key[2:] not in kept_blobs]:
+            del self.blobs[key]
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._activity.pop(thread_id, None)
+            for key in [key for key in self._recent if key[0] == thread_id]:
+                del self._recent[key]
+
+    def _mark_active(self, thread_id: str, now: float) -> None:
+        self._activity[thread_id] = now
+
+    def _idle_threads(self, cutoff: float) -> list[str]:
+        return [thread_id for thread_id, seen in list(self._activity.items()) if seen < cutoff]
+
+
+class BoundedSqliteSaver(_BoundedSaver, SqliteSaver):
+    """
+    SqliteSaver с теми же ограничениями. Асинхронные методы выполняют
+    синхронные в потоке, поэтому с ним работают и ainvoke/astream агента.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, max_messages: int = MAX_MESSAGES,
+                 idle_hours: float = IDLE_HOURS):
+        super().__init__(conn)
+        self._init_bounds(max_messages, idle_hours)
+
+    @classmethod
+    def from_path(cls, path: str | Path, **kwargs: Any) -> "BoundedSqliteSaver":
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # соединение общее для всех потоков, доступ к нему сериализует self.lock
+        return cls(sqlite3.connect(path, check_same_thread=False), **kwargs)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()  # вызывается из cursor(), self.lock уже захвачен
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thread_activity_updated_at
+                ON thread_activity (updated_at);
+        """)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint,
+            metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        saved = super().put(config, self._bounded(checkpoint), metadata, new_versions)
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self.cursor() as cur:
+            # всё, кроме KEEP_CHECKPOINTS последних точек диалога, больше не нужно
+            kept = ("SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT ?")
+            for table in ("writes", "checkpoints"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? "
+                    f"AND checkpoint_id NOT IN ({kept})",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, KEEP_CHECKPOINTS),
+                )
+        self._touch(thread_id)
+        return saved
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    def _mark_active(self, thread_id: str, now: float) -> None:
+        with self.cursor() as cur:
+            cur.execute("INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                        (thread_id, now))
+
+    def _idle_threads(self, cutoff: float) -> list[str]:
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE updated_at < ?", (cutoff,))
+            return [row[0] for row in cur.fetchall()]
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None
+                    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]],
+                          task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+BoundedCheckpointer = BoundedMemorySaver | BoundedSqliteSaver
+
+
+def make_checkpointer(name: str | None = None) -> BoundedCheckpointer:
+    """Хранилище по имени: "sqlite" (по умолчанию) или "memory" """
+    name = name or CHECKPOINTER
+    if name == "sqlite":
+        return BoundedSqliteSaver.from_path(CHECKPOINT_DB)
+    if name == "memory":
+        return BoundedMemorySaver()
+    raise ValueError(f"неизвестное хранилище истории: {name}")
+
+
+@lru_cache(maxsize=None)
+def default_checkpointer() -> BoundedCheckpointer:
+    """Одно хранилище на процесс: все агенты пишут историю в него"""
+    return make_checkpointer()
@@ -0,0 +1,185 @@
+"""
+Управление контекстом агента: что из истории диалога уходит в модель.
+
+Перед каждым обращением к модели (pre_model_hook в create_react_agent):
+- длинные результаты инструментов из прошлых ходов обрезаются до
+  AGENT_TOOL_RESULT_CHARS символов — список писем или текст вложения
+  нужен модели в том ходе, где его получили, а не в каждом следующем;
+- если история всё равно больше AGENT_CONTEXT_TOKENS, старые ходы
+  сворачиваются в краткое содержание (AGENT_CONTEXT_SUMMARY=1) или
+  просто отбрасываются. Содержание хранится в состоянии диалога и
+  дополняется по мере того, как из окна уходят новые ходы;
+- первое сообщение пользователя не сворачивается и не отбрасывается:
+  в нём постановка задачи и приложенный файл с реквизитами
+  (act_generate.main), без них модель теряет задачу посреди диалога.
+
+История в хранилище не меняется: сокращается только то, что видит модель.
+Размер каждого запроса записывается в ContextManager.stats.
+"""
+from collections import deque
+from dataclasses import dataclass
+import os
+import time
+from typing import NotRequired
+
+from dotenv import find_dotenv, load_dotenv
+from langchain_core.language_models import LanguageModelLike
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.constants import TAG_NOSTREAM
+from langgraph.prebuilt.chat_agent_executor import AgentState
+
+
+load_dotenv(find_dotenv())
+
+# бюджет запроса к модели в токенах; 0 — отправлять историю целиком
+CONTEXT_TOKENS = int(os.getenv("AGENT_CONTEXT_TOKENS") or 8000)
+# до скольких символов обрезать результаты инструментов из прошлых ходов
+TOOL_RESULT_CHARS = int(os.getenv("AGENT_TOOL_RESULT_CHARS") or 2000)
+# сворачивать ли старые ходы в краткое содержание (иначе — отбрасывать)
+CONTEXT_SUMMARY = os.getenv("AGENT_CONTEXT_SUMMARY", "1") != "0"
+# грубая оценка для русского текста: токенизатор GigaChat даёт ~4 символа на токен
+CHARS_PER_TOKEN = 4
+# сколько токенов оставить под краткое содержание
+SUMMARY_TOKENS = 500
+
+SUMMARY_PROMPT = (
+    "Кратко перескажи диалог пользователя с ассистентом: какие документы просили, "
+    "какие реквизиты, работы и суммы уже известны, что осталось уточнить. "
+    "Не больше 10 предложений, только факты из диалога."
+)
+
+
+class ContextState(AgentState):
+    """Состояние агента с кратким содержанием свёрнутых ходов"""
+    summary: NotRequired[str]
+    summary_upto: NotRequired[str]  # ID последнего сообщения, вошедшего в содержание
+
+
+@dataclass
+class PromptStats:
+    """Размер одного запроса к модели"""
+    thread_id: str
+    history_messages: int  # сообщений в истории диалога
+    history_tokens: int  # столько ушло бы в модель без сокращения
+    prompt_messages: int
+    prompt_tokens: int
+    truncated_tool_results: int
+    summarized_messages: int  # сколько сообщений свёрнуто в этом запросе
+    seconds: float  # время на подготовку запроса, включая суммаризацию
+
+
+def count_tokens(messages: list[BaseMessage]) -> int:
+    """Оценка числа токенов без обращения к API"""
+    return sum(len(str(message.content)) // CHARS_PER_TOKEN + 4 for message in messages)
+
+
+def truncate_tool_result(message: ToolMessage, max_chars: int) -> ToolMessage:
+    content = str(message.content)
+    if len(content) <= max_chars:
+        return message
+    return message.model_copy(update={
+        "content": f"{content[:max_chars]}… [обрезано, всего {len(content)} символов]"})
+
+
+class ContextManager:
+    """pre_model_hook для create_react_agent: обрезка и сворачивание истории"""
+
+    def __init__(self, model: LanguageModelLike | None = None,
+                 max_tokens: int = CONTEXT_TOKENS,
+                 tool_result_chars: int = TOOL_RESULT_CHARS,
+                 summarize: bool = CONTEXT_SUMMARY):
+        self._model = model
+        self.max_tokens = max_tokens
+        self.tool_result_chars = tool_result_chars
+        self.summarize = summarize and model is not None
+        self.stats: deque[PromptStats] = deque(maxlen=1000)
+
+    def __call__(self, state: ContextState, config: RunnableConfig) -> dict:
+        started = time.perf_counter()
+        history = list(state["messages"])
+        summary = state.get("summary", "")
+        # постановка задачи и файл с реквизитами остаются в каждом запросе
+        first = next((m for m in history if isinstance(m, HumanMessage)), None)
+        reserved = count_tokens([first]) if first is not None else 0
+        messages = [message for message in history[self._start(history, state.get("summary_upto")):]
+                    if message is not first]
+
+        # результаты инструментов нужны целиком только в текущем ходе
+        turn = self._last_turn(messages)
+        truncated = 0
+        for index in range(turn):
+            message = messages[index]
+            if isinstance(message, ToolMessage) and self.tool_result_chars:
+                messages[index] = truncate_tool_result(message, self.tool_result_chars)
+                truncated += messages[index] is not message
+
+        update: dict = {}
+        old: list[BaseMessage] = []
+        if self.max_tokens and count_tokens(messages) > (
+                self.max_tokens - reserved - len(summary) // CHARS_PER_TOKEN):
+            cut = self._cut(messages, turn, reserved)
+            old, messages = messages[:cut], messages[cut:]
+            if old:
+                if self.summarize:
+                    summary = self._summarize(summary, old)
+                update = {"summary": summary, "summary_upto": old[-1].id}
+
+        prompt = (([SystemMessage(f"Краткое содержание начала диалога: {summary}")] if summary else [])
+                  + ([first] if first is not None else []) + messages)
+        self.stats.append(PromptStats(
+            thread_id=str(config.get("configurable", {}).get("thread_id", "")),
+            history_messages=len(history),
+            history_tokens=count_tokens(history),
+            prompt_messages=len(prompt),
+            prompt_tokens=count_tokens(prompt),
+            truncated_tool_results=truncated,
+            summarized_messages=len(old),
+            seconds=time.perf_counter() - started,
+        ))
+        return {**update, "llm_input_messages": prompt}
+
+    @staticmethod
+    def _start(history: list[BaseMessage], summary_upto: str | None) -> int:
+        """Первое сообщение, ещё не вошедшее в краткое содержание"""
+        if summary_upto:
+            for index, message in enumerate(history):
+                if message.id == summary_upto:
+                    return index + 1
+        # сообщение могли удалить из хранилища вместе со всем, что было до него
+        return 0
+
+    @staticmethod
+    def _last_turn(messages: list[BaseMessage]) -> int:
+        """Индекс последнего сообщения пользователя — начало текущего хода"""
+        for index in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[index], HumanMessage):
+                return index
+        return 0
+
+    def _cut(self, messages: list[BaseMessage], turn: int, reserved: int = 0) -> int:
+        """
+        Самая ранняя граница хода, после которой история влезает в бюджет
+        за вычетом *reserved* токенов (первого сообщения пользователя).
+        Текущий ход не режется никогда, даже если он один больше бюджета.
+        """
+        budget = self.max_tokens - reserved - (SUMMARY_TOKENS if self.summarize else 0)
+        for index, message in enumerate(messages[:turn + 1]):
+            if isinstance(message, HumanMessage) and count_tokens(messages[index:]) <= budget:
+                return index
+        return turn
+
+    def _summarize(self, summary: str, old: list[BaseMessage]) -> str:
+        transcript = "\n".join(
+            f"{message.type}: {message.content}" for message in old if message.content)
+        if summary:
+            transcript = f"Краткое содержание до этого: {summary}\n{transcript}"
+        try:
+            # nostream: токены содержания не должны попасть в потоковый ответ агента
+            response = self._model.invoke(  # type: ignore[union-attr]
+                [SystemMessage(SUMMARY_PROMPT), HumanMessage(transcript)],
+                config={"tags": [TAG_NOSTREAM]})
+        except Exception as error:  # без содержания диалог продолжится, просто короче
+            print(f"не удалось свернуть историю: {error}")
+            return summary
+        return str(response.content)
@@ -10,26 +10,95 @@ IMAP-доступ должен быть включён (Почта → Все н
 2. Скачивает письма за указанное количество дней
 3. Сохраняет тексты писем и все вложения
 4. Требует специальных настроек в почтовом аккаунте
+
+Письма скачиваются пачками (UID FETCH по нескольку писем за запрос)
+через небольшой пул IMAP-соединений, пачки качаются параллельно.
+Скачанные письма складываются в ограниченную очередь, из которой их
+разбирают и пишут вложения на диск отдельные потоки (stream_messages),
+так что разбор не ждёт сети, а сеть — разбора; iter_emails отдаёт
+письма по мере готовности.
+
+Есть и «ленивый» режим: сначала скачиваются только ENVELOPE и
+BODYSTRUCTURE (тема, дата, имена, типы и размеры вложений), а
+содержимое конкретного вложения качается отдельно, когда оно нужно.
+
+Большие письма (больше EMAIL_STREAM_THRESHOLD_MB) не качаются целиком:
+их вложения скачиваются кусками BODY.PEEK[часть]<начало.длина> и
+декодируются (base64, quoted-printable) прямо в файл, так что память
+не зависит от размера вложения.
+
+Вложения складываются в хранилище по хэшу содержимого
+(attachment_store.py): одинаковые файлы из разных писем пишутся на диск
+один раз.
+
+В инкрементальном режиме рядом с вложениями ведётся индекс
+(.mail_state.json): UIDVALIDITY папки, последний увиденный UID и уже
+разобранные письма. Повторно качаются только новые письма; если сервер
+сменил UIDVALIDITY, индекс сбрасывается и ящик синхронизируется заново.
+
+Для фонового режима (watcher.py) есть search_after и idle: новые письма
+ищутся по UID, а между поисками соединение ждёт их командой IDLE.
 """
-from dataclasses import dataclass
+import binascii
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, asdict, field
 import imaplib
 import email
 from email.header import decode_header
+from email.utils import parsedate_to_datetime
+import io
+from itertools import chain
+import json
 import os
 from pathlib import Path
+import queue
+import re
+import select
+import tempfile
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import TypeAlias
+from typing import Any, BinaryIO, Callable, Iterator, TypeAlias
+from urllib.parse import unquote
 from dotenv import find_dotenv, load_dotenv
 from langchain_core.tools import tool # декоратор для интеграции с LangChain
 
+from attachment_store import attachment_store
+from telemetry import annotate, propagate, span, traced
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
 
 load_dotenv(find_dotenv())
 # Путь для сохранения вложений (указываете любой,
 # где удобно хранить собранные файлы)
 SAVE_ATTACHMENTS_DIRECTORY = "C:/Users/smoly/SBER_GIGA/LangChain-and-GigaChat/attachments"
 
+# Сколько IMAP-соединений держать одновременно
+IMAP_CONNECTIONS = int(os.getenv("EMAIL_IMAP_CONNECTIONS") or 4)
+# Сколько писем запрашивать одним UID FETCH
+IMAP_FETCH_BATCH = int(os.getenv("EMAIL_FETCH_BATCH") or 50)
+# Качать только новые письма, помня уже скачанные (EMAIL_INCREMENTAL=0 — выключить)
+IMAP_INCREMENTAL = os.getenv("EMAIL_INCREMENTAL", "1") != "0"
+# Письма больше этого размера качаются по частям, с потоковой записью вложений
+STREAM_THRESHOLD = int(float(os.getenv("EMAIL_STREAM_THRESHOLD_MB") or 5) * 2**20)
+# Размер куска при потоковом скачивании вложения
+ATTACHMENT_CHUNK = int(os.getenv("EMAIL_ATTACHMENT_CHUNK") or 2**20)
+# Сколько потоков разбирают скачанные письма и пишут вложения, пока качаются следующие
+EMAIL_PARSE_WORKERS = int(os.getenv("EMAIL_PARSE_WORKERS") or 2)
+# Сколько скачанных, но ещё не разобранных писем может ждать в очереди
+EMAIL_PARSE_QUEUE = int(os.getenv("EMAIL_PARSE_QUEUE") or 100)
+# Файл индекса в каталоге вложений
+MAIL_STATE_FILENAME = ".mail_state.json"
+
 
 Filename: TypeAlias = str  # псевдоним имя файла, в котором хранится аттачмент письма
+Uid: TypeAlias = bytes  # UID письма в папке, например b"1532"
+FetchItems: TypeAlias = dict[str, Any]  # ответ FETCH: {"UID": b"5", "RFC822": b"...", ...}
 
 
 @dataclass
@@ -39,6 +108,26 @@ class Email:
     body: str  # тело письма
     attachments: list[Filename]  # список имён файлов прикрепленных к письму
     date: str  # дата письма
+    uid: str = ""  # UID письма в папке
+
+
+@dataclass
+class AttachmentInfo:
+    """Вложение, известное по BODYSTRUCTURE, без скачанного содержимого"""
+    filename: str  # имя файла
+    part: str  # номер MIME-части для BODY[...], например "2" или "1.2"
+    mime_type: str  # тип содержимого, например application/pdf
+    size: int  # размер в закодированном виде, байт
+    encoding: str  # кодировка передачи: base64, quoted-printable, 7bit...
+
+
+@dataclass
+class EmailHeader:
+    """Письмо без тела и без содержимого вложений"""
+    uid: str  # UID письма в папке, нужен для скачивания вложения
+    subject: str  # тема письма
+    date: str  # дата письма
+    attachments: list[AttachmentInfo]  # вложения письма
 
 # Вспомогательные функции
 
@@ -77,9 +166,23 @@ class CantReadEmail(Exception):
     """Не получилось прочесть конкретное письмо"""
 
 
-@tool
-def fetch_recent_emails(days: int = 2, SAVE_ATTACHMENTS_DIRECTORY: str = "attachments") -> list[Email]:
-    """Возвращает почтовые сообщения и вложения за последние *days* суток."""
+class ImapPoolClosed(Exception):
+    """Соединение просят у уже закрытого пула"""
+
+
+def _mailbox_key() -> str:
+    """Идентификатор папки для индекса: логин, сервер и папка"""
+    return (f"{os.getenv('EMAIL_LOGIN')}@{os.getenv('EMAIL_IMAP_HOST')}:"
+            f"{os.getenv('EMAIL_IMAP_PORT')}/INBOX")
+
+
+def _connect() -> imaplib.IMAP4:
+    """
+    Открывает авторизованное соединение и выбирает INBOX.
+
+    EMAIL_IMAP_SSL=0 отключает SSL — удобно для локального тестового
+    IMAP-сервера.
+    """
     user = os.getenv("EMAIL_LOGIN")
     password = os.getenv("EMAIL_PASSWORD")
     imap_host = os.getenv("EMAIL_IMAP_HOST")
@@ -87,73 +190,1020 @@ def fetch_recent_emails(days: int = 2, SAVE_ATTACHMENTS_DIRECTORY: str = "attach
     if not all((user, password, imap_host, imap_port)):
         raise IncorrectEnvVariables("set correct env variables")
 
-    emails: list[Email] = []
+    use_ssl = os.getenv("EMAIL_IMAP_SSL", "1") != "0"
+    imap_class = imaplib.IMAP4_SSL if use_ssl else imaplib.IMAP4
+    with span("imap.connect", ssl=use_ssl):
+        imap = imap_class(imap_host, int(imap_port))   # Создаёт соединение
+        imap.login(user, password)                     # Авторизация
+        imap.select("INBOX")                           # Залетаем во входящие письма
+    return imap
+
+
+def _logout(imap: imaplib.IMAP4) -> None:
+    try:
+        imap.close()
+        imap.logout()  # завершение IMAP-сессии
+    except (imaplib.IMAP4.error, OSError):
+        pass
+
+
+class ImapPool:
+    """
+    Пул авторизованных IMAP-соединений.
+
+    Соединения открываются по мере надобности, но не больше *size*;
+    одно соединение в каждый момент используется только одним потоком.
+    close() закрывает свободные соединения, а занятые закрываются, когда
+    их вернут в пул.
+    """
+
+    def __init__(self, size: int = IMAP_CONNECTIONS):
+        self.size = size
+        # None в очереди — знак, что пул закрыт, для потоков, ждущих соединения
+        self._idle: queue.Queue[imaplib.IMAP4 | None] = queue.Queue()
+        self._reserved = 0  # открытые + открывающиеся прямо сейчас
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> imaplib.IMAP4:
+        with self._lock:
+            if self._closed:
+                raise ImapPoolClosed("IMAP-пул закрыт")
+            try:
+                imap = self._idle.get_nowait()
+            except queue.Empty:
+                imap = None
+            can_open = imap is None and self._reserved < self.size
+            if can_open:
+                self._reserved += 1
+        if imap is not None:
+            return imap
+        if not can_open:
+            imap = self._idle.get()  # ждём, пока соединение освободится
+            if imap is None:  # пул закрыли, пока ждали: будим следующего ждущего
+                self._idle.put(None)
+                raise ImapPoolClosed("IMAP-пул закрыт")
+            return imap
+        try:
+            return _connect()
+        except BaseException:
+            with self._lock:
+                self._reserved -= 1
+            raise
+
+    def _release(self, imap: imaplib.IMAP4, broken: bool = False) -> None:
+        with self._lock:
+            drop = self._closed or broken
+            if drop:
+                self._reserved -= 1
+            else:
+                self._idle.put(imap)
+        if drop:  # соединение вернули после close() или оно оборвалось
+            _logout(imap)
+
+    @contextmanager
+    def connection(self) -> Iterator[imaplib.IMAP4]:
+        imap = self._acquire()
+        try:
+            yield imap
+        except (imaplib.IMAP4.abort, OSError):
+            # оборванное соединение не возвращаем: пул живёт долго (watcher.py)
+            self._release(imap, broken=True)
+            raise
+        except BaseException:
+            self._release(imap)
+            raise
+        self._release(imap)
+
+    def close(self) -> None:
+        idle = []
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            while True:
+                try:
+                    idle.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            self._reserved -= len(idle)
+            self._idle.put(None)
+        for imap in idle:
+            _logout(imap)
+
+    def __enter__(self) -> "ImapPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_UIDVALIDITY_RE = re.compile(rb"UIDVALIDITY (\d+)")
+
+
+def _search_since(imap: imaplib.IMAP4, since: datetime) -> list[Uid]:
+    with span("imap.search") as search:
+        status, data = imap.uid("SEARCH", None, "SINCE", _imap_date(since))  # 'SINCE 26-June-2025'
+        if status != "OK":
+            raise CantSearchEmails("Поиск не удался:", data)
+        uids = data[0].split()
+        search.set(messages=len(uids))
+    return uids
+
+
+def read_uid_validity(imap: imaplib.IMAP4) -> int:
+    status, data = imap.status("INBOX", "(UIDVALIDITY)")
+    match = _UIDVALIDITY_RE.search(data[0] or b"") if status == "OK" else None
+    if match is None:
+        raise CantSearchEmails("Не удалось узнать UIDVALIDITY:", data)
+    return int(match.group(1))
+
+
+@dataclass
+class MailState:
+    """
+    Индекс скачанных писем одной папки.
+
+    Письма хранятся уже разобранными (как Email), с флагом
+    «обработано», чтобы повторно их не качать и не разбирать; заголовки
+    для fetch_email_headers — отдельно. Пока UIDVALIDITY не сменился,
+    на сервере ищутся только письма новее last_uid (headers_last_uid),
+    если индекс покрывает запрошенные сутки (messages_since, headers_since).
+
+    Письма ведёт iter_emails, заголовки — fetch_email_headers, отметки
+    «обработано» — mark_emails_processed; каждый перечитывает индекс под
+    блокировкой (update_mail_state) и меняет только своё.
+    """
+    uid_validity: int = 0  # UIDVALIDITY папки, при смене UID-ы недействительны
+    last_uid: int = 0  # все письма до этого UID уже в индексе
+    messages_since: str = ""  # начиная с этого дня (ISO) в индексе все письма до last_uid
+    messages: dict[str, dict] = field(default_factory=dict)  # uid → {"email": ..., "processed": ...}
+    headers_last_uid: int = 0  # то же для заголовков
+    headers_since: str = ""
+    headers: dict[str, dict] = field(default_factory=dict)  # uid → EmailHeader
+
+    def reset(self, uid_validity: int) -> None:
+        self.uid_validity = uid_validity
+        self.last_uid = self.headers_last_uid = 0
+        self.messages_since = self.headers_since = ""
+        self.messages.clear()
+        self.headers.clear()
+
+    def covers_messages(self, since: datetime) -> bool:
+        """Все письма с дня *since* до last_uid уже в индексе"""
+        return bool(self.last_uid and self.messages_since) and self.messages_since <= _day(since)
+
+    def covers_headers(self, since: datetime) -> bool:
+        return bool(self.headers_last_uid and self.headers_since) and self.headers_since <= _day(since)
+
+    def known_uids(self, since: datetime) -> list[Uid]:
+        """UID писем индекса, отправленных не раньше дня *since*, по возрастанию"""
+        return [uid.encode() for uid in sorted(self.messages, key=int)
+                if _not_before(self.messages[uid]["email"]["date"], since)]
+
+    def known_header_uids(self, since: datetime) -> list[Uid]:
+        return [uid.encode() for uid in sorted(self.headers, key=int)
+                if _not_before(self.headers[uid]["date"], since)]
+
+    def get_header(self, uid: str) -> EmailHeader:
+        entry = dict(self.headers[uid])
+        entry["attachments"] = [AttachmentInfo(**a) for a in entry["attachments"]]
+        return EmailHeader(**entry)
+
+    def get(self, uid: str) -> Email | None:
+        """Письмо из индекса или None, если его нет или пропали его вложения"""
+        entry = self.messages.get(uid)
+        if entry is None:
+            return None
+        cached = Email(**entry["email"])
+        if not all(os.path.exists(path) for path in cached.attachments):
+            return None
+        return cached
+
+    def add(self, uid: str, message: Email) -> None:
+        processed = self.messages.get(uid, {}).get("processed", False)
+        self.messages[uid] = {"email": asdict(message), "processed": processed}
+
+    def is_processed(self, uid: str) -> bool:
+        return self.messages.get(uid, {}).get("processed", False)
+
+    def mark_processed(self, uid: str) -> None:
+        if uid in self.messages:
+            self.messages[uid]["processed"] = True
+
+    def keep_only(self, uids: set[str]) -> None:
+        """Забывает письма вне текущего окна, чтобы индекс не рос бесконечно"""
+        for uid in list(self.messages):
+            if uid not in uids:
+                del self.messages[uid]
+
+    def merge_messages(self, fetched: "MailState", window: set[str] | None, since: datetime) -> None:
+        """
+        Переносит в индекс письма *fetched* — снимка, с которым работал
+        iter_emails; заголовки и отметки «обработано» остаются как есть.
+        *window* — UID всех писем окна, если запуск дошёл до конца.
+        """
+        if self.uid_validity != fetched.uid_validity:
+            self.reset(fetched.uid_validity)
+        for uid, entry in fetched.messages.items():
+            self.messages[uid] = {**entry, "processed": entry["processed"] or self.is_processed(uid)}
+        if window is not None:
+            # last_uid верен только вместе с тем окном, до которого обрезан индекс
+            self.keep_only(window)
+            self.last_uid, self.messages_since = fetched.last_uid, _day(since)
+
+    def merge_headers(self, fetched: "MailState", headers: list[EmailHeader], since: datetime) -> None:
+        """
+        Заменяет заголовки результатом fetch_email_headers за сутки начиная
+        с *since*; *fetched* — снимок индекса, с которым он работал
+        """
+        if self.uid_validity != fetched.uid_validity:
+            self.reset(fetched.uid_validity)
+        self.headers = {header.uid: asdict(header) for header in headers}
+        self.headers_last_uid = max([fetched.headers_last_uid, *(int(header.uid) for header in headers)])
+        self.headers_since = _day(since)
+
+
+def _day(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).date().isoformat()
+
+
+def _not_before(date: str, since: datetime) -> bool:
+    """Письмо с датой *date* попадает в SEARCH SINCE *since* (сравниваются дни)"""
+    try:
+        sent = parsedate_to_datetime(date)
+    except (TypeError, ValueError):
+        return True  # без даты письмо не отбрасываем
+    if sent.tzinfo is None:
+        sent = sent.replace(tzinfo=timezone.utc)
+    return sent.astimezone(timezone.utc).date() >= since.astimezone(timezone.utc).date()
+
+
+def _state_path(save_attachments_directory: str) -> Path:
+    return Path(save_attachments_directory) / MAIL_STATE_FILENAME
+
+
+def load_mail_state(save_attachments_directory: str) -> MailState:
+    """Индекс текущей папки (из .env) или пустой, если его ещё нет"""
+    try:
+        with open(_state_path(save_attachments_directory), encoding="utf-8") as f:
+            data = json.load(f).get(_mailbox_key())
+    except (FileNotFoundError, json.JSONDecodeError):
+        data = None
+    return MailState(**data) if data else MailState()
+
+
+# потоки одного процесса; между процессами — блокировка файла .mail_state.lock
+_state_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_state(save_attachments_directory: str) -> Iterator[None]:
+    """Индекс меняют iter_emails, fetch_email_headers и несколько процессов сразу"""
+    with _state_lock, open(_state_path(save_attachments_directory).with_suffix(".lock"), "a+b") as f:
+        if os.name == "nt":
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # сама ждёт ~10 с, потом OSError
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)  # снимается при закрытии файла
+            yield
+
+
+def update_mail_state(save_attachments_directory: str,
+                      update: Callable[[MailState], None]) -> MailState:
+    """
+    Перечитывает индекс текущей папки под блокировкой, применяет к нему
+    *update* и сохраняет: изменения других процессов не теряются
+    """
+    with _locked_state(save_attachments_directory):
+        state = load_mail_state(save_attachments_directory)
+        update(state)
+        _write_mail_state(save_attachments_directory, state)
+    return state
+
+
+def _write_mail_state(save_attachments_directory: str, state: MailState) -> None:
+    """Сохраняет индекс текущей папки; запись атомарная"""
+    path = _state_path(save_attachments_directory)
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        data = {}
+    data[_mailbox_key()] = asdict(state)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_name, path)
+
+
+def mark_emails_processed(
+    emails: list[Email], save_attachments_directory: str = "attachments"
+) -> None:
+    """Отмечает письма как обработанные, чтобы skip_processed их пропускал"""
+    def mark(state: MailState) -> None:
+        for message in emails:
+            state.mark_processed(message.uid)
+
+    update_mail_state(save_attachments_directory, mark)
+
+
+# ── Разбор ответов FETCH ─────────────
+# imaplib отдаёт ответ кусками: строки и пары (строка, литерал {n});
+# ниже они собираются обратно во вложенные списки.
+
+_OPEN, _CLOSE = object(), object()
+_TOKEN_RE = re.compile(rb'''\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))''')
+_QUOTED_ESCAPE_RE = re.compile(rb"\\(.)")
+
+
+def _text_tokens(text: bytes) -> Iterator[Any]:
+    for match in _TOKEN_RE.finditer(text):
+        opening, closing, quoted, atom = match.groups()
+        if opening:
+            yield _OPEN
+        elif closing:
+            yield _CLOSE
+        elif quoted is not None:
+            yield _QUOTED_ESCAPE_RE.sub(rb"\1", quoted)
+        elif atom is not None:
+            yield None if atom.upper() == b"NIL" else atom
+
+
+def _tokens(data: list) -> Iterator[Any]:
+    for item in data:
+        if isinstance(item, tuple):  # (b'1 (UID 5 RFC822 {1234}', b'...')
+            text, literal = item
+            yield from _text_tokens(text[:text.rindex(b"{")])
+            yield literal
+        elif item is not None:
+            yield from _text_tokens(item)
+
+
+def _read_list(tokens: Iterator[Any]) -> list:
+    items: list = []
+    for token in tokens:
+        if token is _CLOSE:
+            return items
+        items.append(_read_list(tokens) if token is _OPEN else token)
+    return items
+
+
+def _parse_fetch(data: list) -> list[FetchItems]:
+    """Ответы FETCH → словари {"UID": ..., "ENVELOPE": ..., ...}"""
+    responses = []
+    tokens = _tokens(data)
+    for token in tokens:
+        # порядковый номер письма, за ним список «ключ значение ...»
+        if token is _OPEN:
+            fields = _read_list(tokens)
+        elif next(tokens, None) is _OPEN:
+            fields = _read_list(tokens)
+        else:
+            continue
+        responses.append({
+            fields[i].decode().upper(): fields[i + 1] for i in range(0, len(fields) - 1, 2)
+        })
+    return responses
+
+
+def _fetch_batch(pool: ImapPool, uids: list[Uid], items: str) -> dict[Uid, FetchItems]:
+    """Скачивает пачку писем одним UID FETCH"""
+    with pool.connection() as imap, span("imap.fetch", messages=len(uids), items=items) as fetch:
+        status, data = imap.uid("FETCH", b",".join(uids), items)
+        fetch.set(bytes=sum(len(part) for item in data if isinstance(item, tuple) for part in item))
+    if status != "OK":
+        raise CantReadEmail(f"Не удалось получить письма uid={uids[0]!r}..{uids[-1]!r}")
+    return {fields["UID"]: fields for fields in _parse_fetch(data) if "UID" in fields}
+
+
+def fetch_items(
+    pool: ImapPool, uids: list[Uid], items: str, batch_size: int = IMAP_FETCH_BATCH
+) -> dict[Uid, FetchItems]:
+    """Запрашивает *items* по письмам пачками, параллельно по всем соединениям пула"""
+    batches = [uids[i:i + batch_size] for i in range(0, len(uids), batch_size)]
+    messages: dict[Uid, FetchItems] = {}
+    if not batches:
+        return messages
+    fetch_batch = propagate(_fetch_batch)
+    with ThreadPoolExecutor(min(pool.size, len(batches))) as executor:
+        fetched_batches = executor.map(lambda b: fetch_batch(pool, b, items), batches)
+        for batch, fetched in zip(batches, fetched_batches):
+            missing = [uid for uid in batch if uid not in fetched]
+            if missing:
+                raise CantReadEmail(f"Не удалось получить письмо uid={missing[0]!r}")
+            messages.update(fetched)
+    return messages
+
+
+def fetch_raw_messages(
+    pool: ImapPool, uids: list[Uid], batch_size: int = IMAP_FETCH_BATCH
+) -> dict[Uid, bytes]:
+    """Скачивает письма целиком"""
+    # RFC822 - это стандарт, который определяет формат электронных писем
+    fetched = fetch_items(pool, uids, "(RFC822)", batch_size)
+    return {uid: fields["RFC822"] for uid, fields in fetched.items()}
+
+
+def parse_message(uid: Uid, raw: bytes, save_attachments_directory: str) -> Email:
+    """Разбирает письмо и сохраняет его вложения на диск"""
+    msg = email.message_from_bytes(raw)
+
+    email_subject = _decode(msg.get("Subject", ""))
+    email_date = msg.get("Date", "")
+
+    # Текст письма (всегда берём первую текстовую часть)
+    body = ""
+    for part in msg.walk():
+        ctype = part.get_content_type()
+        if ctype == "text/plain" and part.get_filename() is None:
+            charset = part.get_content_charset() or "utf-8"
+            body = part.get_payload(decode=True).decode(charset, errors="ignore")
+            break
+    email_body = body
+
+    # Вложения
+    attachments: list[Filename] = []
+    for part in msg.walk():
+        filename = part.get_filename()
+        if filename:
+            print("attachments", filename)
+            filename = _decode(filename).strip()
+            with span("mail.attachment", streamed=False) as attachment:
+                payload = part.get_payload(decode=True)
+                attachment.set(bytes=len(payload or b""))
+                filepath = attachment_store(save_attachments_directory).save_bytes(
+                    filename, uid.decode(), payload)
+            attachments.append(Filename(filepath))
+
+    return Email(
+        subject=email_subject,
+        body=email_body,
+        attachments=attachments,
+        date=email_date,
+        uid=uid.decode(),
+    )
+
+
+_DONE = object()  # конец конвейера в очереди готовых писем
+
+
+def stream_messages(
+    pool: ImapPool,
+    uids: list[Uid],
+    large: set[Uid],
+    structures: dict[Uid, FetchItems],
+    save_attachments_directory: str,
+    batch_size: int = IMAP_FETCH_BATCH,
+    parse_workers: int = EMAIL_PARSE_WORKERS,
+    max_queued: int = EMAIL_PARSE_QUEUE,
+) -> Iterator[Email]:
+    """
+    Качает и разбирает письма *uids* конвейером. Соединения пула качают
+    пачки писем и кладут их в очередь не длиннее *max_queued*, а
+    *parse_workers* потоков разбирают письма и пишут вложения на диск,
+    пока сеть качает следующие пачки. Письма из *large* качаются по
+    частям по *structures*. Письма отдаются по мере готовности, не по
+    порядку *uids*; если закрыть генератор раньше, конвейер остановится.
+    """
+    raw: queue.Queue[tuple[Uid, bytes] | None] = queue.Queue(max_queued)
+    ready: queue.Queue[Any] = queue.Queue()  # Email, исключение или _DONE
+    stopped = threading.Event()
+
+    def put_raw(item: tuple[Uid, bytes]) -> None:
+        # очередь полна — ждём разборщиков, но не дольше, чем до остановки
+        while not stopped.is_set():
+            try:
+                raw.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def fetch(batch: list[Uid]) -> None:
+        if stopped.is_set():
+            return
+        fetched = _fetch_batch(pool, batch, "(RFC822)")
+        for uid in batch:
+            if uid not in fetched:
+                raise CantReadEmail(f"Не удалось получить письмо uid={uid!r}")
+            put_raw((uid, fetched[uid]["RFC822"]))
+
+    def stream(uid: Uid) -> None:
+        if not stopped.is_set():
+            ready.put(_stream_message(pool, uid, structures[uid], save_attachments_directory))
+
+    def parse() -> None:
+        while (item := raw.get()) is not None:
+            if stopped.is_set():
+                continue  # только разгружаем очередь
+            try:
+                ready.put(parse_message(*item, save_attachments_directory))
+            except Exception as e:
+                stopped.set()
+                ready.put(e)
+
+    def run() -> None:
+        parsers = [threading.Thread(target=propagate(parse), name=f"mail-parse-{i}", daemon=True)
+                   for i in range(max(parse_workers, 1))]
+        for parser in parsers:
+            parser.start()
+        small = [uid for uid in uids if uid not in large]
+        batches = [small[i:i + batch_size] for i in range(0, len(small), batch_size)]
+        try:
+            with ThreadPoolExecutor(pool.size, thread_name_prefix="mail-fetch") as executor:
+                futures = [executor.submit(propagate(fetch), batch) for batch in batches]
+                futures += [executor.submit(propagate(stream), uid) for uid in large]
+                for future in as_completed(futures):
+                    if (error := future.exception()) is not None and not stopped.is_set():
+                        stopped.set()
+                        ready.put(error)
+        finally:
+            for _ in parsers:
+                raw.put(None)
+            for parser in parsers:
+                parser.join()
+            ready.put(_DONE)
+
+    coordinator = threading.Thread(target=propagate(run), name="mail-pipeline", daemon=True)
+    coordinator.start()
+    try:
+        while (item := ready.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        coordinator.join()
+
+
+@traced("mail.fetch_emails")
+def iter_emails(
+    days: int = 2,
+    save_attachments_directory: str = "attachments",
+    connections: int = IMAP_CONNECTIONS,
+    batch_size: int = IMAP_FETCH_BATCH,
+    incremental: bool = IMAP_INCREMENTAL,
+    skip_processed: bool = False,
+    parse_workers: int = EMAIL_PARSE_WORKERS,
+) -> Iterator[Email]:
+    """
+    Почтовые сообщения и вложения за последние *days* суток — по мере
+    готовности: сначала уже скачанные (из локального индекса), затем
+    новые, в том порядке, в каком их успели скачать и разобрать.
+
+    *connections* — сколько IMAP-соединений качают параллельно,
+    *batch_size* — сколько писем запрашивается одним UID FETCH,
+    *parse_workers* — сколько потоков разбирают письма (stream_messages).
+    При *incremental* уже скачанные письма берутся из локального индекса,
+    с сервера качаются только новые. *skip_processed* пропускает письма,
+    отмеченные mark_emails_processed.
+    """
     # вычисляем дату за какой промежуток собираем информацию
     since = datetime.now(timezone.utc) - timedelta(days=days)
-    since_str = _imap_date(since)
 
-    # ── Подключаемся ─────────────
-    imap = imaplib.IMAP4_SSL(imap_host, imap_port) # Создаёт SSL-соединение
-    imap.login(user, password)                     # Авторизация
-    imap.select("INBOX")                           # Залетаем во входящие письма
+    # ── Готовим каталог для вложений ─────────────
+    Path(save_attachments_directory).mkdir(exist_ok=True)
+    state = load_mail_state(save_attachments_directory) if incremental else MailState()
+
+    with ImapPool(connections) as pool:
+        # ── Ищем письма ─────────────
+        with pool.connection() as imap:
+            if incremental:
+                uid_validity = read_uid_validity(imap)
+                if uid_validity != state.uid_validity:
+                    if state.uid_validity:
+                        print("UIDVALIDITY сменился, полная синхронизация")
+                    state.reset(uid_validity)
+            if incremental and state.covers_messages(since):
+                # письма до last_uid уже в индексе, на сервере ищем только новее; после
+                # прерванного запуска часть новых уже может быть в индексе
+                newer = search_after(imap, state.last_uid, since)
+                uids = sorted(set(state.known_uids(since)).union(newer), key=int)
+            else:
+                uids = _search_since(imap, since)
+        print(f"Найдено {len(uids)} писем за последние {days} дня(ей)")
+
+        known = {uid: state.get(uid.decode()) for uid in uids}
+        new_uids = [uid for uid in uids if known[uid] is None]
+        if incremental:
+            print(f"Новых писем: {len(new_uids)}")
+
+        # ── Большие письма качаем по частям, остальные — пачками целиком ─────────────
+        structures = fetch_items(pool, new_uids, "(UID RFC822.SIZE)", batch_size)
+        large = {uid for uid in new_uids if int(structures[uid]["RFC822.SIZE"]) > STREAM_THRESHOLD}
+        if large:
+            structures.update(fetch_items(
+                pool, sorted(large), "(UID RFC822.SIZE ENVELOPE BODYSTRUCTURE)", batch_size))
+        annotate(messages=len(uids), new_messages=len(new_uids), streamed_messages=len(large))
+
+        # ── Отдаём письма, пока следующие ещё качаются и разбираются ───────────────
+        completed = False
+        fresh = stream_messages(pool, new_uids, large, structures, save_attachments_directory,
+                                batch_size, parse_workers)
+        # генератор закрывается до пула: конвейер не должен пережить соединения
+        with closing(fresh):
+            try:
+                for message in chain((m for m in known.values() if m is not None), fresh):
+                    state.add(message.uid, message)
+                    if not (skip_processed and state.is_processed(message.uid)):
+                        yield message
+                completed = True
+            finally:
+                if incremental:
+                    # при остановке на полпути в индексе остаются уже разобранные письма
+                    window = None
+                    if completed:
+                        window = {uid.decode() for uid in uids}
+                        # письма отдаются не по порядку, поэтому last_uid — только когда скачаны все
+                        state.last_uid = max([state.last_uid, *map(int, uids)])
+                    update_mail_state(save_attachments_directory,
+                                      lambda current: current.merge_messages(state, window, since))
+
+
+def fetch_emails(
+    days: int = 2,
+    save_attachments_directory: str = "attachments",
+    connections: int = IMAP_CONNECTIONS,
+    batch_size: int = IMAP_FETCH_BATCH,
+    incremental: bool = IMAP_INCREMENTAL,
+    skip_processed: bool = False,
+    parse_workers: int = EMAIL_PARSE_WORKERS,
+) -> list[Email]:
+    """Все письма iter_emails одним списком, по возрастанию UID"""
+    emails = iter_emails(days, save_attachments_directory, connections, batch_size,
+                         incremental, skip_processed, parse_workers)
+    return sorted(emails, key=lambda message: int(message.uid))
+
+
+def _text(value: bytes | None) -> str:
+    return _decode(value.decode("utf-8", errors="ignore")) if value else ""
+
+
+def _params(pairs: list | None) -> dict[str, str]:
+    """("NAME" "a.pdf" "CHARSET" "utf-8") → {"name": "a.pdf", "charset": "utf-8"}"""
+    if not isinstance(pairs, list):
+        return {}
+    return {
+        pairs[i].decode().lower(): (pairs[i + 1] or b"").decode("utf-8", errors="ignore")
+        for i in range(0, len(pairs) - 1, 2)
+    }
+
+
+def _part_filename(*params: dict[str, str]) -> str | None:
+    """Имя файла из параметров Content-Disposition/Content-Type"""
+    for values in params:
+        for key in ("filename", "name"):
+            if values.get(key):
+                return _decode(values[key]).strip()
+            if values.get(f"{key}*"):  # RFC 2231: utf-8''%D0%B0%D0%BA%D1%82.pdf
+                charset, _, value = values[f"{key}*"].partition("''")
+                return unquote(value or charset, encoding=charset if value else "utf-8").strip()
+    return None
 
-    # ── Ищем письма ─────────────
-    status, data = imap.search(None, "SINCE", since_str)  # 'SINCE 26-June-2025'
-    if status != "OK":
-        raise CantSearchEmails("Поиск не удался:", data)
 
-    ids = data[0].split()
-    print(f"Найдено {len(ids)} писем за последние {days} дня(ей)")
+@dataclass
+class _Part:
+    """Листовая часть письма из BODYSTRUCTURE"""
+    number: str  # номер для BODY[...]
+    mime_type: str
+    size: int
+    encoding: str
+    charset: str
+    filename: str | None  # есть только у вложений
+
+    def attachment(self) -> AttachmentInfo:
+        return AttachmentInfo(
+            filename=self.filename or "",
+            part=self.number,
+            mime_type=self.mime_type,
+            size=self.size,
+            encoding=self.encoding,
+        )
 
-    # ── Готовим каталог для вложений ─────────────
-    Path(SAVE_ATTACHMENTS_DIRECTORY).mkdir(exist_ok=True)
 
-    # ── Обрабатываем каждое письмо ───────────────
-    for num in ids:
-        status, msg_data = imap.fetch(num, "(RFC822)") # RFC822 - это стандарт, который определяет формат электронных писем
-        if status != "OK":
-            raise CantReadEmail(f"Не удалось получить письмо id={num}")
+def _structure_parts(structure: list, number: str = "") -> list[_Part]:
+    """Листовые части из BODYSTRUCTURE с номерами для BODY[...]"""
+    if structure and isinstance(structure[0], list):  # multipart: сначала части, потом подтип
+        parts = []
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            parts += _structure_parts(child, f"{number}.{index}" if number else str(index))
+        return parts
+
+    maintype = (structure[0] or b"").decode().lower()
+    subtype = (structure[1] or b"").decode().lower()
+    # после размера идут поля, зависящие от типа части, потом disposition
+    disposition_index = {"text": 9, "message": 11}.get(maintype, 8)
+    if maintype == "message" and subtype != "rfc822":
+        disposition_index = 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    disposition_params = _params(disposition[1]) if isinstance(disposition, list) \
+        and len(disposition) > 1 else {}
+    content_params = _params(structure[2])
+    return [_Part(
+        number=number or "1",
+        mime_type=f"{maintype}/{subtype}",
+        size=int(structure[6] or 0),
+        encoding=(structure[5] or b"7bit").decode().lower(),
+        charset=content_params.get("charset", ""),
+        filename=_part_filename(disposition_params, content_params),
+    )]
+
+
+def _structure_attachments(structure: list) -> list[AttachmentInfo]:
+    """Вложения из BODYSTRUCTURE"""
+    return [part.attachment() for part in _structure_parts(structure) if part.filename]
+
+
+@traced("mail.fetch_headers")
+def fetch_email_headers(
+    days: int = 2,
+    connections: int = IMAP_CONNECTIONS,
+    batch_size: int = IMAP_FETCH_BATCH,
+    save_attachments_directory: str = "attachments",
+    incremental: bool = IMAP_INCREMENTAL,
+) -> list[EmailHeader]:
+    """
+    Тема, дата и список вложений писем за последние *days* суток —
+    без тел писем и содержимого вложений. При *incremental* заголовки
+    хранятся в индексе рядом с вложениями, и с сервера качаются только
+    заголовки новых писем.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    if incremental:
+        Path(save_attachments_directory).mkdir(exist_ok=True)
+    state = load_mail_state(save_attachments_directory) if incremental else MailState()
+    with ImapPool(connections) as pool:
+        known: list[Uid] = []
+        with pool.connection() as imap:
+            if incremental:
+                uid_validity = read_uid_validity(imap)
+                if uid_validity != state.uid_validity:
+                    state.reset(uid_validity)
+            if incremental and state.covers_headers(since):
+                known = state.known_header_uids(since)
+                new_uids = search_after(imap, state.headers_last_uid, since)
+            else:
+                new_uids = _search_since(imap, since)
+        print(f"Найдено {len(known) + len(new_uids)} писем за последние {days} дня(ей)")
+        annotate(messages=len(known) + len(new_uids), new_messages=len(new_uids))
+        headers = ([state.get_header(uid.decode()) for uid in known]
+                   + fetch_headers(pool, new_uids, batch_size))
+    if incremental:
+        update_mail_state(save_attachments_directory,
+                          lambda current: current.merge_headers(state, headers, since))
+    return headers
+
+
+def fetch_headers(
+    pool: ImapPool, uids: list[Uid], batch_size: int = IMAP_FETCH_BATCH
+) -> list[EmailHeader]:
+    """Заголовки и список вложений писем *uids*, в том же порядке"""
+    fetched = fetch_items(pool, uids, "(UID ENVELOPE BODYSTRUCTURE)", batch_size)
+    headers = []
+    for uid in uids:
+        envelope = fetched[uid]["ENVELOPE"]  # (date subject from sender ...)
+        headers.append(EmailHeader(
+            uid=uid.decode(),
+            subject=_text(envelope[1]),
+            date=_text(envelope[0]),
+            attachments=_structure_attachments(fetched[uid]["BODYSTRUCTURE"]),
+        ))
+    return headers
 
-        msg = email.message_from_bytes(msg_data[0][1])
 
-        email_subject = _decode(msg.get("Subject", ""))
-        email_date = msg.get("Date", "")
+# Ожидание новых писем (для watcher.py)
 
+
+def search_after(imap: imaplib.IMAP4, last_uid: int, since: datetime | None = None) -> list[Uid]:
+    """UID писем, пришедших после *last_uid* (и, если задано, не раньше *since*)"""
+    criteria = ["UID", f"{last_uid + 1}:*"]
+    if since is not None:
+        criteria += ["SINCE", _imap_date(since)]
+    with span("imap.search") as search:
+        status, data = imap.uid("SEARCH", None, *criteria)
+        if status != "OK":
+            raise CantSearchEmails("Поиск не удался:", data)
+        # «N:*» по RFC 3501 включает последнее письмо, даже если его UID меньше N
+        uids = [uid for uid in data[0].split() if int(uid) > last_uid]
+        search.set(messages=len(uids))
+    return uids
+
+
+def supports_idle(imap: imaplib.IMAP4) -> bool:
+    return "IDLE" in imap.capabilities
+
+
+def idle(imap: imaplib.IMAP4, timeout: float) -> bool:
+    """
+    Ждёт изменений в папке командой IDLE (RFC 2177), но не дольше
+    *timeout* секунд. True — сервер сообщил о новых письмах (EXISTS).
+
+    Ответ сервера ждём через select по сокету: таймаут на самом сокете
+    ломает буферизованный файл imaplib. Если сервер прислал EXISTS в том
+    же пакете, что и «+ idling», select его не увидит, и письмо заметится
+    по истечении *timeout* — поэтому вызывающий всё равно ищет новые UID
+    после каждого IDLE.
+    """
+    tag = imap._new_tag()
+    imap.send(tag + b" IDLE\r\n")
+    line = imap.readline()
+    if not line.startswith(b"+"):
+        raise CantSearchEmails(f"Сервер не принял IDLE: {line!r}")
+    changed = False
+    deadline = time.monotonic() + timeout
+    with span("imap.idle", timeout=timeout) as waiting:
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([imap.sock], [], [], remaining)[0]:
+                break
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("соединение закрыто во время IDLE")
+            changed = line.startswith(b"*") and line.rstrip().endswith(b"EXISTS")
+        imap.send(b"DONE\r\n")
+        while not (line := imap.readline()).startswith(tag):
+            if not line:
+                raise imaplib.IMAP4.abort("соединение закрыто во время IDLE")
+            changed = changed or line.rstrip().endswith(b"EXISTS")
+        waiting.set(changed=changed)
+    if line.split(b" ")[1:2] != [b"OK"]:
+        raise CantSearchEmails(f"IDLE завершился ошибкой: {line!r}")
+    return changed
+
+
+class _Base64Decoder:
+    """Декодирует base64 по кускам: хвост, не кратный 4 символам, ждёт следующего куска"""
+
+    def __init__(self):
+        self._tail = b""
+
+    def decode(self, chunk: bytes) -> bytes:
+        data = self._tail + chunk.translate(None, b" \t\r\n")
+        cut = len(data) - len(data) % 4
+        self._tail = data[cut:]
+        return binascii.a2b_base64(data[:cut])
+
+    def flush(self) -> bytes:
+        tail, self._tail = self._tail, b""
+        return binascii.a2b_base64(tail + b"=" * (-len(tail) % 4)) if tail else b""
+
+
+class _QuotedPrintableDecoder:
+    """Декодирует quoted-printable по кускам: незаконченная строка ждёт следующего куска"""
+
+    def __init__(self):
+        self._tail = b""
+
+    def decode(self, chunk: bytes) -> bytes:
+        data = self._tail + chunk
+        cut = data.rfind(b"\n") + 1
+        self._tail = data[cut:]
+        return binascii.a2b_qp(data[:cut])
+
+    def flush(self) -> bytes:
+        tail, self._tail = self._tail, b""
+        return binascii.a2b_qp(tail)
+
+
+class _IdentityDecoder:
+    def decode(self, chunk: bytes) -> bytes:
+        return chunk
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder(encoding: str) -> _Base64Decoder | _QuotedPrintableDecoder | _IdentityDecoder:
+    if encoding == "base64":
+        return _Base64Decoder()
+    if encoding == "quoted-printable":
+        return _QuotedPrintableDecoder()
+    return _IdentityDecoder()
+
+
+def _fetch_one(imap: imaplib.IMAP4, uid: str, items: str) -> FetchItems:
+    status, data = imap.uid("FETCH", uid, items)
+    fetched = _parse_fetch(data) if status == "OK" else []
+    if not fetched:
+        raise CantReadEmail(f"Не удалось получить письмо uid={uid}")
+    return fetched[0]
+
+
+def _stream_part(imap: imaplib.IMAP4, uid: str, part: _Part, f: BinaryIO) -> None:
+    """Качает часть письма кусками BODY.PEEK[n]<начало.длина> и сразу декодирует в *f*"""
+    decoder = _decoder(part.encoding)
+    offset = 0
+    while True:
+        fields = _fetch_one(imap, uid, f"(BODY.PEEK[{part.number}]<{offset}.{ATTACHMENT_CHUNK}>)")
+        chunk = fields.get(f"BODY[{part.number}]<{offset}>") or b""
+        f.write(decoder.decode(chunk))
+        offset += len(chunk)
+        if len(chunk) < ATTACHMENT_CHUNK:
+            break
+    f.write(decoder.flush())
+
+
+def _stream_message(
+    pool: ImapPool, uid: Uid, fields: FetchItems, save_attachments_directory: str
+) -> Email:
+    """Собирает Email по ENVELOPE/BODYSTRUCTURE, вложения пишет в файлы по кускам"""
+    envelope = fields["ENVELOPE"]  # (date subject from sender ...)
+    parts = _structure_parts(fields["BODYSTRUCTURE"])
+    uid_text = uid.decode()
+    with pool.connection() as imap:
         # Текст письма (всегда берём первую текстовую часть)
         body = ""
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            if ctype == "text/plain" and part.get_filename() is None:
-                charset = part.get_content_charset() or "utf-8"
-                body = part.get_payload(decode=True).decode(charset, errors="ignore")
-                break
-        email_body = body
+        text = next((p for p in parts if p.mime_type == "text/plain" and not p.filename), None)
+        if text is not None:
+            buffer = io.BytesIO()
+            _stream_part(imap, uid_text, text, buffer)
+            body = buffer.getvalue().decode(text.charset or "utf-8", errors="ignore")
 
         # Вложения
         attachments: list[Filename] = []
-        for part in msg.walk():
-            filename = part.get_filename()
-            if filename:
-                print("attachments", filename)
-                filename = _decode(filename).strip()
-                filepath = Path(SAVE_ATTACHMENTS_DIRECTORY) / filename
-                # предотвращаем перезапись
-                if filepath.exists():
-                    base, ext = os.path.splitext(filename)
-                    filepath = Path(SAVE_ATTACHMENTS_DIRECTORY) / f"{base}_{num.decode()}{ext}"
-                with open(filepath, "wb") as f:
-                    f.write(part.get_payload(decode=True))
+        for part in parts:
+            if part.filename:
+                print("attachments", part.filename)
+                with span("mail.attachment", streamed=True, bytes=part.size):
+                    filepath = attachment_store(save_attachments_directory).save(
+                        part.filename, uid_text, lambda f: _stream_part(imap, uid_text, part, f))
                 attachments.append(Filename(filepath))
 
-        emails.append(Email(
-            subject=email_subject,
-            body=email_body,
-            attachments=attachments,
-            date=email_date
-        ))
-    imap.close()
-    imap.logout() # завершение IMAP-сессии
-    return emails
+    return Email(
+        subject=_text(envelope[1]),
+        body=body,
+        attachments=attachments,
+        date=_text(envelope[0]),
+        uid=uid_text,
+    )
+
+
+@traced("mail.download_attachment")
+def download_attachment(
+    uid: str, part: str, save_attachments_directory: str = "attachments",
+    pool: ImapPool | None = None,
+) -> Filename:
+    """
+    Скачивает одну часть письма (вложение) и по кускам сохраняет её в файл.
+    Соединение берётся из *pool*, а без него открывается своё.
+    """
+    Path(save_attachments_directory).mkdir(exist_ok=True)
+    if pool is None:
+        with ImapPool(1) as own_pool:
+            return _download_attachment(own_pool, uid, part, save_attachments_directory)
+    return _download_attachment(pool, uid, part, save_attachments_directory)
+
+
+def _download_attachment(pool: ImapPool, uid: str, part: str, save_attachments_directory: str) -> Filename:
+    with pool.connection() as imap:
+        structure = _fetch_one(imap, uid, "(UID BODYSTRUCTURE)")["BODYSTRUCTURE"]
+        info = next((p for p in _structure_parts(structure) if p.number == part and p.filename),
+                    None)
+        if info is None:
+            raise CantReadEmail(f"В письме uid={uid} нет вложения в части {part}")
+        with span("mail.attachment", streamed=True, bytes=info.size):
+            filepath = attachment_store(save_attachments_directory).save(
+                info.filename or "", uid, lambda f: _stream_part(imap, uid, info, f))
+    return Filename(filepath)
+
+
+@tool
+def fetch_recent_emails(days: int = 2, SAVE_ATTACHMENTS_DIRECTORY: str = "attachments") -> list[Email]:
+    """Возвращает почтовые сообщения и вложения за последние *days* суток."""
+    return fetch_emails(days, SAVE_ATTACHMENTS_DIRECTORY)
+
+
+@tool
+def fetch_recent_email_headers(days: int = 2) -> list[EmailHeader]:
+    """
+    Возвращает темы, даты и список вложений (имя, тип, размер) писем за
+    последние *days* суток, не скачивая сами вложения.
+    Чтобы получить файл вложения, вызови download_email_attachment.
+    """
+    return fetch_email_headers(days)
+
+
+@tool
+def download_email_attachment(
+    uid: str, part: str, SAVE_ATTACHMENTS_DIRECTORY: str = "attachments"
+) -> Filename:
+    """
+    Скачивает вложение письма *uid* (часть *part* из fetch_recent_email_headers)
+    и возвращает путь к сохранённому файлу.
+    """
+    return download_attachment(uid, part, SAVE_ATTACHMENTS_DIRECTORY)
 
 
 
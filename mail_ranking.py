@@ -0,0 +1,252 @@
+"""
+Локальный отбор вложений-кандидатов, прежде чем звать агента.
+
+Раньше агент получал темы и вложения всех писем за N суток и сам искал
+среди них карточку предприятия — на полном ящике это долгий и дорогой
+по токенам запрос. Теперь вложения сначала ранжируются здесь:
+
+- инвертированный индекс по словам темы, тела письма, имени файла и,
+  если файл уже скачан, его текста; слово приводится к основе (первые
+  STEM_LENGTH букв), чтобы «реквизиты» и «реквизитами» совпадали;
+- запрос — основы с весами (QUERY), у каждого поля свой вес (FIELD_WEIGHTS);
+- эвристики по расширению и MIME-типу: docx и pdf выше, картинки и
+  архивы ниже, слишком большие файлы ниже;
+- в тексте скачанного файла — сколько реквизитов нашли правила
+  requisites.py (ИНН, КПП, БИК, счета...);
+- свежие письма немного выше старых.
+
+select_candidates ранжирует вложения по заголовкам писем, скачивает
+лучшие и доранжирует их по тексту. Агенту уходят только эти top-k,
+а если какой-то из них целиком разбирается правилами, агент не нужен.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import math
+import mimetypes
+import os
+from pathlib import Path
+import re
+
+from dotenv import find_dotenv, load_dotenv
+
+from attachment_text import CantReadDocument, document_text
+from mail import IMAP_CONNECTIONS, Email, EmailHeader, ImapPool, download_attachment
+from requisites import find_requisites
+from telemetry import annotate, count, propagate, traced
+
+
+load_dotenv(find_dotenv())
+# Сколько вложений-кандидатов скачивать и показывать агенту
+CANDIDATES_TOP_K = int(os.getenv("MAIL_CANDIDATES") or 5)
+# Файлы больше этого размера не скачиваются для разбора текста
+CANDIDATE_MAX_BYTES = int(float(os.getenv("MAIL_CANDIDATE_MAX_MB") or 2) * 2**20)
+
+# Сколько первых букв слова считается его основой
+STEM_LENGTH = 6
+# Основы слов, по которым узнаётся карточка предприятия, и их веса
+QUERY = {
+    "реквиз": 3.0, "карточ": 3.0, "rekviz": 3.0, "requis": 3.0, "kartoc": 2.0,
+    "инн": 2.0, "кпп": 2.0, "бик": 2.0, "огрн": 1.5, "предпр": 1.0, "компан": 0.5,
+    "банк": 0.5, "счет": 0.5, "card": 1.0, "inn": 1.0,
+}
+FIELD_WEIGHTS = {"filename": 3.0, "subject": 2.0, "body": 1.0, "text": 1.0}
+# Расширения, которые разбирает requisites.py, и баллы за них
+EXTENSION_SCORES = {".docx": 2.0, ".pdf": 1.5, ".txt": 0.5}
+ARCHIVE_EXTENSIONS = {".zip", ".rar", ".7z", ".gz"}
+BINARY_MIME_TYPES = ("image/", "audio/", "video/")
+LARGE_FILE_BYTES = 5 * 2**20
+# Балл за реквизит, найденный правилами в тексте файла
+REQUISITE_SCORE = 1.5
+# Балл за свежесть: вдвое меньше за каждые RECENCY_HALF_LIFE_DAYS суток
+RECENCY_SCORE = 1.0
+RECENCY_HALF_LIFE_DAYS = 1.0
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+@dataclass
+class Candidate:
+    """Вложение письма, в котором могут быть реквизиты"""
+    uid: str  # UID письма
+    subject: str  # тема письма
+    date: str  # дата письма
+    filename: str  # имя файла во вложении
+    part: str = ""  # номер MIME-части для download_attachment; пусто — файл уже скачан
+    mime_type: str = ""
+    size: int = 0  # размер, байт
+    path: str | None = None  # скачанный файл
+    score: float = 0.0
+    matches: list[str] = field(default_factory=list)  # за что начислены баллы
+
+
+def stems(text: str) -> list[str]:
+    """Основы слов текста: без цифр, в нижнем регистре, ё → е"""
+    return [word[:STEM_LENGTH] for word in _WORD_RE.findall(text.lower().replace("ё", "е"))]
+
+
+def _age_days(date: str, now: datetime) -> float | None:
+    try:
+        sent = parsedate_to_datetime(date)
+    except (TypeError, ValueError):
+        return None
+    if sent.tzinfo is None:
+        sent = sent.replace(tzinfo=timezone.utc)
+    return max((now - sent).total_seconds() / 86400, 0.0)
+
+
+class MailIndex:
+    """
+    Инвертированный индекс по вложениям писем: основа слова → {номер
+    вложения: вес}. Баллы, не зависящие от запроса (тип файла, размер,
+    свежесть, реквизиты в тексте), копятся отдельно в _bonus.
+    """
+
+    def __init__(self, now: datetime | None = None):
+        self.now = now or datetime.now(timezone.utc)
+        self.candidates: list[Candidate] = []
+        self._postings: dict[str, dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        self._bonus: list[float] = []
+        self._notes: list[list[str]] = []
+        self._documents: dict[int, int] = {}  # id(кандидата) → номер вложения
+
+    def _index(self, document: int, field_name: str, text: str) -> None:
+        counts: dict[str, int] = defaultdict(int)
+        for stem in stems(text):
+            counts[stem] += 1
+        weight = FIELD_WEIGHTS[field_name]
+        for stem, occurrences in counts.items():
+            # повторы слова в длинном тексте почти ничего не добавляют
+            self._postings[stem][document] += weight * (1 + math.log(occurrences))
+
+    def _add(self, candidate: Candidate, body: str = "") -> None:
+        document = len(self.candidates)
+        self.candidates.append(candidate)
+        self._documents[id(candidate)] = document
+        bonus, notes = 0.0, []
+        suffix = Path(candidate.filename).suffix.lower()
+        mime_type = candidate.mime_type = (
+            candidate.mime_type or mimetypes.guess_type(candidate.filename)[0] or "")
+        if suffix in EXTENSION_SCORES:
+            bonus += EXTENSION_SCORES[suffix]
+            notes.append(suffix)
+        elif suffix in ARCHIVE_EXTENSIONS:
+            bonus -= 1.0
+            notes.append("архив")
+        if mime_type.startswith(BINARY_MIME_TYPES):
+            bonus -= 2.0
+            notes.append(mime_type)
+        if candidate.size > LARGE_FILE_BYTES:
+            bonus -= 1.0
+            notes.append("большой файл")
+        age = _age_days(candidate.date, self.now)
+        if age is not None:
+            bonus += RECENCY_SCORE * 0.5 ** (age / RECENCY_HALF_LIFE_DAYS)
+        self._bonus.append(bonus)
+        self._notes.append(notes)
+
+        self._index(document, "filename", candidate.filename)
+        self._index(document, "subject", candidate.subject)
+        if body:
+            self._index(document, "body", body)
+
+    def add_header(self, header: EmailHeader) -> None:
+        """Вложения письма, известные только по BODYSTRUCTURE"""
+        for attachment in header.attachments:
+            self._add(Candidate(header.uid, header.subject, header.date, attachment.filename,
+                                attachment.part, attachment.mime_type, attachment.size))
+
+    def add_email(self, message: Email) -> None:
+        """Письмо с телом и уже скачанными вложениями; их текст тоже индексируется"""
+        for path in message.attachments:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            candidate = Candidate(message.uid, message.subject, message.date,
+                                  Path(path).name, size=size, path=str(path))
+            self._add(candidate, message.body)
+            self.add_file(candidate)
+
+    def add_file(self, candidate: Candidate) -> None:
+        """Индексирует текст скачанного вложения и ищет в нём реквизиты"""
+        document = self._documents[id(candidate)]
+        if (candidate.path is None or candidate.size > CANDIDATE_MAX_BYTES
+                or Path(candidate.path).suffix.lower() not in EXTENSION_SCORES):
+            return
+        try:
+            text = document_text(candidate.path)
+        except (CantReadDocument, OSError):
+            return
+        self._index(document, "text", text)
+        found = find_requisites(text)
+        if found:
+            self._bonus[document] += REQUISITE_SCORE * len(found)
+            self._notes[document].append(f"реквизитов в тексте: {len(found)}")
+
+    def rank(self, top_k: int = CANDIDATES_TOP_K, query: dict[str, float] = QUERY) -> list[Candidate]:
+        """Лучшие *top_k* вложений по запросу, по убыванию балла"""
+        scores = list(self._bonus)
+        matches: list[list[str]] = [list(notes) for notes in self._notes]
+        for stem, weight in query.items():
+            for document, term_weight in self._postings.get(stem, {}).items():
+                scores[document] += weight * term_weight
+                matches[document].append(stem)
+        ranked = sorted(range(len(self.candidates)), key=lambda document: -scores[document])
+        top = []
+        for document in ranked[:top_k]:
+            candidate = self.candidates[document]
+            candidate.score = round(scores[document], 2)
+            candidate.matches = matches[document]
+            top.append(candidate)
+        return top
+
+
+@traced("mail.select_candidates")
+def select_candidates(
+    headers: list[EmailHeader],
+    save_attachments_directory: str = "attachments",
+    top_k: int = CANDIDATES_TOP_K,
+    now: datetime | None = None,
+) -> list[Candidate]:
+    """
+    Ранжирует вложения по заголовкам, скачивает *top_k* лучших из тех,
+    что можно разобрать (docx, pdf, txt не больше CANDIDATE_MAX_BYTES),
+    и переранжирует всё с учётом их текста. Остальные вложения не
+    скачиваются вовсе; вложение, которое скачать не удалось, остаётся
+    кандидатом без path.
+    """
+    index = MailIndex(now)
+    for header in headers:
+        index.add_header(header)
+    shortlist = [candidate for candidate in index.rank(len(index.candidates))
+                 if candidate.size <= CANDIDATE_MAX_BYTES
+                 and Path(candidate.filename).suffix.lower() in EXTENSION_SCORES][:top_k]
+
+    def download(pool: ImapPool, candidate: Candidate) -> None:
+        try:
+            candidate.path = str(download_attachment(
+                candidate.uid, candidate.part, save_attachments_directory, pool))
+        except Exception as e:  # письмо удалили или оно битое — остальные кандидаты всё равно нужны
+            print(f"не удалось скачать «{candidate.filename}» из письма uid={candidate.uid}: {e}")
+            count("candidate_download_errors")
+
+    connections = max(min(len(shortlist), IMAP_CONNECTIONS), 1)
+    with ImapPool(connections) as pool, ThreadPoolExecutor(connections) as executor:
+        list(executor.map(propagate(lambda candidate: download(pool, candidate)), shortlist))
+    for candidate in shortlist:
+        index.add_file(candidate)
+    annotate(attachments=len(index.candidates),
+             downloaded=sum(candidate.path is not None for candidate in shortlist))
+    return index.rank(top_k)
+
+
+def describe_candidates(candidates: list[Candidate]) -> str:
+    """Кандидаты одной строкой на вложение — для запроса к агенту"""
+    lines = []
+    for candidate in candidates:
+        where = (f"уже скачан: {candidate.path}" if candidate.path
+                 else f"uid={candidate.uid}, part={candidate.part}")
+        lines.append(f"- «{candidate.filename}» ({candidate.mime_type or 'тип неизвестен'}, "
+                     f"{candidate.size // 1024} КБ) из письма «{candidate.subject}» "
+                     f"от {candidate.date}; {where}")
+    return "\n".join(lines)
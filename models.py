@@ -0,0 +1,124 @@
+"""
+Модели данных документов: заказчик, его банк и выполненные работы.
+
+Вынесены из act_generate.py, чтобы рендер документов и пакетная
+генерация не тянули за собой LangChain и GigaChat.
+
+Модели проверяют себя при создании (в том числе когда их собирает
+LangChain из аргументов вызова инструмента): ошибка уходит модели
+текстом, и она может исправить данные. Суммы и НДС в Job не хранятся —
+их один раз считает totals.py.
+"""
+from dataclasses import dataclass, fields
+import re
+from typing import Any
+
+
+class InvalidDocumentData(ValueError):
+    """Данные документа не прошли проверку"""
+
+
+def _digits(value: Any, name: str, lengths: tuple[int, ...]) -> str:
+    """Номер без пробелов и дефисов; длина — одна из *lengths*"""
+    digits = re.sub(r"[\s-]", "", str(value))
+    if not digits.isdigit() or len(digits) not in lengths:
+        expected = " или ".join(map(str, lengths))
+        raise InvalidDocumentData(f"{name}: ожидается {expected} цифр, получено «{value}»")
+    return digits
+
+
+def _text(value: Any, name: str) -> str:
+    text = str(value).strip()
+    if not text:
+        raise InvalidDocumentData(f"{name}: пустое значение")
+    return text
+
+
+def _known_fields(cls: type, data: dict) -> dict:
+    """Только поля модели: в старых JSON есть лишние (price_total и т.п.)"""
+    names = [field.name for field in fields(cls)]
+    missing = [name for name in names if data.get(name) in (None, "")]
+    if missing:
+        raise InvalidDocumentData(f"не заполнены поля: {', '.join(missing)}")
+    return {key: value for key, value in data.items() if key in names}
+
+
+@dataclass(slots=True)
+class Bank:
+    """Банковские реквизиты заказчика"""
+    name: str  # наименование банка
+    current_account: str  # расчётный счёт
+    corporate_account: str  # корреспондентский счёт
+    BIC: str  # БИК банка
+
+    def __post_init__(self):
+        self.name = _text(self.name, "банк")
+        self.current_account = _digits(self.current_account, "расчётный счёт", (20,))
+        self.corporate_account = _digits(self.corporate_account, "корреспондентский счёт", (20,))
+        self.BIC = _digits(self.BIC, "БИК", (9,))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Bank":
+        return cls(**_known_fields(cls, data))
+
+
+@dataclass(slots=True)
+class Customer:
+    """Заказчик"""
+    name: str  # полное название юридического лица, наприемер, ООО «Рога и копыта»
+    INN: str  # ИНН
+    KPP: str  # КПП, а у ИП — ОГРНИП
+    address: str  # юридический адрес
+    signatory: str  # подписант
+    bank: Bank  # банковские реквизиты заказчика
+
+    def __post_init__(self):
+        self.name = _text(self.name, "название")
+        self.INN = _digits(self.INN, "ИНН", (10, 12))
+        self.KPP = _digits(self.KPP, "КПП/ОГРН", (9, 13, 15))
+        self.address = _text(self.address, "адрес")
+        self.signatory = _text(self.signatory, "подписант")
+        if isinstance(self.bank, dict):
+            try:
+                self.bank = Bank.from_dict(self.bank)
+            except InvalidDocumentData as e:
+                raise InvalidDocumentData(f"банк: {e}") from None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Customer":
+        """Банк вложенным словарём или плоскими полями bank_name, bank_BIC, ... (как в CSV)"""
+        if "bank" not in data:
+            data = {**data, "bank": {key.removeprefix("bank_"): value
+                                     for key, value in data.items() if key.startswith("bank_")}}
+        return cls(**_known_fields(cls, data))
+
+
+@dataclass(slots=True)
+class Job:
+    """Выполненная работа; сумма по строке и НДС считаются в totals.py"""
+    task: str  # выполненная задача
+    count: int  # количество
+    unit: str  # единица измерения
+    price: float  # цена за единицу, руб.
+
+    def __post_init__(self):
+        self.task = _text(self.task, "наименование работы")
+        self.unit = _text(self.unit, "единица измерения")
+        # из JSON и CSV числа приходят и строками
+        try:
+            self.price = float(self.price)
+            count = float(self.count)
+        except (TypeError, ValueError):
+            raise InvalidDocumentData(
+                f"{self.task}: количество и цена должны быть числами") from None
+        if not count.is_integer():
+            raise InvalidDocumentData(f"{self.task}: количество должно быть целым")
+        self.count = int(count)
+        if self.count <= 0:
+            raise InvalidDocumentData(f"{self.task}: количество должно быть больше нуля")
+        if self.price < 0:
+            raise InvalidDocumentData(f"{self.task}: цена не может быть отрицательной")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        return cls(**_known_fields(cls, data))
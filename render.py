@@ -0,0 +1,426 @@
+"""
+Генерация PDF-документов (акт, счёт) из Typst-шаблонов.
+
+1. Собирает из заказчика и списка работ JSON с данными документа
+2. Компилирует шаблон из папки typst/: через CLI `typst compile`
+   или внутри процесса через Python-биндинги (TYPST_BACKEND=native)
+3. Умеет рендерить сразу много документов (пакетом), раскидывая
+   компиляции по пулу воркеров
+
+Каждый рендер идёт в своей временной папке (typst/.renders/<id>/) со
+своим JSON и PDF; шаблоны (act.typ, invoice.typ) общие
+и только читаются. Шаблон получает путь к своему JSON через
+`--input data=...`, поэтому документы можно собирать параллельно.
+
+Готовые PDF кэшируются на диске по хэшу шаблонов и данных документа:
+повторный запрос того же акта/счёта отдаётся из кэша без компиляции,
+а правка любого .typ-шаблона автоматически делает старые записи
+недействительными.
+Все компиляции идут через планировщик (RenderScheduler) с ограниченным
+числом одновременных процессов typst и ограниченной очередью.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import date
+from functools import lru_cache
+import json
+import os
+from pathlib import Path
+import shutil
+import subprocess  # для запуска внешних процессов
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Literal, TypeAlias
+import uuid  # для генерации уникальных имён документов
+
+from cache import DiskCache, content_hash
+from models import Customer, Job
+from telemetry import count, propagate, span
+from totals import VAT_RATES, compute_totals, format_money, money, totals_payload
+
+
+# Папка с шаблонами; она же --root для typst
+TYPST_DIRECTORY = Path(__file__).resolve().parent / "typst"
+# Временные папки рендеров (должны лежать внутри --root)
+RENDERS_DIRECTORY = TYPST_DIRECTORY / ".renders"
+# Куда складываются готовые документы, если путь не указан явно
+DOCUMENTS_DIRECTORY = Path(__file__).resolve().parent / "documents"
+
+# Сколько typst-процессов может работать одновременно (по умолчанию по числу ядер)
+TYPST_MAX_WORKERS = int(os.getenv("TYPST_MAX_WORKERS") or os.cpu_count() or 1)
+
+# Кэш готовых PDF и его предельный размер
+RENDER_CACHE_DIRECTORY = Path(__file__).resolve().parent / ".cache" / "pdf"
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB") or 200)
+
+DocumentKind: TypeAlias = Literal["act", "invoice"]  # вид документа = имя шаблона
+
+
+@dataclass
+class RenderResult:
+    """Результат рендеринга одного документа"""
+    kind: DocumentKind  # вид документа
+    pdf_path: Path | None  # путь к PDF, None если не получилось или PDF отдан байтами
+    seconds: float  # сколько заняла компиляция
+    error: str | None = None  # stderr typst, если компиляция упала
+    pdf_bytes: bytes | None = None  # содержимое PDF, если файл не сохраняли
+    cached: bool = False  # документ взят из кэша, компиляции не было
+
+
+class CantRenderDocument(Exception):
+    """Не получилось скомпилировать документ"""
+
+
+class RenderQueueFull(Exception):
+    """Очередь компиляций переполнена"""
+
+
+def document_payload(kind: DocumentKind, customer: Customer, jobs: list[Job]) -> dict:
+    """
+    Данные документа в том виде, в каком их читает шаблон: суммы по строкам,
+    итого и НДС уже посчитаны (ставка — по виду документа)
+    """
+    totals = compute_totals(jobs, VAT_RATES[kind])
+    return {
+        "customer": asdict(customer),
+        "jobs": [{**asdict(job), "price": format_money(money(job.price)),
+                  "amount": format_money(amount)}
+                 for job, amount in zip(jobs, totals.amounts)],
+        "totals": totals_payload(totals),
+    }
+
+
+@lru_cache(maxsize=16)
+def _templates_hash(stamp: tuple) -> str:
+    return content_hash(*(Path(path).read_bytes() for path, *_ in stamp))
+
+
+def templates_hash() -> str:
+    """Хэш всех .typ-шаблонов; пересчитывается только когда файлы меняются"""
+    stamp = tuple(
+        (str(path), path.stat().st_mtime_ns, path.stat().st_size)
+        for path in sorted(TYPST_DIRECTORY.glob("*.typ"))
+    )
+    return _templates_hash(stamp)
+
+
+def cache_key(kind: DocumentKind, payload: dict) -> str:
+    """
+    Ключ документа в кэше: шаблоны + вид документа + данные.
+
+    В ключ входит и сегодняшняя дата — шаблоны печатают её в документе.
+    """
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return content_hash(templates_hash(), kind, date.today().isoformat(), canonical)
+
+
+render_cache = DiskCache(RENDER_CACHE_DIRECTORY, RENDER_CACHE_MAX_MB * 2**20, suffix=".pdf")
+
+
+def _from_cache(
+    cache: DiskCache, key: str, kind: DocumentKind, pdf_path: Path | None
+) -> RenderResult | None:
+    started = time.perf_counter()
+    if pdf_path is None:
+        pdf_bytes = cache.get(key)
+        if pdf_bytes is None:
+            return None
+        return RenderResult(kind, None, time.perf_counter() - started,
+                            pdf_bytes=pdf_bytes, cached=True)
+    cached_path = cache.get_path(key)
+    if cached_path is None:
+        return None
+    try:
+        shutil.copyfile(cached_path, pdf_path)
+    except FileNotFoundError:  # успели вытеснить
+        return None
+    return RenderResult(kind, pdf_path, time.perf_counter() - started, cached=True)
+
+
+def _write_payload(path: Path, payload: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+
+def _data_input(data_path: Path) -> str:
+    # пути в typst считаются от --root, поэтому передаём путь относительно него
+    return "/" + data_path.resolve().relative_to(TYPST_DIRECTORY).as_posix()
+
+
+class SubprocessBackend:
+    """Компиляция через CLI: отдельный процесс `typst compile` на документ"""
+    name = "subprocess"
+
+    def compile(self, kind: DocumentKind, data_path: Path, pdf_path: Path) -> None:
+        """Запускает typst над шаблоном *kind* с данными из *data_path*"""
+        command = [
+            "typst", "compile",
+            "--root", str(TYPST_DIRECTORY),
+            "--input", f"data={_data_input(data_path)}",
+            str(TYPST_DIRECTORY / f"{kind}.typ"),
+            str(pdf_path),
+        ]
+        try:
+            subprocess.run(command,
+                           check=True,
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE,
+                           text=True,
+                           encoding="utf-8")
+        except subprocess.CalledProcessError as e:
+            raise CantRenderDocument(e.stderr) from e
+
+
+class NativeBackend:
+    """
+    Компиляция внутри процесса через Python-биндинги typst (`pip install typst`).
+
+    Компилятор каждого шаблона создаётся один раз на поток и дальше
+    переиспользуется: шрифты, разобранные шаблоны и пакет @preview/zero
+    остаются загруженными между документами.
+    """
+    name = "native"
+
+    def __init__(self):
+        import typst  # необязательная зависимость, нужна только этому бэкенду
+        self._typst = typst
+        self._local = threading.local()
+
+    def _compiler(self, kind: DocumentKind):
+        compilers = self._local.__dict__.setdefault("compilers", {})
+        if kind not in compilers:
+            compilers[kind] = self._typst.Compiler(
+                str(TYPST_DIRECTORY / f"{kind}.typ"),
+                root=str(TYPST_DIRECTORY),
+                package_path=os.getenv("TYPST_PACKAGE_PATH"),
+            )
+        return compilers[kind]
+
+    def compile(self, kind: DocumentKind, data_path: Path, pdf_path: Path) -> None:
+        try:
+            self._compiler(kind).compile(
+                output=str(pdf_path), sys_inputs={"data": _data_input(data_path)})
+        except self._typst.TypstError as e:
+            raise CantRenderDocument(str(e)) from e
+
+
+RenderBackend: TypeAlias = SubprocessBackend | NativeBackend
+
+
+def make_backend(name: str | None = None) -> RenderBackend:
+    """Бэкенд по имени: "subprocess" (по умолчанию) или "native" """
+    name = name or os.getenv("TYPST_BACKEND") or SubprocessBackend.name
+    if name == SubprocessBackend.name:
+        return SubprocessBackend()
+    if name == NativeBackend.name:
+        return NativeBackend()
+    raise ValueError(f"неизвестный бэкенд typst: {name}")
+
+
+def _render(
+    backend: RenderBackend, kind: DocumentKind, payload: dict, data_path: Path, pdf_path: Path
+) -> RenderResult:
+    started = time.perf_counter()
+    try:
+        with span("render.write_json", kind=kind):
+            _write_payload(data_path, payload)
+        with span("typst.compile", kind=kind, backend=backend.name):
+            backend.compile(kind, data_path, pdf_path)
+    except CantRenderDocument as e:
+        return RenderResult(kind, None, time.perf_counter() - started, str(e))
+    return RenderResult(kind, pdf_path, time.perf_counter() - started)
+
+
+@contextmanager
+def render_workspace() -> Iterator[Path]:
+    """Временная папка под один рендер, удаляется после использования"""
+    RENDERS_DIRECTORY.mkdir(exist_ok=True)
+    workspace = Path(tempfile.mkdtemp(dir=RENDERS_DIRECTORY))
+    try:
+        yield workspace
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def _render_isolated(
+    backend: RenderBackend, kind: DocumentKind, payload: dict, pdf_path: Path | None
+) -> RenderResult:
+    """
+    Рендерит документ в собственной папке.
+
+    Если *pdf_path* не указан, PDF возвращается в pdf_bytes
+    и на диске ничего не остаётся.
+    """
+    with render_workspace() as workspace:
+        result = _render(
+            backend,
+            kind,
+            payload,
+            workspace / f"{kind}.json",
+            pdf_path or workspace / f"{kind}.pdf",
+        )
+        if pdf_path is None and result.pdf_path is not None:
+            result.pdf_bytes = result.pdf_path.read_bytes()
+            result.pdf_path = None
+        return result
+
+
+def _render_and_cache(
+    backend: RenderBackend,
+    kind: DocumentKind,
+    payload: dict,
+    pdf_path: Path | None,
+    cache: DiskCache,
+    key: str,
+) -> RenderResult:
+    result = _render_isolated(backend, kind, payload, pdf_path)
+    if result.error is None:
+        cache.put(key, result.pdf_bytes if result.pdf_bytes is not None
+                  else result.pdf_path.read_bytes())  # type: ignore[union-attr]
+    return result
+
+
+class RenderScheduler:
+    """
+    Планировщик компиляций typst.
+
+    Одновременно идёт не больше *max_workers* компиляций typst,
+    ещё *max_queued* заданий могут ждать в очереди. Когда очередь
+    заполнена, submit блокируется (или падает с RenderQueueFull по
+    таймауту), чтобы не перегружать машину.
+
+    Документы, которые уже есть в *cache*, отдаются сразу, без очереди.
+    Компилирует *backend* (см. make_backend, по умолчанию из TYPST_BACKEND).
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        max_queued: int | None = None,
+        cache: DiskCache | None = render_cache,
+        backend: RenderBackend | None = None,
+    ):
+        self.max_workers = max_workers or TYPST_MAX_WORKERS
+        self.backend = backend or make_backend()
+        self._cache = cache
+        max_queued = self.max_workers * 4 if max_queued is None else max_queued
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="typst")
+        # свободные места = работающие + ожидающие задания
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_queued)
+
+    def submit(
+        self,
+        kind: DocumentKind,
+        customer: Customer,
+        jobs: list[Job],
+        pdf_path: str | Path | None,
+        timeout: float | None = None,
+    ) -> Future[RenderResult]:
+        """
+        Ставит документ в очередь и возвращает future с RenderResult.
+
+        При pdf_path=None PDF придёт байтами в RenderResult.pdf_bytes.
+        """
+        payload = document_payload(kind, customer, jobs)
+        pdf_path = Path(pdf_path) if pdf_path is not None else None
+        if self._cache is not None:
+            key = cache_key(kind, payload)
+            cached = _from_cache(self._cache, key, kind, pdf_path)
+            count("render_cache_lookups", kind=kind, result="hit" if cached else "miss")
+            if cached is not None:
+                future: Future[RenderResult] = Future()
+                future.set_result(cached)
+                return future
+
+        if not self._slots.acquire(timeout=timeout):
+            raise RenderQueueFull(f"очередь рендеринга заполнена, {kind} не принят")
+        try:
+            if self._cache is not None:
+                future = self._executor.submit(
+                    propagate(_render_and_cache), self.backend, kind, payload, pdf_path,
+                    self._cache, key)
+            else:
+                future = self._executor.submit(
+                    propagate(_render_isolated), self.backend, kind, payload, pdf_path)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> "RenderScheduler":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+
+_default_scheduler: RenderScheduler | None = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> RenderScheduler:
+    """Общий для процесса планировщик (один на все сессии и агентов)"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RenderScheduler()
+        return _default_scheduler
+
+
+def render_document(
+    kind: DocumentKind,
+    customer: Customer,
+    jobs: list[Job],
+    pdf_path: Path | None = None,
+) -> RenderResult:
+    """
+    Рендерит один документ через общий планировщик и ждёт результата.
+
+    PDF по умолчанию получает уникальное имя в папке documents/
+    (documents/act_<id>.pdf), так что параллельные сессии не
+    перезаписывают документы друг друга.
+    """
+    if pdf_path is None:
+        DOCUMENTS_DIRECTORY.mkdir(exist_ok=True)
+        pdf_path = DOCUMENTS_DIRECTORY / f"{kind}_{uuid.uuid4().hex[:12]}.pdf"
+    return default_scheduler().submit(kind, customer, jobs, pdf_path).result()
+
+
+def render_document_bytes(kind: DocumentKind, customer: Customer, jobs: list[Job]) -> bytes:
+    """Рендерит документ и возвращает содержимое PDF, не оставляя файлов на диске"""
+    result = default_scheduler().submit(kind, customer, jobs, None).result()
+    if result.error is not None:
+        raise CantRenderDocument(result.error)
+    return result.pdf_bytes  # type: ignore[return-value]
+
+
+def render_batch(
+    documents: Iterable[tuple[Customer, list[Job]]],
+    kind: DocumentKind,
+    output_directory: str | Path,
+    max_workers: int | None = None,
+    backend: RenderBackend | None = None,
+) -> list[RenderResult]:
+    """
+    Рендерит пачку документов одного вида, например акты за месяц
+    по всем контрагентам.
+
+    Каждый документ получает свой PDF (`<output_directory>/<kind>_0001.pdf`, ...),
+    компиляции идут параллельно в *max_workers* процессах typst
+    (по умолчанию по числу ядер). Результаты возвращаются в порядке
+    входных документов.
+    """
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    with RenderScheduler(max_workers, backend=backend) as scheduler:
+        futures = [
+            scheduler.submit(kind, customer, jobs, output_directory / f"{kind}_{index:04d}.pdf")
+            for index, (customer, jobs) in enumerate(documents, start=1)
+        ]
+        return [future.result() for future in futures]
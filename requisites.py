@@ -0,0 +1,207 @@
+"""
+Извлечение реквизитов контрагента из документа без LLM.
+
+Карточка предприятия (.docx, .pdf или текст) разбирается правилами:
+ИНН, КПП, БИК и счета ищутся по подписям и проверяются контрольными
+суммами, название, адрес, банк и подписант — по типовым подписям
+полей. Если хоть одно поле не нашлось или не прошло проверку,
+extract_customer возвращает None, и реквизиты разбирает агент по
+загруженному в GigaChat файлу, как раньше.
+
+Текст документа берётся из attachment_text.py: там он извлекается
+один раз и кэшируется по хэшу содержимого файла.
+"""
+from pathlib import Path
+import re
+from typing import BinaryIO
+
+from attachment_text import CantReadDocument, document_text
+from models import Customer, InvalidDocumentData
+
+
+# Контрольные суммы
+
+def inn_valid(inn: str) -> bool:
+    """Проверка контрольных цифр ИНН юрлица (10 цифр) и ИП (12 цифр)"""
+    def check(digits: str, weights: list[int]) -> int:
+        return sum(int(d) * w for d, w in zip(digits, weights)) % 11 % 10
+
+    if not inn.isdigit():
+        return False
+    if len(inn) == 10:
+        return check(inn, [2, 4, 10, 3, 5, 9, 4, 6, 8]) == int(inn[9])
+    if len(inn) == 12:
+        return (check(inn, [7, 2, 4, 10, 3, 5, 9, 4, 6, 8]) == int(inn[10])
+                and check(inn, [3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8]) == int(inn[11]))
+    return False
+
+
+def account_valid(account: str, bic: str, correspondent: bool = False) -> bool:
+    """Контрольный ключ счёта по БИК: для р/с — три последние цифры БИК, для к/с — 0 и 5–6 цифры"""
+    if len(account) != 20 or len(bic) != 9 or not (account + bic).isdigit():
+        return False
+    key = ("0" + bic[4:6] if correspondent else bic[-3:]) + account
+    return sum(int(d) * (7, 1, 3)[i % 3] for i, d in enumerate(key)) % 10 == 0
+
+
+# Поиск полей
+
+_SEP = r"[\s:№.\-–—]*"
+_ACCOUNT = r"(\d(?:[\d ]{18,28})\d)"
+
+_INN_RE = re.compile(rf"ИНН(?:\s*/\s*КПП)?{_SEP}(\d{{12}}|\d{{10}})(?!\d)(?:\s*/\s*(\d{{9}}))?")
+_KPP_RE = re.compile(rf"КПП{_SEP}(\d{{9}})(?!\d)")
+_OGRN_RE = re.compile(rf"ОГРН(?:ИП)?{_SEP}(\d{{15}}|\d{{13}})(?!\d)")
+_BIC_RE = re.compile(rf"БИК{_SEP}(\d{{9}})(?!\d)")
+_CURRENT_RE = re.compile(
+    rf"(?:р\s*/\s*сч?|р\.\s*с\.|расч[её]тный\s+сч[её]т){_SEP}{_ACCOUNT}", re.IGNORECASE)
+_CORRESPONDENT_RE = re.compile(
+    rf"(?:к\s*/\s*сч?|к\.\s*с\.|корр?\.?\s*сч[её]т|корреспондентский\s+сч[её]т){_SEP}{_ACCOUNT}",
+    re.IGNORECASE)
+# «Банк» как подпись поля — только в начале строки или ячейки, иначе это часть названия
+_BANK_RE = re.compile(
+    r"(?:Наименование\s+банка|Банк\s+получателя|(?:^|\t)Банк(?!\w))[\s:\t]*([^\n\t]+)",
+    re.MULTILINE)
+_BANK_AFTER_ACCOUNT_RE = re.compile(r"р\s*/\s*сч?\s*\d{20}\s+в\s+([^\n\t,]+)", re.IGNORECASE)
+# сначала юридический адрес, и только если его нет — любой другой
+_ADDRESS_RES = [
+    re.compile(r"(?:Юридический\s+адрес|Юр\.\s*адрес|Адрес\s+юридический|Адрес\s+регистрации)"
+               r"[\s:\t]*([^\n\t]+)", re.IGNORECASE),
+    re.compile(r"(?<!\w)Адрес(?:\s+местонахождения)?[\s:\t]*([^\n\t]+)", re.IGNORECASE),
+]
+_LEGAL_FORMS = {
+    "Общество с ограниченной ответственностью": "ООО",
+    "Публичное акционерное общество": "ПАО",
+    "Непубличное акционерное общество": "НАО",
+    "Закрытое акционерное общество": "ЗАО",
+    "Акционерное общество": "АО",
+}
+_NAME_RE = re.compile(r"(?<!\w)(ООО|ПАО|НАО|ЗАО|АО)\s*[«\"“„']+([^»\"”“'\n]+)[»\"”“']+")
+_IP_RE = re.compile(r"(?:(?<!\w)ИП|Индивидуальный\s+предприниматель)\s+"
+                    r"([А-ЯЁ][а-яё]+(?:-[А-ЯЁ][а-яё]+)?\s+[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?)")
+# регистр не важен только в должности, в ФИО по заглавным буквам ищутся имя и фамилия
+_POSITION = (r"(?i:Генеральный\s+директор|Исполнительный\s+директор|Директор|Руководитель"
+             r"|Президент|Управляющий|Индивидуальный\s+предприниматель|(?<!\w)ИП)")
+_SIGNATORY_FULL_RE = re.compile(
+    rf"{_POSITION}[\s:\t—–-]*"
+    r"([А-ЯЁ][а-яё]+(?:-[А-ЯЁ][а-яё]+)?)\s+([А-ЯЁ])(?:[а-яё]+|\.)\s*([А-ЯЁ])(?:[а-яё]+|\.)?")
+_SIGNATORY_INITIALS_RE = re.compile(
+    rf"{_POSITION}[\s:\t—–-]*([А-ЯЁ])\.\s*([А-ЯЁ])\.\s*([А-ЯЁ][а-яё]+(?:-[А-ЯЁ][а-яё]+)?)")
+
+
+def _normalize(text: str) -> str:
+    text = text.replace("\xa0", " ").replace("\u202f", " ")
+    for long_form, short_form in _LEGAL_FORMS.items():
+        text = re.sub(long_form, short_form, text, flags=re.IGNORECASE)
+    return text
+
+
+def _clean(value: str) -> str:
+    return value.strip(" \t;,.").strip()
+
+
+def _company_name(text: str) -> str | None:
+    for match in _NAME_RE.finditer(text):
+        name = _clean(match.group(2))
+        if "банк" not in name.lower():  # первым может встретиться банк контрагента
+            return f"{match.group(1)} «{name}»"
+    if match := _IP_RE.search(text):
+        return f"ИП {match.group(1)}"
+    return None
+
+
+def _signatory(text: str) -> str | None:
+    if match := _SIGNATORY_INITIALS_RE.search(text):
+        first, middle, surname = match.groups()
+        return f"{surname} {first}.{middle}."
+    if match := _SIGNATORY_FULL_RE.search(text):
+        surname, first, middle = match.groups()
+        return f"{surname} {first}.{middle}."
+    return None
+
+
+def _accounts(pattern: re.Pattern, text: str) -> list[str]:
+    accounts = (match.group(1).replace(" ", "") for match in pattern.finditer(text))
+    return [account for account in accounts if len(account) == 20]
+
+
+def find_requisites(text: str) -> dict[str, str]:
+    """
+    Все поля, которые удалось найти и проверить; ключи — как у Customer
+    и Bank (поля банка с префиксом bank_)
+    """
+    text = _normalize(text)
+    found: dict[str, str] = {}
+
+    for match in _INN_RE.finditer(text):
+        if inn_valid(match.group(1)):
+            found["INN"] = match.group(1)
+            if match.group(2):
+                found["KPP"] = match.group(2)
+            break
+    if "KPP" not in found:
+        if match := _KPP_RE.search(text):
+            found["KPP"] = match.group(1)
+        elif match := _OGRN_RE.search(text):  # у ИП нет КПП, в акте тогда ставится ОГРНИП
+            found["KPP"] = match.group(1)
+
+    bics = [match.group(1) for match in _BIC_RE.finditer(text)]
+    current = _accounts(_CURRENT_RE, text)
+    correspondent = _accounts(_CORRESPONDENT_RE, text)
+    # счета без подписей: по балансовому счёту 301 — корреспондентский, 40… — расчётный
+    bare = re.findall(r"(?<!\d)(\d{20})(?!\d)", text)
+    current += [account for account in bare if account.startswith("40")]
+    correspondent += [account for account in bare if account.startswith("301")]
+    for bic in bics:
+        account = next((a for a in current if account_valid(a, bic)), None)
+        if account is None:
+            continue
+        found["bank_BIC"] = bic
+        found["bank_current_account"] = account
+        corr = next((a for a in correspondent if account_valid(a, bic, correspondent=True)), None)
+        if corr is not None:
+            found["bank_corporate_account"] = corr
+        break
+
+    for pattern in (_BANK_RE, _BANK_AFTER_ACCOUNT_RE):
+        if match := pattern.search(text):
+            # «Банк: ПАО Сбербанк, БИК 044525225» — БИК и счета уже разобраны отдельно
+            name = re.split(r",?\s*(?:БИК|к\s*/\s*с|корр|ИНН)", match.group(1), flags=re.IGNORECASE)[0]
+            if _clean(name) and not _clean(name)[0].isdigit():
+                found["bank_name"] = _clean(name)
+                break
+
+    if name := _company_name(text):
+        found["name"] = name
+    for pattern in _ADDRESS_RES:
+        if match := pattern.search(text):
+            found["address"] = _clean(match.group(1))
+            break
+    if signatory := _signatory(text):
+        found["signatory"] = signatory
+    return found
+
+
+REQUIRED_FIELDS = ("name", "INN", "KPP", "address", "signatory",
+                   "bank_name", "bank_current_account", "bank_corporate_account", "bank_BIC")
+
+
+def extract_requisites(text: str) -> Customer | None:
+    """
+    Customer, если в тексте нашлись и прошли проверку все поля, иначе None;
+    InvalidDocumentData — если поля нашлись, но Customer их не принял
+    (например, пустой адрес)
+    """
+    found = find_requisites(text)
+    if any(field not in found for field in REQUIRED_FIELDS):
+        return None
+    return Customer.from_dict(found)
+
+
+def extract_customer(file: str | Path | BinaryIO) -> Customer | None:
+    """Реквизиты из файла или None, если их нужно разбирать агентом"""
+    try:
+        return extract_requisites(document_text(file))
+    except (CantReadDocument, InvalidDocumentData) as e:
+        print(e)
+        return None
@@ -0,0 +1,88 @@
+"""
+Число → русская пропись (до триллионов).
+
+Раньше пропись считал typst/ru-numbers.typ при каждой компиляции
+документа. Теперь строки готовятся один раз, когда собираются данные
+документа (totals.totals_payload), и шаблон их только печатает.
+Правила те же, что в ru-numbers.typ; совпадение проверяет
+benchmarks/ru_numbers.py.
+"""
+from functools import lru_cache
+
+
+_UNITS = (
+    "ноль", "один", "два", "три", "четыре",
+    "пять", "шесть", "семь", "восемь", "девять",
+    "десять", "одиннадцать", "двенадцать", "тринадцать", "четырнадцать",
+    "пятнадцать", "шестнадцать", "семнадцать", "восемнадцать", "девятнадцать",
+)
+
+_FEMININE = {1: "одна", 2: "две"}
+
+_TENS = (
+    "", "", "двадцать", "тридцать", "сорок",
+    "пятьдесят", "шестьдесят", "семьдесят", "восемьдесят", "девяносто",
+)
+
+_HUNDREDS = (
+    "", "сто", "двести", "триста", "четыреста",
+    "пятьсот", "шестьсот", "семьсот", "восемьсот", "девятьсот",
+)
+
+# (1-форма, 2–4-форма, 5+-форма, женский род?)
+_SCALES = (
+    ("", "", "", False),
+    ("тысяча", "тысячи", "тысяч", True),
+    ("миллион", "миллиона", "миллионов", False),
+    ("миллиард", "миллиарда", "миллиардов", False),
+    ("триллион", "триллиона", "триллионов", False),
+)
+
+RUBLES = ("рубль", "рубля", "рублей")
+
+
+def plural(n: int, one: str, few: str, many: str) -> str:
+    """Форма слова после числа: 1 рубль, 2 рубля, 5 рублей, 11 рублей"""
+    if 11 <= n % 100 <= 14:
+        return many
+    if n % 10 == 1:
+        return one
+    if 2 <= n % 10 <= 4:
+        return few
+    return many
+
+
+@lru_cache(maxsize=2000)
+def _chunk(n: int, feminine: bool) -> str:
+    """Пропись триады (1–999)"""
+    words = []
+    if n // 100:
+        words.append(_HUNDREDS[n // 100])
+    rest = n % 100
+    if rest >= 20:
+        words.append(_TENS[rest // 10])
+        rest %= 10
+    if rest:
+        words.append(_FEMININE[rest] if feminine and rest in _FEMININE else _UNITS[rest])
+    return " ".join(words)
+
+
+@lru_cache(maxsize=4096)
+def ru_words(n: int) -> str:
+    """Целое неотрицательное число прописью: 2001 → «две тысячи один»"""
+    if n < 0 or n >= 1000 ** len(_SCALES):
+        raise ValueError(f"число вне диапазона прописи: {n}")
+    if n == 0:
+        return _UNITS[0]
+    parts = []
+    for scale, (one, few, many, feminine) in enumerate(_SCALES):
+        chunk = n // 1000 ** scale % 1000
+        if chunk:
+            words = _chunk(chunk, feminine)
+            parts.append(f"{words} {plural(chunk, one, few, many)}" if scale else words)
+    return " ".join(reversed(parts))
+
+
+def rubles_in_words(rubles: int) -> str:
+    """«сто двадцать один рубль», «две тысячи рублей»"""
+    return f"{ru_words(rubles)} {plural(rubles, *RUBLES)}"
@@ -0,0 +1,345 @@
+"""
+Замеры времени по этапам (спаны), счётчики и их выгрузка.
+
+    with span("imap.fetch", messages=len(uids)) as s:
+        ...
+        s.set(bytes=size)
+
+Спаны вкладываются друг в друга (родитель берётся из contextvars), у
+всех спанов одного запроса общий trace_id — по нему видно, на каком
+этапе запрос провёл больше всего времени. Длительности копятся в
+гистограммах по имени спана, прочие величины (токены модели, попадания
+в кэш) — счётчиками count().
+
+Куда выгружать — TELEMETRY, через запятую:
+- json — каждый законченный спан строкой в .cache/telemetry/spans.jsonl;
+- prometheus — гистограммы и счётчики в текстовом формате Prometheus в
+  .cache/telemetry/metrics.prom (переписывается не чаще раза в
+  TELEMETRY_FLUSH_SECONDS и при выходе), для textfile collector;
+- otel — спаны дублируются в OpenTelemetry (нужен opentelemetry-api;
+  экспорт настраивается его SDK, например через opentelemetry-instrument).
+Без TELEMETRY спаны только считаются в памяти: prometheus_text().
+
+Сводка по файлу спанов — самые медленные этапы и запросы:
+    python telemetry.py .cache/telemetry/spans.jsonl
+"""
+import atexit
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+import functools
+import inspect
+import json
+import os
+from pathlib import Path
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator, TypeVar
+import uuid
+
+from dotenv import find_dotenv, load_dotenv
+
+
+load_dotenv(find_dotenv())
+
+SINKS = {name.strip() for name in (os.getenv("TELEMETRY") or "").split(",") if name.strip()}
+TELEMETRY_DIRECTORY = Path(os.getenv("TELEMETRY_DIRECTORY") or Path(".cache") / "telemetry")
+FLUSH_SECONDS = float(os.getenv("TELEMETRY_FLUSH_SECONDS") or 10)
+# границы корзин гистограмм длительности, с
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "gigachat_docs"
+
+F = TypeVar("F", bound=Callable)
+
+_current: ContextVar["Span | None"] = ContextVar("telemetry_span", default=None)
+
+
+def _otel_tracer():
+    if "otel" not in SINKS:
+        return None
+    try:
+        from opentelemetry import trace  # необязательная зависимость
+    except ImportError:
+        print("TELEMETRY=otel: не установлен opentelemetry-api, спаны в OpenTelemetry не попадут")
+        return None
+    return trace.get_tracer(METRIC_PREFIX)
+
+
+_tracer = _otel_tracer()
+
+
+def _otel_value(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+@dataclass
+class Span:
+    """Один замер: этап, его родитель и атрибуты"""
+    name: str
+    trace_id: str  # общий для всех спанов одного запроса
+    span_id: str
+    parent_id: str | None
+    started: float  # unix-время начала
+    attributes: dict[str, Any] = field(default_factory=dict)
+    seconds: float | None = None  # None — спан ещё не закончился
+    error: str | None = None
+    _clock: float = field(default=0.0, repr=False)
+    _otel: Any = field(default=None, repr=False)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | str | None = None) -> None:
+        if self.seconds is not None:
+            return
+        self.seconds = time.perf_counter() - self._clock
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+        if self._otel is not None:
+            self._otel.set_attributes({key: _otel_value(value) for key, value in self.attributes.items()})
+            if self.error is not None:
+                from opentelemetry.trace import Status, StatusCode
+                self._otel.set_status(Status(StatusCode.ERROR, self.error))
+            self._otel.end()
+        _collector.finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent_id, "started": self.started, "seconds": self.seconds,
+            "error": self.error, "attributes": self.attributes,
+        }
+
+
+def start_span(name: str, parent: Span | None = None, **attributes: Any) -> Span:
+    """
+    Начинает спан, не делая его текущим; закончить — span.end().
+    Для замеров, у которых начало и конец в разных местах (колбэки LangChain)
+    """
+    parent = parent or _current.get()
+    span = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        started=time.time(),
+        attributes=attributes,
+        _clock=time.perf_counter(),
+    )
+    if _tracer is not None:
+        from opentelemetry import trace
+        context = trace.set_span_in_context(parent._otel) if parent and parent._otel else None
+        span._otel = _tracer.start_span(name, context=context)
+    return span
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Замер блока кода; вложенные замеры становятся его детьми"""
+    current = start_span(name, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except GeneratorExit:  # генератор просто не дочитали — это не ошибка
+        raise
+    except BaseException as error:
+        current.end(error)
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:  # генератор закрыли в другом контексте
+            pass
+        current.end()
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """
+    Декоратор: каждый вызов функции — спан *name*. Понимает обычные и
+    асинхронные функции и генераторы (спан длится, пока генератор не исчерпан)
+    """
+    def decorator(function: F) -> F:
+        if inspect.isasyncgenfunction(function):
+            @functools.wraps(function)
+            async def async_generator(*args, **kwargs):
+                with span(name):
+                    async for item in function(*args, **kwargs):
+                        yield item
+            return async_generator  # type: ignore[return-value]
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator(*args, **kwargs):
+                with span(name):
+                    yield from function(*args, **kwargs)
+            return generator  # type: ignore[return-value]
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def coroutine(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return coroutine  # type: ignore[return-value]
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def annotate(**attributes: Any) -> None:
+    """Добавляет атрибуты текущему спану, если он есть"""
+    if (current := _current.get()) is not None:
+        current.set(**attributes)
+
+
+def propagate(function: F) -> F:
+    """
+    function, которая выполнится в копии текущего контекста: спаны из
+    потоков пула (ThreadPoolExecutor) остаются детьми текущего спана
+    """
+    context = copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # копия на каждый вызов: один контекст нельзя войти из двух потоков сразу
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper  # type: ignore[return-value]
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Счётчик *name* (в Prometheus — <prefix>_<name>_total с метками *labels*)"""
+    _collector.count(name, value, labels)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str]) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _le(bound: float) -> str:
+    return f"{bound:g}"
+
+
+class _Collector:
+    """Гистограммы длительностей, счётчики и выгрузка законченных спанов"""
+
+    def __init__(self, sinks: set[str], directory: Path):
+        self._sinks = sinks
+        self._directory = directory
+        self._lock = threading.Lock()
+        # имя спана → [по корзинам..., +Inf, сумма]
+        self._histograms: dict[str, list[float]] = {}
+        self._errors: dict[str, int] = defaultdict(int)
+        self._counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = defaultdict(float)
+        self._spans_file = None
+        self._last_flush = time.monotonic()
+
+    def finish(self, span: Span) -> None:
+        with self._lock:
+            histogram = self._histograms.setdefault(span.name, [0.0] * (len(BUCKETS) + 2))
+            for index, bound in enumerate(BUCKETS):
+                if span.seconds <= bound:  # type: ignore[operator]
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += span.seconds  # type: ignore[operator]
+            if span.error is not None:
+                self._errors[span.name] += 1
+            if "json" in self._sinks:
+                if self._spans_file is None:
+                    self._directory.mkdir(parents=True, exist_ok=True)
+                    self._spans_file = open(self._directory / "spans.jsonl", "a", encoding="utf-8")
+                self._spans_file.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                self._spans_file.flush()
+            flush = "prometheus" in self._sinks and time.monotonic() - self._last_flush >= FLUSH_SECONDS
+        if flush:
+            self.flush()
+
+    def count(self, name: str, value: float, labels: dict[str, str]) -> None:
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+            errors = dict(self._errors)
+            counters = dict(self._counters)
+        metric = f"{METRIC_PREFIX}_span_seconds"
+        lines = [f"# HELP {metric} Длительность этапов", f"# TYPE {metric} histogram"]
+        for name, values in sorted(histograms.items()):
+            for bound, value in zip(BUCKETS, values):
+                lines.append(f"{metric}_bucket{_labels({'span': name, 'le': _le(bound)})} {value:g}")
+            lines.append(f"{metric}_bucket{_labels({'span': name, 'le': '+Inf'})} {values[-2]:g}")
+            lines.append(f"{metric}_sum{_labels({'span': name})} {values[-1]:.6f}")
+            lines.append(f"{metric}_count{_labels({'span': name})} {values[-2]:g}")
+        metric = f"{METRIC_PREFIX}_span_errors_total"
+        lines += [f"# HELP {metric} Этапы, закончившиеся ошибкой", f"# TYPE {metric} counter"]
+        lines += [f"{metric}{_labels({'span': name})} {value}" for name, value in sorted(errors.items())]
+        declared = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(dict(labels)) if labels else ''} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Переписывает metrics.prom атомарно, чтобы сборщик не прочитал половину файла"""
+        self._last_flush = time.monotonic()
+        if "prometheus" not in self._sinks:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._directory / "metrics.prom"
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_text(self.prometheus_text(), encoding="utf-8")
+        os.replace(temporary, path)
+
+
+_collector = _Collector(SINKS, TELEMETRY_DIRECTORY)
+atexit.register(_collector.flush)
+
+
+def prometheus_text() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    return _collector.prometheus_text()
+
+
+def _percentile(values: list[float], q: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 \
+        else values[0]
+
+
+def summarize(path: str | Path, top: int = 10) -> None:
+    """Печатает этапы по суммарному времени и самые медленные запросы с их самым долгим этапом"""
+    spans = [json.loads(line) for line in open(path, encoding="utf-8") if line.strip()]
+    by_name: dict[str, list[float]] = defaultdict(list)
+    by_trace: dict[str, list[dict]] = defaultdict(list)
+    for item in spans:
+        by_name[item["name"]].append(item["seconds"])
+        by_trace[item["trace_id"]].append(item)
+
+    print(f"{'этап':<28}{'вызовов':>8}{'p50, мс':>10}{'p95, мс':>10}{'всего, с':>10}")
+    for name, seconds in sorted(by_name.items(), key=lambda item: -sum(item[1])):
+        print(f"{name:<28}{len(seconds):>8}{_percentile(seconds, 50) * 1000:>10.1f}"
+              f"{_percentile(seconds, 95) * 1000:>10.1f}{sum(seconds):>10.2f}")
+
+    print("\nсамые медленные запросы:")
+    roots = [next((s for s in trace if s["parent_id"] is None), max(trace, key=lambda s: s["seconds"]))
+             for trace in by_trace.values()]
+    for root in sorted(roots, key=lambda s: -s["seconds"])[:top]:
+        children = [s for s in by_trace[root["trace_id"]] if s is not root]
+        slowest = max(children, key=lambda s: s["seconds"], default=None)
+        detail = f", дольше всего {slowest['name']} {slowest['seconds']:.2f} с" if slowest else ""
+        error = f", ошибка: {root['error']}" if root["error"] else ""
+        print(f"  {root['trace_id'][:8]} {root['name']} {root['seconds']:.2f} с{detail}{error}")
+
+
+if __name__ == "__main__":
+    summarize(sys.argv[1] if len(sys.argv) > 1 else TELEMETRY_DIRECTORY / "spans.jsonl")
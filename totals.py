@@ -0,0 +1,87 @@
+"""
+Суммы документа: по строкам, итого, НДС и всего к оплате.
+
+Считается один раз здесь, в Decimal с округлением до копеек, и готовыми
+числами передаётся в шаблоны — Typst больше ничего не умножает во float.
+Ставки НДС по видам документов настраиваются через окружение:
+ACT_VAT_RATE (по умолчанию 0.15, как было в шаблоне акта) и
+INVOICE_VAT_RATE (по умолчанию пусто — «НДС не облагается»).
+"""
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+import os
+from typing import Iterable
+
+from models import Job
+from ru_numbers import rubles_in_words
+
+
+KOPECK = Decimal("0.01")
+
+
+def _rate(value: str | None) -> Decimal | None:
+    """Ставка из строки окружения: "0.2", "20%" или пусто (без НДС)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith("%"):
+        return Decimal(value[:-1]) / 100
+    return Decimal(value)
+
+
+VAT_RATES: dict[str, Decimal | None] = {
+    "act": _rate(os.getenv("ACT_VAT_RATE", "0.15")),
+    "invoice": _rate(os.getenv("INVOICE_VAT_RATE")),
+}
+
+
+def money(value: int | float | str | Decimal) -> Decimal:
+    """Сумма в рублях с копейками; float переводится через str, без двоичного хвоста"""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(KOPECK, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True, slots=True)
+class Totals:
+    amounts: tuple[Decimal, ...]  # сумма по каждой строке
+    subtotal: Decimal  # итого без НДС
+    vat_rate: Decimal | None  # None — НДС не облагается
+    vat: Decimal
+    total: Decimal  # всего к оплате
+
+
+def compute_totals(jobs: Iterable[Job], vat_rate: Decimal | None) -> Totals:
+    """НДС начисляется сверху на итог, как в шаблоне акта"""
+    amounts = tuple(money(money(job.price) * Decimal(str(job.count))) for job in jobs)
+    subtotal = sum(amounts, Decimal("0.00"))
+    vat = money(subtotal * vat_rate) if vat_rate is not None else Decimal("0.00")
+    return Totals(amounts, subtotal, vat_rate, vat, subtotal + vat)
+
+
+def format_money(value: Decimal) -> str:
+    """Для num() в шаблоне: целые рубли без копеек, иначе с двумя знаками"""
+    return str(value.to_integral_value()) if value == value.to_integral_value() else str(value)
+
+
+def _rubles_and_kopecks(value: Decimal) -> tuple[int, str]:
+    rubles, kopecks = divmod(value.quantize(KOPECK) * 100, 100)
+    return int(rubles), f"{int(kopecks):02d}"
+
+
+def totals_payload(totals: Totals) -> dict:
+    """Суммы в том виде, в каком их читают шаблоны"""
+    total_rubles, total_kopecks = _rubles_and_kopecks(totals.total)
+    vat_rubles, vat_kopecks = _rubles_and_kopecks(totals.vat)
+    return {
+        "subtotal": format_money(totals.subtotal),
+        "vat": format_money(totals.vat),
+        "vat_percent": (format_money(totals.vat_rate * 100)
+                        if totals.vat_rate is not None else None),
+        "total": format_money(totals.total),
+        # пропись готовится здесь, а не в шаблоне: «... рублей» + копейки цифрами
+        "total_words": rubles_in_words(total_rubles),
+        "total_kopecks": total_kopecks,
+        "vat_words": rubles_in_words(vat_rubles),
+        "vat_kopecks": vat_kopecks,
+    }
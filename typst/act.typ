@@ -1,11 +1,9 @@
-#import "ru-numbers.typ": ru-words
 #import "@preview/zero:0.3.3": num, set-group
 #set-group(size: 3, separator: sym.space.thin, threshold: 4)
 
-#let act = json("act.json")
-#let act_sum = act.jobs.map(job => float(job.at("count")) * float(job.at("price"))).sum()
-#let act_nds = act_sum * 0.15  // НДС 18%
-#let act_total = act_sum + act_nds
+#let act = json(sys.inputs.at("data", default: "act.json"))
+// суммы и НДС посчитаны заранее в totals.py
+#let totals = act.totals
 
 = Акт выполненных работ (оказания услуг)
 
@@ -42,24 +40,28 @@
     ], [
       #job.at("count")
     ], [
-      #num(float(job.at("price")))
+      #num(job.at("price"))
     ], [
-      #num(float(job.at("count")) * float(job.at("price")))
+      #num(job.at("amount"))
     ]
   )}
 )
 
 #align(right)[
-  #text(weight: "bold")[Итого:] #num(act_sum)
+  #text(weight: "bold")[Итого:] #num(totals.subtotal)
   #linebreak()
-  #text(weight: "bold")[В том числе НДС (15%):] #num(act_nds)
+  #if totals.vat_percent != none [
+    #text(weight: "bold")[В том числе НДС (#totals.vat_percent%):] #num(totals.vat)
+  ] else [
+    #text(weight: "bold")[НДС:] не облагается
+  ]
   #linebreak()
-  #text(weight: "bold")[Всего (с учетом НДС):] #num(act_total)
+  #text(weight: "bold")[Всего (с учетом НДС):] #num(totals.total)
 ]
 
-Всего оказано услуг на сумму (с НДС): #text(weight: "bold")[#ru-words(int(act_total))] рублей 00 коп.
+Всего оказано услуг на сумму (с НДС): #text(weight: "bold")[#totals.total_words] #totals.total_kopecks коп.
 #linebreak()
-в т.ч. НДС — #text(weight: "bold")[#ru-words(int(act_nds))] рублей 00 коп.
+в т.ч. НДС — #text(weight: "bold")[#totals.vat_words] #totals.vat_kopecks коп.
 
 Вышеперечисленные работы (услуги) выполнены полностью и в срок. Заказчик претензий по объему, качеству и срокам оказания услуг не имеет.
 
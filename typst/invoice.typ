@@ -1,10 +1,10 @@
-#import "ru-numbers.typ": ru-words
 #import "@preview/zero:0.3.3": num, set-group
 #set-group(size: 3, separator: sym.space.thin, threshold: 4)
 
-#let invoice = json("invoice.json")
+#let invoice = json(sys.inputs.at("data", default: "invoice.json"))
 
-#let invoice_overall_sum = invoice.jobs.map(job => job.at("price") * job.at("count")).sum()
+// суммы и НДС посчитаны заранее в totals.py
+#let totals = invoice.totals
 #let invoice_jobs_count = invoice.jobs.len()
 
 #let get_invoice_number(
@@ -63,15 +63,19 @@
     ], table.cell(align: center)[шт], table.cell(align: center)[#num(job.at("count"))], table.cell(align: center)[
       #align(center)[#num(job.at("price"))]
     ],table.cell(align: center)[
-      #align(center)[#num(invoice_overall_sum)]
+      #align(center)[#num(job.at("amount"))]
     ]
   )},
-  table.cell(colspan: 5, stroke: none, align: right)[*Итого:*], table.cell(align: center)[#num(invoice_overall_sum)],
-  table.cell(colspan: 5, stroke: none, align: right)[*НДС:*], table.cell(align: center)[не облагается],
-  table.cell(colspan: 5, stroke: none, align: right)[*Всего к оплате:*], table.cell(align: center)[#num(invoice_overall_sum)],
+  table.cell(colspan: 5, stroke: none, align: right)[*Итого:*], table.cell(align: center)[#num(totals.subtotal)],
+  ..if totals.vat_percent != none {(
+    table.cell(colspan: 5, stroke: none, align: right)[*НДС (#totals.vat_percent%):*], table.cell(align: center)[#num(totals.vat)],
+  )} else {(
+    table.cell(colspan: 5, stroke: none, align: right)[*НДС:*], table.cell(align: center)[не облагается],
+  )},
+  table.cell(colspan: 5, stroke: none, align: right)[*Всего к оплате:*], table.cell(align: center)[#num(totals.total)],
 )
 
-Всего наименований #invoice_jobs_count , на сумму #num(invoice_overall_sum) (#ru-words(invoice_overall_sum)) руб ноль копеек. Оплачивая настоящий счёт, вы присоединяетесь к Оферте, опубликованной на сайте https://to.digital/oferta.pdf.
+Всего наименований #invoice_jobs_count , на сумму #num(totals.total) (#totals.total_words #totals.total_kopecks коп.). Оплачивая настоящий счёт, вы присоединяетесь к Оферте, опубликованной на сайте https://to.digital/oferta.pdf.
 
 #block(above: 3em)[
   ИП Смоляк #text("__________________________") Смоляк П.В.
@@ -1,5 +1,7 @@
 // --------------------------------------------------------------
 // Число → русская пропись (до миллиардов). Typst 0.12+
+// Шаблоны документов его больше не импортируют: пропись готовит
+// ru_numbers.py. Файл оставлен эталоном для benchmarks/ru_numbers.py
 // --------------------------------------------------------------
 
 #import calc: rem, floor    // rem — остаток; floor — целая часть
@@ -0,0 +1,112 @@
+"""
+Кэш загруженных в GigaChat файлов: sha256 содержимого → id файла.
+
+Одни и те же реквизиты загружаются при каждом запуске act_generate.py
+и при каждом перезапуске страницы Streamlit. Кэш лежит в
+.cache/uploads.sqlite и переживает перезапуски: если файл с таким же
+содержимым уже загружали тем же аккаунтом и запись не устарела
+(GIGACHAT_FILE_TTL_HOURS), повторно он не загружается.
+
+Если GigaChat отказался принимать id из кэша (файл удалили на стороне
+сервиса), запись сбрасывается через invalidate, и файл загружается заново.
+"""
+import hashlib
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+from dotenv import find_dotenv, load_dotenv
+
+
+load_dotenv(find_dotenv())
+
+UPLOAD_CACHE_PATH = Path(".cache") / "uploads.sqlite"
+# сколько часов считаем загруженный файл живым на стороне GigaChat
+UPLOAD_TTL_HOURS = float(os.getenv("GIGACHAT_FILE_TTL_HOURS") or 24)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    uploaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_file_id ON uploads (file_id);
+"""
+
+
+def upload_key(data: bytes, account: str = "") -> str:
+    """
+    Ключ кэша: sha256 содержимого, а для непустого *account* — ещё и
+    хэш учётных данных, ведь id файла действителен только в своём аккаунте
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if not account:
+        return digest
+    return f"{hashlib.sha256(account.encode('utf-8')).hexdigest()[:16]}:{digest}"
+
+
+def model_account(model: object) -> str:
+    """Учётные данные модели: id файлов у разных аккаунтов разные"""
+    return (getattr(model, "credentials", None)
+            or getattr(model, "user", None)
+            or os.getenv("GIGACHAT_CREDENTIALS") or "")
+
+
+class UploadCache:
+    """
+    Ключ содержимого → id загруженного файла, с истечением по времени.
+
+    Кэшем пользуются сразу несколько процессов (act_generate.py, app.py и
+    демон watcher.py), поэтому он в SQLite: каждое изменение — отдельная
+    запись в базе, чужие id не затираются.
+    """
+
+    def __init__(self, path: str | Path = UPLOAD_CACHE_PATH,
+                 ttl_hours: float = UPLOAD_TTL_HOURS):
+        self.path = Path(path)
+        self.ttl = ttl_hours * 3600
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """База открывается при первом обращении, а не при импорте модуля"""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        """id файла или None, если не загружали или запись устарела"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT file_id FROM uploads WHERE key = ? AND uploaded_at >= ?",
+                (key, time.time() - self.ttl)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, file_id: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO uploads (key, file_id, uploaded_at) VALUES (?, ?, ?)",
+                         (key, file_id, now))
+            # протухшие записи выбрасываем заодно, чтобы база не росла бесконечно
+            conn.execute("DELETE FROM uploads WHERE uploaded_at < ?", (now - self.ttl,))
+
+    def invalidate(self, file_id: str) -> bool:
+        """Забывает id, который отверг GigaChat; True, если он был в кэше"""
+        with self._lock:
+            return self._connection().execute("DELETE FROM uploads WHERE file_id = ?", (file_id,)).rowcount > 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+upload_cache = UploadCache()
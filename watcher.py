@@ -0,0 +1,468 @@
+"""
+Фоновый режим: следит за почтой и заранее готовит карточки предприятий.
+
+Раньше всё делалось, только когда запускали act_generate.py: он искал
+письма за два дня, скачивал вложение, разбирал реквизиты, а если
+правила не справлялись — загружал файл в GigaChat. Демон делает это
+заранее, по мере прихода писем:
+
+- одно IMAP-соединение ждёт новых писем командой IDLE; если сервер её
+  не умеет, раз в WATCH_POLL_SECONDS спрашивает NOOP;
+- у новых писем качаются только ENVELOPE и BODYSTRUCTURE, вложения,
+  которые можно разобрать (docx, pdf, txt), ранжируются mail_ranking.py
+  и кладутся в очередь — самые похожие на карточку обрабатываются первыми;
+- очередь лежит в SQLite (.cache/watcher.sqlite) и переживает
+  перезапуск: задачи, прерванные падением, возвращаются в очередь,
+  неудачные повторяются до WATCH_MAX_ATTEMPTS раз, с паузой
+  WATCH_RETRY_SECONDS, которая удваивается с каждой попыткой;
+- рабочие потоки скачивают вложение и разбирают реквизиты правилами
+  (requisites.py); если не вышло, а файл похож на карточку, загружают
+  его в GigaChat через кэш upload_cache.py — агенту достанется готовый id.
+
+act_generate.py сначала предлагает пользователю карточку из самого
+свежего письма, подготовленную демоном (latest_prepared); если её
+принять, в почту он не ходит вовсе.
+
+Запуск из корня проекта:
+    python watcher.py                # с предзагрузкой в GigaChat
+    python watcher.py --no-upload    # только скачивать и разбирать
+"""
+import argparse
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+import imaplib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+from dotenv import find_dotenv, load_dotenv
+
+from attachment_text import CantReadDocument, document_text
+from mail import (CantReadEmail, CantSearchEmails, EmailHeader, ImapPool, download_attachment,
+                  fetch_headers, idle, read_uid_validity, search_after, supports_idle)
+from mail_ranking import CANDIDATE_MAX_BYTES, EXTENSION_SCORES, QUERY, Candidate, MailIndex
+from models import InvalidDocumentData
+from requisites import extract_requisites, find_requisites
+from telemetry import count, span
+from upload_cache import UploadCache, model_account, upload_cache, upload_key
+
+
+load_dotenv(find_dotenv())
+WATCH_DB = Path(os.getenv("WATCH_DB") or Path(".cache") / "watcher.sqlite")
+# Сколько потоков скачивают и разбирают вложения
+WATCH_WORKERS = int(os.getenv("WATCH_WORKERS") or 2)
+# Сколько ждать в IDLE, прежде чем переспросить сервер (RFC 2177 советует меньше 29 минут)
+WATCH_IDLE_SECONDS = float(os.getenv("WATCH_IDLE_SECONDS") or 300)
+# Как часто спрашивать сервер без IDLE
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS") or 60)
+# За сколько суток разобрать почту при первом запуске
+WATCH_BACKFILL_DAYS = int(os.getenv("WATCH_BACKFILL_DAYS") or 2)
+WATCH_MAX_ATTEMPTS = int(os.getenv("WATCH_MAX_ATTEMPTS") or 3)
+# Пауза перед повтором неудачной задачи, с; удваивается с каждой попыткой
+WATCH_RETRY_SECONDS = float(os.getenv("WATCH_RETRY_SECONDS") or 60)
+# Сколько суток хранить обработанные задачи
+WATCH_KEEP_DAYS = float(os.getenv("WATCH_KEEP_DAYS") or 7)
+# Пауза перед переподключением после сетевой ошибки, с
+RECONNECT_SECONDS = 10.0
+
+# pending → running → ready | uploaded | skipped | failed
+PREPARED_STATUSES = ("ready", "uploaded")
+# UIDVALIDITY, которую демон видел последней, — подзапрос для SQL
+CURRENT_UID_VALIDITY = "(SELECT CAST(value AS INTEGER) FROM watcher_state WHERE key = 'uid_validity')"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    uid_validity INTEGER NOT NULL,
+    uid TEXT NOT NULL,
+    part TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    date TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    score REAL NOT NULL,
+    named INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    path TEXT,
+    customer TEXT,
+    file_id TEXT,
+    error TEXT,
+    retry_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (uid_validity, uid, part)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, score);
+CREATE TABLE IF NOT EXISTS watcher_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class Job:
+    """Вложение в очереди подготовки"""
+    id: int
+    uid: str  # UID письма
+    part: str  # номер MIME-части вложения
+    filename: str
+    subject: str  # тема письма
+    date: str  # дата письма
+    size: int
+    score: float  # балл mail_ranking.py по заголовкам
+    named: bool  # имя файла или тема письма похожи на реквизиты
+    status: str = "pending"
+    attempts: int = 0
+    path: str | None = None  # скачанный файл
+    customer: dict | None = None  # реквизиты, если их разобрали правила
+    file_id: str | None = None  # id файла в GigaChat, если правила не справились
+    error: str | None = None
+
+
+def _job(row: sqlite3.Row) -> Job:
+    return Job(row["id"], row["uid"], row["part"], row["filename"], row["subject"], row["date"],
+               row["size"], row["score"], bool(row["named"]), row["status"], row["attempts"],
+               row["path"], json.loads(row["customer"]) if row["customer"] else None,
+               row["file_id"], row["error"])
+
+
+def _prepared(conn: sqlite3.Connection, max_age_hours: float | None, limit: int) -> list[Job]:
+    since = time.time() - max_age_hours * 3600 if max_age_hours else 0
+    rows = conn.execute(
+        f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(PREPARED_STATUSES))}) "
+        f"AND created_at >= ? ORDER BY uid_validity = {CURRENT_UID_VALIDITY} DESC, "
+        "CAST(uid AS INTEGER) DESC, status = 'ready' DESC, score DESC LIMIT ?",
+        (*PREPARED_STATUSES, since, limit)).fetchall()
+    return [_job(row) for row in rows]
+
+
+class WorkQueue:
+    """
+    Очередь вложений в SQLite. Берут из неё потоки одного процесса,
+    поэтому соединение одно, а доступ сериализует _lock; читать её
+    (latest_prepared) можно и из другого процесса — база в режиме WAL.
+    """
+
+    def __init__(self, path: str | Path = WATCH_DB, max_attempts: int = WATCH_MAX_ATTEMPTS,
+                 retry_seconds: float = WATCH_RETRY_SECONDS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._added = threading.Condition(self._lock)
+
+    def get_state(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM watcher_state WHERE key = ?", (key,)).fetchone()
+            return row["value"] if row else None
+
+    def set_state(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO watcher_state (key, value) VALUES (?, ?)",
+                               (key, value))
+
+    def put(self, uid_validity: int, candidates: list[Candidate]) -> int:
+        """Добавляет вложения; уже известные пропускаются. Возвращает, сколько добавлено"""
+        now = time.time()
+        with self._added:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (uid_validity, uid, part, filename, subject, date, size, "
+                "score, named, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(uid_validity, c.uid, c.part, c.filename, c.subject, c.date, c.size, c.score,
+                  any(stem in QUERY for stem in c.matches), now, now) for c in candidates])
+            added = self._conn.total_changes - before
+            if added:
+                self._added.notify_all()
+        return added
+
+    def fail_stale(self, uid_validity: int) -> int:
+        """Закрывает незавершённые задачи из другой UIDVALIDITY: их UID больше ничего не значат"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'UIDVALIDITY сменился', updated_at = ? "
+                "WHERE status = 'pending' AND uid_validity != ?", (time.time(), uid_validity)).rowcount
+
+    def recover(self) -> int:
+        """Возвращает в очередь задачи, прерванные прошлым запуском"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'pending' WHERE status = 'running'").rowcount
+
+    def take(self, timeout: float) -> Job | None:
+        """
+        Самая похожая на карточку задача из очереди или None, если за
+        *timeout* ничего не пришло. Отложенные повторы ждут своего retry_at;
+        задачи из прежней UIDVALIDITY не выдаются: их UID теперь указывают
+        на другие письма.
+        """
+        deadline = time.monotonic() + timeout
+        with self._added:
+            while True:
+                row = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE status = 'pending' AND retry_at <= ? "
+                    f"AND uid_validity = {CURRENT_UID_VALIDITY} ORDER BY score DESC, id LIMIT 1",
+                    (time.time(),)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                        "WHERE id = ?", (time.time(), row["id"]))
+                    job = _job(row)
+                    job.status, job.attempts = "running", job.attempts + 1
+                    return job
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # проснуться к ближайшему отложенному повтору, даже если новых задач нет
+                next_retry = self._conn.execute(
+                    "SELECT MIN(retry_at) FROM jobs WHERE status = 'pending' "
+                    f"AND uid_validity = {CURRENT_UID_VALIDITY}").fetchone()[0]
+                if next_retry is not None:
+                    remaining = min(remaining, max(next_retry - time.time(), 0.01))
+                self._added.wait(remaining)
+
+    def finish(self, job: Job) -> None:
+        """
+        Сохраняет результат; неудачная задача возвращается в очередь, пока
+        есть попытки, но не раньше чем через retry_seconds · 2^(попытка − 1)
+        """
+        now, retry_at = time.time(), 0.0
+        if job.status == "failed" and job.attempts < self.max_attempts:
+            job.status = "pending"
+            retry_at = now + self.retry_seconds * 2 ** (job.attempts - 1)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, path = ?, customer = ?, file_id = ?, error = ?, "
+                "retry_at = ?, updated_at = ? WHERE id = ?",
+                (job.status, job.path,
+                 json.dumps(job.customer, ensure_ascii=False) if job.customer else None,
+                 job.file_id, job.error, retry_at, now, job.id))
+
+    def prepared(self, max_age_hours: float | None = None, limit: int = 10) -> list[Job]:
+        """
+        Подготовленные вложения от самого нового письма к старым (по UID в
+        текущей UIDVALIDITY); в одном письме разобранные правилами — первыми
+        """
+        with self._lock:
+            return _prepared(self._conn, max_age_hours, limit)
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def prune(self, keep_days: float = WATCH_KEEP_DAYS) -> int:
+        """Удаляет обработанные задачи и задачи из прежней UIDVALIDITY старше *keep_days* суток"""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE (status NOT IN ('pending', 'running') "
+                f"OR uid_validity != {CURRENT_UID_VALIDITY}) AND updated_at < ?",
+                (time.time() - keep_days * 86400,)).rowcount
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def latest_prepared(path: str | Path = WATCH_DB, max_age_hours: float = 48) -> Job | None:
+    """
+    Вложение из самого свежего письма среди подготовленных демоном за
+    *max_age_hours* или None, если демон не запускался или ничего не нашёл
+    """
+    if not Path(path).exists():
+        return None
+    # только чтение: схему создаёт и меняет сам демон
+    conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        prepared = _prepared(conn, max_age_hours, limit=1)
+    except sqlite3.OperationalError:  # база ещё без таблиц
+        return None
+    finally:
+        conn.close()
+    return prepared[0] if prepared else None
+
+
+class Watcher:
+    """
+    Следит за INBOX и готовит вложения. *model* — модель GigaChat для
+    предзагрузки файлов; без неё вложения только скачиваются и разбираются.
+    """
+
+    def __init__(self, queue: WorkQueue, save_attachments_directory: str = "attachments",
+                 workers: int = WATCH_WORKERS, model: object | None = None,
+                 uploads: UploadCache = upload_cache,
+                 idle_seconds: float = WATCH_IDLE_SECONDS,
+                 poll_seconds: float = WATCH_POLL_SECONDS):
+        self.queue = queue
+        self.directory = save_attachments_directory
+        self.workers = workers
+        self.model = model
+        self.uploads = uploads
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self.stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+        # вложения качают рабочие потоки, соединений нужно по одному на поток
+        self.pool = ImapPool(workers)
+
+    # ── почта ─────────────
+
+    def enqueue(self, uid_validity: int, headers: list[EmailHeader]) -> int:
+        """Кладёт в очередь вложения писем, которые можно разобрать"""
+        index = MailIndex()
+        for header in headers:
+            index.add_header(header)
+        candidates = [candidate for candidate in index.rank(len(index.candidates))
+                      if candidate.size <= CANDIDATE_MAX_BYTES
+                      and Path(candidate.filename).suffix.lower() in EXTENSION_SCORES]
+        added = self.queue.put(uid_validity, candidates)
+        count("watcher_jobs_enqueued", added)
+        return added
+
+    def poll(self, pool: ImapPool) -> int:
+        """Один проход: новые письма после запомненного UID — в очередь"""
+        with pool.connection() as imap:
+            uid_validity = read_uid_validity(imap)
+            last_uid = self.queue.get_state("last_uid")
+            if last_uid is None or self.queue.get_state("uid_validity") != str(uid_validity):
+                # первый запуск или папку пересоздали: разбираем последние дни
+                stale = self.queue.fail_stale(uid_validity)
+                if stale:
+                    print(f"UIDVALIDITY сменился, снято задач: {stale}")
+                since = datetime.now(timezone.utc) - timedelta(days=WATCH_BACKFILL_DAYS)
+                uids = search_after(imap, 0, since)
+            else:
+                uids = search_after(imap, int(last_uid))
+        added = self.enqueue(uid_validity, fetch_headers(pool, uids)) if uids else 0
+        self.queue.set_state("uid_validity", str(uid_validity))
+        if uids:
+            self.queue.set_state("last_uid", max(uids, key=int).decode())
+        elif last_uid is None:
+            self.queue.set_state("last_uid", "0")
+        return added
+
+    def wait_for_mail(self, pool: ImapPool) -> None:
+        with pool.connection() as imap:
+            if supports_idle(imap):
+                idle(imap, self.idle_seconds)
+            else:
+                self.stopped.wait(self.poll_seconds)
+                imap.noop()
+
+    def watch(self) -> None:
+        """Цикл наблюдения; сетевые ошибки не останавливают демон, а ведут к переподключению"""
+        while not self.stopped.is_set():
+            try:
+                with ImapPool(1) as pool:
+                    while not self.stopped.is_set():
+                        added = self.poll(pool)
+                        if added:
+                            print(f"в очереди новых вложений: {added}")
+                        self.queue.prune()
+                        self.wait_for_mail(pool)
+            except (imaplib.IMAP4.error, OSError, CantSearchEmails, CantReadEmail) as e:
+                print(f"почта недоступна ({e}), переподключение через {RECONNECT_SECONDS:.0f} с")
+                self.stopped.wait(RECONNECT_SECONDS)
+
+    # ── обработка ─────────────
+
+    def _upload(self, path: str) -> str:
+        """Загружает файл в GigaChat через общий кэш id, как LLMAgent.upload_file"""
+        data = Path(path).read_bytes()
+        key = upload_key(data, model_account(self.model))
+        file_id = self.uploads.get(key)
+        if file_id is None:
+            file_id = self.model.upload_file((Path(path).name, data)).id_  # type: ignore
+            self.uploads.put(key, file_id)
+        return file_id
+
+    def prepare(self, job: Job) -> Job:
+        """Скачивает вложение, разбирает реквизиты, при необходимости загружает в GigaChat"""
+        with span("watcher.prepare", filename=job.filename, attempt=job.attempts) as preparing:
+            try:
+                job.path = str(download_attachment(job.uid, job.part, self.directory, pool=self.pool))
+                text = document_text(job.path)
+                try:
+                    customer = extract_requisites(text)
+                except InvalidDocumentData:  # поля нашлись, но не прошли проверку — разберёт агент
+                    customer = None
+                if customer is not None:
+                    job.status, job.customer = "ready", asdict(customer)
+                elif self.model is not None and (job.named or len(find_requisites(text)) >= 2):
+                    job.status, job.file_id = "uploaded", self._upload(job.path)
+                else:
+                    job.status = "skipped"
+                job.error = None
+            except CantReadDocument as e:
+                job.status, job.error = "skipped", str(e)
+            except Exception as e:  # IMAP, диск, GigaChat: демон не должен терять рабочий поток
+                job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            preparing.set(status=job.status)
+        count("watcher_jobs", status=job.status)
+        self.queue.finish(job)
+        return job
+
+    def work(self) -> None:
+        while not self.stopped.is_set():
+            job = self.queue.take(timeout=1.0)
+            if job is not None:
+                self.prepare(job)
+
+    # ── запуск ─────────────
+
+    def start(self) -> "Watcher":
+        """Запускает рабочие потоки и наблюдение за почтой в фоне"""
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"возвращено в очередь после перезапуска: {recovered}")
+        self._threads = [threading.Thread(target=self.work, name=f"watcher-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self.watch, name="watcher-imap", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Останавливает потоки; соединение в IDLE закроется при выходе из процесса"""
+        self.stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--attachments", default="attachments", help="куда скачивать вложения")
+    parser.add_argument("--workers", type=int, default=WATCH_WORKERS)
+    parser.add_argument("--no-upload", action="store_true",
+                        help="не загружать в GigaChat то, что не разобрали правила")
+    args = parser.parse_args()
+
+    model = None
+    if not args.no_upload:
+        from langchain_gigachat.chat_models import GigaChat
+        model = GigaChat(model="GigaChat-2-Max", verify_ssl_certs=False)
+
+    queue = WorkQueue()
+    watcher = Watcher(queue, args.attachments, args.workers, model).start()
+    print(f"слежу за почтой, очередь — {WATCH_DB}; Ctrl+C — выход")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"очередь: {queue.counts()}")
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()